@@ -330,6 +330,7 @@ html_content='''
                     -->
                     <div class="control-group">
                         <h2>Current Value: <span id="csv-value">Loading...</span></h2>
+                        <p>Zone Pumps: <span id="pump-value">-</span></p>
                         <h3>Large Tank: Pump Controls</h3>
                         <div class="button-group">
                             <button onclick="pumpON()">ON</button>
@@ -354,6 +355,8 @@ html_content='''
                         <h2 class="title">Mode Controls</h2>
                     </div>
                     <div class="control-group">                       
+                        <p>Mode: <span id="mode-value">-</span> | Heading: <span id="heading-value">-</span> | E-Stop: <span id="estop-value">-</span></p>
+                        <p>Cross-track: <span id="cross-track-value">-</span> m | Remaining: <span id="remaining-value">-</span> m</p>
                         <div class="button-group">
                             <button onclick="setMode('basic_movement')">Basic Movement</button>
                             <button onclick="setMode('auto_navigation')">Auto-Navigation</button>
@@ -420,22 +423,6 @@ html_content='''
         var plannedPath = null;
         var gpsData = [];
 
-    async function fetchCSVValue() {
-      try {
-        const response = await fetch('moisture_data.csv'); // URL to your CSV
-        const data = await response.text();
-        const rows = data.trim().split('\n');
-        const latestRow = rows[1]; // skip header
-        const value = latestRow.split(',')[1];
-        document.getElementById('csv-value').textContent = value;
-      } catch (error) {
-        document.getElementById('csv-value').textContent = 'Error';
-        console.error('CSV fetch error:', error);
-      }
-    }
-
-    fetchCSVValue();
-
         // Emergency Controls
         function sendEStop() {
             fetch('/estop', { method: 'POST' })
@@ -714,6 +701,7 @@ html_content='''
             if (pathPolyline) {
                 map.removeLayer(pathPolyline);
                 pathPolyline = null;
+                fetchTrack();
             }
         }
 
@@ -747,32 +735,101 @@ html_content='''
                 robotMarker.setLatLng([initialLat, initialLon]);
             });
 
-        // Update robot position and heading periodically
-        setInterval(function() {
-            fetch('/get_gps_data')
+        // Track path. The server simplifies the track for the current zoom
+        // level; settled vertices after gpsCursor are appended and the
+        // provisional tail is replaced on every update.
+        var gpsCursor = -1;
+        var gpsCoordinates = [];
+        var gpsTail = [];
+        var trackFetching = false;
+        var trackStale = false;
+        function trackLatLng(point) {
+            return [point.Estimated_Lat || point.GPS_Lat, point.Estimated_Lon || point.GPS_Lon];
+        }
+        function fetchTrack() {
+            if (trackFetching) {
+                // One request at a time; fetch again when this one finishes
+                trackStale = true;
+                return;
+            }
+            trackFetching = true;
+            trackStale = false;
+            if (!pathPolyline) {
+                // Path was cleared; fetch the whole track again
+                gpsCursor = -1;
+            }
+            fetch('/get_gps_data?since=' + encodeURIComponent(gpsCursor) + '&zoom=' + map.getZoom())
                 .then(response => response.json())
                 .then(data => {
-                    if (data && data.length > 0) {
-                        gpsData = data;
-                        var gpsCoordinates = data.map(function(point) {
-                            return [point.Estimated_Lat || point.GPS_Lat, point.Estimated_Lon || point.GPS_Lon];
-                        });
-
-                        var latestPosition = gpsCoordinates[gpsCoordinates.length - 1];
-                        robotMarker.setLatLng(latestPosition);
-
-                        var heading = data[data.length - 1].Estimated_Theta || data[data.length - 1].Heading || 0;
-                        robotMarker.setRotationAngle(heading);
+                    if (data.reset) {
+                        gpsData = [];
+                        gpsCoordinates = [];
+                    }
+                    gpsCursor = data.cursor;
+                    Array.prototype.push.apply(gpsData, data.points);
+                    Array.prototype.push.apply(gpsCoordinates, data.points.map(trackLatLng));
+                    gpsTail = data.tail.map(trackLatLng);
 
+                    var path = gpsCoordinates.concat(gpsTail);
+                    if (path.length > 0) {
                         if (pathPolyline) {
-                            pathPolyline.setLatLngs(gpsCoordinates);
+                            pathPolyline.setLatLngs(path);
                         } else {
-                            pathPolyline = L.polyline(gpsCoordinates, {color: 'blue'}).addTo(map);
+                            pathPolyline = L.polyline(path, {color: 'blue'}).addTo(map);
                         }
                     }
                 })
-                .catch(error => console.error('Error fetching GPS data:', error));
-        }, 1000);
+                .catch(error => console.error('Error fetching GPS data:', error))
+                .finally(() => {
+                    trackFetching = false;
+                    if (trackStale) {
+                        fetchTrack();
+                    }
+                });
+        }
+        map.on('zoomend', function() {
+            // Different level of detail; fetch the whole track again
+            gpsCursor = -1;
+            fetchTrack();
+        });
+
+        // Live telemetry pushed by the server; only changed fields are sent
+        var telemetrySource = new EventSource('/telemetry_stream');
+        telemetrySource.onmessage = function(event) {
+            var update = JSON.parse(event.data);
+            if ('pose' in update) {
+                robotMarker.setLatLng([update.pose.lat, update.pose.lon]);
+                robotMarker.setRotationAngle(update.pose.heading || 0);
+            }
+            if ('track_seq' in update) {
+                fetchTrack();
+            }
+            if ('heading' in update) {
+                document.getElementById('heading-value').textContent = update.heading.toFixed(1);
+            }
+            if ('mode' in update) {
+                document.getElementById('mode-value').textContent = update.mode.replace('_', ' ');
+            }
+            if ('e_stop' in update) {
+                document.getElementById('estop-value').textContent = update.e_stop ? 'ACTIVE' : 'off';
+            }
+            if ('path_progress' in update) {
+                document.getElementById('cross-track-value').textContent = update.path_progress.cross_track.toFixed(2);
+                document.getElementById('remaining-value').textContent = update.path_progress.remaining.toFixed(1);
+            }
+            if ('moisture' in update) {
+                document.getElementById('csv-value').textContent = update.moisture.value;
+            }
+            if ('pumps' in update) {
+                document.getElementById('pump-value').textContent = Object.keys(update.pumps)
+                    .map(zone => zone + ': ' + (update.pumps[zone] ? 'ON' : 'off')).join(', ');
+            }
+        };
+        telemetrySource.onerror = function() {
+            // EventSource reconnects by itself and receives the full state again
+            console.error('Telemetry stream interrupted; reconnecting');
+        };
+        fetchTrack();
     </script>
 </body>
 </html>
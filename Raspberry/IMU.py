@@ -1,72 +1,358 @@
-import smbus
-bus = smbus.SMBus(1)
 from LSM9DS0 import *
 from LSM9DS1 import *
 from LSM6DSL import *
 from LIS3MDL import *
+import os
+import json
 import time
+import struct
+import numpy as np
+
+
+I2C_BUS = 1
+
+
+def openBus(spec=None):
+    #IMU_BUS selects the I2C backend, see fake_smbus.py:
+    #  unset                  /dev/i2c-1 through smbus
+    #  fake:<chip>            emulated lsm9ds0, lsm9ds1 or lsm6dsl register map
+    #  replay:<trace.jsonl>   trace recorded on the robot with IMU_RECORD=<trace.jsonl>
+    if spec is None:
+        spec = os.environ.get('IMU_BUS', '')
+    if spec.startswith('fake:'):
+        from fake_smbus import FakeSMBus
+        return FakeSMBus(spec[len('fake:'):])
+    if spec.startswith('replay:'):
+        from fake_smbus import ReplaySMBus
+        return ReplaySMBus(spec[len('replay:'):])
+
+    import smbus
+    real_bus = smbus.SMBus(I2C_BUS)
+    if os.environ.get('IMU_RECORD'):
+        from fake_smbus import RecordingSMBus
+        return RecordingSMBus(real_bus, os.environ['IMU_RECORD'])
+    return real_bus
+
+
+bus = openBus()
 
 
 
 
 BerryIMUversion = 99
 
+#Driver object for the detected IMU, set by detectIMU()
+driver = None
+
+
+#Setting the MSB of the register address enables address auto-increment on the
+#LSM9DS0 and on the LSM9DS1/LIS3MDL magnetometers. The LSM9DS1 accel/gyro uses
+#IF_ADD_INC in CTRL_REG8 (on by default) and the LSM6DSL uses IF_INC in CTRL3_C.
+AUTO_INCREMENT = 0x80
+
 
+def blockReader(bus,device_address,register):
+    #Build a reader for the six output bytes (X, Y and Z, low byte first) of one sensor.
+    #Everything the read needs is bound here, so a call is one I2C transaction and an unpack.
+    read = bus.read_i2c_block_data
+    unpack = struct.Struct('<hhh').unpack
+    to_bytes = bytes
+    def readBlock():
+        return unpack(to_bytes(read(device_address, register, 6)))
+    return readBlock
 
 
 
-def detectIMU():
+
+class BerryIMUv1:
+    #BerryIMUv1 uses the LSM9DS0
+    version = 1
+    ACC_GAIN = 0.000244     #g/LSB at +/- 8g
+    GYR_GAIN = 0.070        #dps/LSB at 2000 dps
+    MAG_GAIN = 0.00048      #gauss/LSB at +/- 12 gauss
+    GYR_SIGN = 1            #Gyro axes point the same way as the accelerometer axes
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.readACC = blockReader(bus, LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_L_A | AUTO_INCREMENT)
+        self.readGYR = blockReader(bus, LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_L_G | AUTO_INCREMENT)
+        self.readMAG = blockReader(bus, LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_L_M | AUTO_INCREMENT)
+
+    def readAll(self):
+        #Full sample in three I2C transactions.
+        #Returns ((ACCx, ACCy, ACCz), (GYRx, GYRy, GYRz), (MAGx, MAGy, MAGz))
+        return self.readACC(), self.readGYR(), self.readMAG()
+
+    def init(self):
+        write = self.bus.write_byte_data
+        #initialise the accelerometer
+        write(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG1_XM, 0b01100111)  #z,y,x axis enabled, continuos update,  100Hz data rate
+        write(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG2_XM, 0b00011000)  #+/- 8G full scale
+
+        #initialise the magnetometer
+        write(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG5_XM, 0b11110000)  #Temp enable, M data rate = 50Hz
+        write(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG6_XM, 0b01100000)  #+/- 12gauss
+        write(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG7_XM, 0b00000000)  #Continuous-conversion mode
+
+        #initialise the gyroscope
+        write(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG1_G, 0b00001111)   #Normal power mode, all axes enabled
+        write(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG4_G, 0b00110000)   #Continuos update, 2000 dps full scale
+
+
+
+
+class BerryIMUv2(BerryIMUv1):
+    #BerryIMUv2 uses the LSM9DS1
+    version = 2
+    ACC_GAIN = 0.000244     #g/LSB at +/- 8g
+    GYR_GAIN = 0.070        #dps/LSB at 2000 dps
+    MAG_GAIN = 0.00043      #gauss/LSB at +/- 12 gauss
+    GYR_SIGN = -1           #ORIENT_CFG_G in init() inverts all three gyro axes
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.readACC = blockReader(bus, LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_L_XL)
+        self.readGYR = blockReader(bus, LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_L_G)
+        self.readMAG = blockReader(bus, LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_L_M | AUTO_INCREMENT)
+
+    def init(self):
+        write = self.bus.write_byte_data
+        #initialise the accelerometer
+        write(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG5_XL,0b00111000)   #z, y, x axis enabled for accelerometer
+        write(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG6_XL,0b00111000)   #+/- 8g
+
+        #initialise the gyroscope
+        write(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG4,0b00111000)      #z, y, x axis enabled for gyro
+        write(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG1_G,0b10111000)    #Gyro ODR = 476Hz, 2000 dps
+        write(LSM9DS1_GYR_ADDRESS,LSM9DS1_ORIENT_CFG_G,0b10111000)   #Swap orientation
+
+        #initialise the magnetometer
+        write(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG1_M, 0b10011100)    #Temp compensation enabled,Low power mode mode,80Hz ODR
+        write(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG2_M, 0b01000000)    #+/- 2gauss
+        write(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG3_M, 0b00000000)    #continuos update
+        write(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG4_M, 0b00000000)    #lower power mode for Z axis
+
+
+
+
+#LSM6DSL FIFO (BerryIMUv3 only)
+#ODR_FIFO codes for FIFO_CTRL5, the FIFO ODR must not exceed the sensor ODR set in init()
+FIFO_ODR = {12.5: 0b0001, 26: 0b0010, 52: 0b0011, 104: 0b0100, 208: 0b0101,
+            416: 0b0110, 833: 0b0111, 1660: 0b1000, 3330: 0b1001, 6660: 0b1010}
+FIFO_MODE_BYPASS = 0b000
+FIFO_MODE_CONTINUOUS = 0b110
+FIFO_SET_WORDS = 6          #One data set is GYRx, GYRy, GYRz, ACCx, ACCy, ACCz
+FIFO_BLOCK_WORDS = 12       #Two data sets per block read, SMBus block reads are limited to 32 bytes
+
+
+class BerryIMUv3(BerryIMUv1):
+    #BerryIMUv3 uses the LSM6DSL and LIS3MDL
+    version = 3
+    ACC_GAIN = 0.000244     #g/LSB at +/- 8g
+    GYR_GAIN = 0.070        #dps/LSB at 2000 dps
+    MAG_GAIN = 1.0 / 3421   #gauss/LSB at +/- 8 gauss
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.readACC = blockReader(bus, LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_XL)
+        self.readGYR = blockReader(bus, LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_G)
+        self.readMAG = blockReader(bus, LIS3MDL_ADDRESS, LIS3MDL_OUT_X_L | AUTO_INCREMENT)
+        self.fifo_odr_hz = 0
+
+    def init(self):
+        write = self.bus.write_byte_data
+        #initialise the accelerometer
+        write(LSM6DSL_ADDRESS,LSM6DSL_CTRL1_XL,0b10011111)           #ODR 3.33 kHz, +/- 8g , BW = 400hz
+        write(LSM6DSL_ADDRESS,LSM6DSL_CTRL8_XL,0b11001000)           #Low pass filter enabled, BW9, composite filter
+        write(LSM6DSL_ADDRESS,LSM6DSL_CTRL3_C,0b01000100)            #Enable Block Data update, increment during multi byte read
+
+        #initialise the gyroscope
+        write(LSM6DSL_ADDRESS,LSM6DSL_CTRL2_G,0b10011100)            #ODR 3.3 kHz, 2000 dps
+
+        #initialise the magnetometer
+        write(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG1, 0b11011100)         # Temp sesnor enabled, High performance, ODR 80 Hz, FAST ODR disabled and Selft test disabled.
+        write(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG2, 0b00100000)         # +/- 8 gauss
+        write(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG3, 0b00000000)         # Continuous-conversion mode
+
+    def initFIFO(self, odr_hz=416):
+        #Store gyro and accelerometer samples in the LSM6DSL FIFO at odr_hz so they can be
+        #drained in bulk with readFIFO(). 416Hz keeps the drain within a 100kHz I2C bus budget.
+        if odr_hz not in FIFO_ODR:
+            print(f"Unsupported FIFO ODR {odr_hz}Hz, use one of {sorted(FIFO_ODR)}")
+            return False
+        write = self.bus.write_byte_data
+        write(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL5,FIFO_MODE_BYPASS)            #Bypass mode clears the FIFO
+        write(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL3,0b00001001)                  #No decimation for gyro and accelerometer
+        write(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL5,(FIFO_ODR[odr_hz] << 3) | FIFO_MODE_CONTINUOUS)   #Continuous mode, oldest data overwritten when full
+        self.fifo_odr_hz = odr_hz
+        return True
+
+    def stopFIFO(self):
+        self.bus.write_byte_data(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL5,FIFO_MODE_BYPASS)
+        self.fifo_odr_hz = 0
+
+    def readFIFO(self):
+        #Drain every complete data set currently in the FIFO.
+        #Returns (gyr, acc) as int16 arrays of shape (N, 3), oldest sample first.
+        #The FIFO must be started with initFIFO() first, in bypass mode it holds no samples.
+        if not self.fifo_odr_hz:
+            raise RuntimeError("LSM6DSL FIFO is not running, call initFIFO() before readFIFO()")
+        read = self.bus.read_i2c_block_data
+        status = read(LSM6DSL_ADDRESS, LSM6DSL_FIFO_STATUS1, 4)
+        unread_words = status[0] | ((status[1] & 0x07) << 8)
+        if status[1] & 0x40:
+            print("Warning: LSM6DSL FIFO overrun, samples were lost")
+        pattern = status[2] | ((status[3] & 0x03) << 8)
+
+        #FIFO_PATTERN is the next word to be read, discard words until the next set starts on GYRx
+        skip = (FIFO_SET_WORDS - pattern) % FIFO_SET_WORDS
+        for i in range(min(skip, unread_words)):
+            read(LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, 2)
+        unread_words -= skip
+
+        remaining = (max(unread_words, 0) // FIFO_SET_WORDS) * FIFO_SET_WORDS
+        data = bytearray()
+        #With IF_INC set the address rolls back from FIFO_DATA_OUT_H to FIFO_DATA_OUT_L during a burst
+        while remaining > 0:
+            words = min(remaining, FIFO_BLOCK_WORDS)
+            data += bytes(read(LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, words * 2))
+            remaining -= words
+
+        samples = np.frombuffer(bytes(data), dtype='<i2').reshape(-1, FIFO_SET_WORDS)
+        return samples[:, 0:3], samples[:, 3:6]
+
+
+
+
+#detectIMU() remembers the detected version per bus, so a warm start only has to
+#confirm it with one WHO_AM_I read instead of probing every BerryIMU generation.
+#The accel/gyro WHO_AM_I at 0x6A differs between all three versions.
+DETECT_CACHE = os.environ.get('IMU_DETECT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'berryimu_detect.json'))
+WHO_AM_I_CHECK = {
+    1: (LSM9DS0_GYR_ADDRESS, LSM9DS0_WHO_AM_I_G, 0xd4),
+    2: (LSM9DS1_GYR_ADDRESS, LSM9DS1_WHO_AM_I_XG, 0x68),
+    3: (LSM6DSL_ADDRESS, LSM6DSL_WHO_AM_I, 0x6A),
+}
+DRIVERS = {1: BerryIMUv1, 2: BerryIMUv2, 3: BerryIMUv3}
+
+
+def busKey():
+    #Cache key for the module bus: the bus number, or the IMU_BUS spec for fake/replay buses
+    return os.environ.get('IMU_BUS') or str(I2C_BUS)
+
+
+def loadDetectCache():
+    try:
+        with open(DETECT_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveDetectCache(cache_key, version):
+    cache = loadDetectCache()
+    cache[cache_key] = version
+    try:
+        os.makedirs(os.path.dirname(DETECT_CACHE), exist_ok=True)
+        with open(DETECT_CACHE, 'w') as f:
+            json.dump(cache, f)
+    except OSError as e:
+        print(f"Could not save IMU detection cache: {e}")
+
+
+def verifyCachedIMU(i2c_bus, cache_key):
+    #Returns the cached version if a single WHO_AM_I read still confirms it, otherwise None
+    version = loadDetectCache().get(cache_key)
+    if version not in WHO_AM_I_CHECK:
+        return None
+    address, register, expected = WHO_AM_I_CHECK[version]
+    try:
+        if i2c_bus.read_byte_data(address, register) == expected:
+            return version
+    except IOError:
+        pass
+    return None
+
+
+def detectIMU(i2c_bus=None, cache_key=None):
     #Detect which version of BerryIMU is connected using the 'who am i' register
     #BerryIMUv1 uses the LSM9DS0
     #BerryIMUv2 uses the LSM9DS1
     #BerryIMUv3 uses the LSM6DSL and LIS3MDL
- 
-    global BerryIMUversion
+    #Any SMBus-like object can be passed in, otherwise the module bus is used.
+    #The module bus is cached under busKey(); pass cache_key to cache another bus.
+    #Returns the driver for the detected IMU, or None.
+
+    global BerryIMUversion, driver
+
+    #Forget the previous detection so a failed probe never returns or caches a stale driver
+    BerryIMUversion = 99
+    driver = None
+
+    if i2c_bus is None:
+        i2c_bus = bus
+        if cache_key is None:
+            cache_key = busKey()
+
+    if cache_key is not None:
+        version = verifyCachedIMU(i2c_bus, cache_key)
+        if version is not None:
+            BerryIMUversion = version
+            driver = DRIVERS[version](i2c_bus)
+            print(f"Found BerryIMUv{version} (cached)")
+            return driver
 
 
     try:
         #Check for BerryIMUv1 (LSM9DS0)
         #If no LSM9DS0 is connected, there will be an I2C bus error and the program will exit.
         #This section of code stops this from happening.
-        LSM9DS0_WHO_G_response = (bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_WHO_AM_I_G))
-        LSM9DS0_WHO_XM_response = (bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_WHO_AM_I_XM))
+        LSM9DS0_WHO_G_response = (i2c_bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_WHO_AM_I_G))
+        LSM9DS0_WHO_XM_response = (i2c_bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_WHO_AM_I_XM))
     except IOError as e:
-        print('')        #need to do something here, so we just print a space
+        pass             #No LSM9DS0 on the bus
     else:
         if (LSM9DS0_WHO_G_response == 0xd4) and (LSM9DS0_WHO_XM_response == 0x49):
             print("Found BerryIMUv1 (LSM9DS0)")
             BerryIMUversion = 1
+            driver = BerryIMUv1(i2c_bus)
 
 
     try:
         #Check for BerryIMUv2 (LSM9DS1)
         #If no LSM9DS1 is connnected, there will be an I2C bus error and the program will exit.
         #This section of code stops this from happening.
-        LSM9DS1_WHO_XG_response = (bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_WHO_AM_I_XG))
-        LSM9DS1_WHO_M_response = (bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_WHO_AM_I_M))
+        LSM9DS1_WHO_XG_response = (i2c_bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_WHO_AM_I_XG))
+        LSM9DS1_WHO_M_response = (i2c_bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_WHO_AM_I_M))
 
     except IOError as f:
-        print('')        #need to do something here, so we just print a space
+        pass             #No LSM9DS1 on the bus
     else:
         if (LSM9DS1_WHO_XG_response == 0x68) and (LSM9DS1_WHO_M_response == 0x3d):
             print("Found BerryIMUv2 (LSM9DS1)")
             BerryIMUversion = 2
+            driver = BerryIMUv2(i2c_bus)
 
     try:
         #Check for BerryIMUv3 (LSM6DSL and LIS3MDL)
         #If no LSM6DSL or LIS3MDL is connected, there will be an I2C bus error and the program will exit.
         #This section of code stops this from happening.
-        LSM6DSL_WHO_AM_I_response = (bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_WHO_AM_I))
-        LIS3MDL_WHO_AM_I_response = (bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_WHO_AM_I))
+        LSM6DSL_WHO_AM_I_response = (i2c_bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_WHO_AM_I))
+        LIS3MDL_WHO_AM_I_response = (i2c_bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_WHO_AM_I))
 
     except IOError as f:
-        print('')        #need to do something here, so we just print a space
+        pass             #No LSM6DSL or LIS3MDL on the bus
     else:
         if (LSM6DSL_WHO_AM_I_response == 0x6A) and (LIS3MDL_WHO_AM_I_response == 0x3D):
             print("Found BerryIMUv3 (LSM6DSL and LIS3MDL)")
             BerryIMUversion = 3
+            driver = BerryIMUv3(i2c_bus)
     time.sleep(1)
 
+    if driver is not None and cache_key is not None:
+        saveDetectCache(cache_key, BerryIMUversion)
+    return driver
+
 
 
 
@@ -85,207 +371,81 @@ def writeByte(device_address,register,value):
 
 
 
-def readACCx():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_H_XL)
+#Module level helpers kept for existing scripts, they forward to the detected driver.
+#Code on a hot path should hold on to the driver returned by detectIMU() instead.
+
+def readACC():
+    return driver.readACC()
+
+
+def readGYR():
+    return driver.readGYR()
 
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
 
+def readMAG():
+    return driver.readMAG()
 
 
- 
+def readAll():
+    return driver.readAll()
+
+
+def readACCx():
+    return driver.readACC()[0]
 
 
 def readACCy():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Y_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Y_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Y_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Y_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_H_XL)
-
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
+    return driver.readACC()[1]
 
 
 def readACCz():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Z_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Z_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Z_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Z_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_H_XL)
-
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
+    return driver.readACC()[2]
 
 
 def readGYRx():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
+    return driver.readGYR()[0]
 
 
 def readGYRy():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Y_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Y_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Y_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Y_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
+    return driver.readGYR()[1]
+
 
 def readGYRz():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Z_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Z_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Z_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Z_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
+    return driver.readGYR()[2]
 
 
 def readMAGx():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_X_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_X_H)
-
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+    return driver.readMAG()[0]
 
 
 def readMAGy():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Y_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Y_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Y_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Y_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Y_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Y_H)
-
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+    return driver.readMAG()[1]
 
 
 def readMAGz():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Z_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Z_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Z_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Z_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Z_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Z_H)
-
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+    return driver.readMAG()[2]
 
 
 
 def initIMU():
+    if driver is not None:
+        driver.init()
 
-    if(BerryIMUversion == 1):   #For BerryIMUv1
-        #initialise the accelerometer
-        writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG1_XM, 0b01100111)  #z,y,x axis enabled, continuos update,  100Hz data rate
-        writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG2_XM, 0b00011000)  #+/- 8G full scale
-
-        #initialise the magnetometer
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG5_XM, 0b11110000)  #Temp enable, M data rate = 50Hz
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG6_XM, 0b01100000)  #+/- 12gauss
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG7_XM, 0b00000000)  #Continuous-conversion mode
-
-        #initialise the gyroscope
-        writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG1_G, 0b00001111)   #Normal power mode, all axes enabled
-        writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG4_G, 0b00110000)   #Continuos update, 2000 dps full scale
 
-    elif(BerryIMUversion == 2):       #For BerryIMUv2
-        #initialise the accelerometer
-        writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG5_XL,0b00111000)   #z, y, x axis enabled for accelerometer
-        writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG6_XL,0b00111000)   #+/- 8g
 
-        #initialise the gyroscope
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG4,0b00111000)      #z, y, x axis enabled for gyro
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG1_G,0b10111000)    #Gyro ODR = 476Hz, 2000 dps
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_ORIENT_CFG_G,0b10111000)   #Swap orientation
+def initFIFO(odr_hz=416):
+    if(BerryIMUversion != 3):
+        print("FIFO mode is only available on BerryIMUv3 (LSM6DSL)")
+        return False
+    return driver.initFIFO(odr_hz)
 
-        #initialise the magnetometer
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG1_M, 0b10011100)    #Temp compensation enabled,Low power mode mode,80Hz ODR
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG2_M, 0b01000000)    #+/- 2gauss
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG3_M, 0b00000000)    #continuos update
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG4_M, 0b00000000)    #lower power mode for Z axis
 
-    elif(BerryIMUversion == 3):       #For BerryIMUv3
-        #initialise the accelerometer
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL1_XL,0b10011111)           #ODR 3.33 kHz, +/- 8g , BW = 400hz
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL8_XL,0b11001000)           #Low pass filter enabled, BW9, composite filter
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL3_C,0b01000100)            #Enable Block Data update, increment during multi byte read
-
-        #initialise the gyroscope
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL2_G,0b10011100)            #ODR 3.3 kHz, 2000 dps
-
-        #initialise the magnetometer
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG1, 0b11011100)         # Temp sesnor enabled, High performance, ODR 80 Hz, FAST ODR disabled and Selft test disabled.
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG2, 0b00100000)         # +/- 8 gauss
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG3, 0b00000000)         # Continuous-conversion mode
+def stopFIFO():
+    if(BerryIMUversion == 3):
+        driver.stopFIFO()
 
 
+def readFIFO():
+    if(BerryIMUversion != 3):
+        raise RuntimeError("FIFO mode is only available on BerryIMUv3 (LSM6DSL)")
+    return driver.readFIFO()
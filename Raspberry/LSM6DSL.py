@@ -1,6 +1,12 @@
 
 LSM6DSL_ADDRESS          =  0x6A
 
+LSM6DSL_FIFO_CTRL1       =  0x06
+LSM6DSL_FIFO_CTRL2       =  0x07
+LSM6DSL_FIFO_CTRL3       =  0x08
+LSM6DSL_FIFO_CTRL4       =  0x09
+LSM6DSL_FIFO_CTRL5       =  0x0A
+
 LSM6DSL_WHO_AM_I         =  0x0F
 LSM6DSL_RAM_ACCESS       =  0x01
 LSM6DSL_CTRL1_XL         =  0x10
@@ -32,6 +38,13 @@ LSM6DSL_OUTY_H_G         =  0x25
 LSM6DSL_OUTZ_L_G         =  0x26
 LSM6DSL_OUTZ_H_G         =  0x27
 
+LSM6DSL_FIFO_STATUS1     =  0x3A
+LSM6DSL_FIFO_STATUS2     =  0x3B
+LSM6DSL_FIFO_STATUS3     =  0x3C
+LSM6DSL_FIFO_STATUS4     =  0x3D
+LSM6DSL_FIFO_DATA_OUT_L  =  0x3E
+LSM6DSL_FIFO_DATA_OUT_H  =  0x3F
+
 LSM6DSL_TAP_CFG          =  0x58
 LSM6DSL_WAKE_UP_SRC      =  0x1B
 LSM6DSL_WAKE_UP_DUR      =  0x5C
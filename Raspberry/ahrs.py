@@ -0,0 +1,129 @@
+# ahrs.py
+
+import ctypes
+import math
+from multiprocessing import Lock, RawArray
+
+from imu_calibration import Calibration
+
+# Layout of the shared estimate
+STATE_TIMESTAMP = 0
+STATE_HEADING = 1
+STATE_PITCH = 2
+STATE_ROLL = 3
+STATE_YAW_RATE = 4
+STATE_VALID = 5
+STATE_WIDTH = 6
+
+
+def wrap_degrees(angle):
+    """Wraps an angle difference into [-180, 180)."""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class ComplementaryAHRS:
+    """
+    Complementary attitude and heading filter running at the IMU rate.
+
+    Gyro rates are integrated for a smooth, low-latency estimate and pulled
+    towards the accelerometer tilt and the tilt-compensated magnetometer
+    heading with weight (1 - alpha) per sample, using the same pitch, roll
+    and heading conventions as heading_service.compute_heading().
+
+    Feed it with update() or attach it to an IMUSampler:
+        sampler.add_listener(ahrs.update)
+    The latest estimate lives in shared memory, so processes started with
+    the filter as an argument can call snapshot() as well.
+    """
+
+    def __init__(self, gyr_gain, alpha=0.98, acc_calibration=None, mag_calibration=None, max_gap=0.5):
+        self.gyr_gain = gyr_gain  # dps per LSB, including the driver's GYR_SIGN
+        self.alpha = alpha
+        self.acc_calibration = acc_calibration or Calibration()
+        self.mag_calibration = mag_calibration or Calibration()
+        self.max_gap = max_gap  # Restart from the sensors if samples stop for this long
+        self.last_timestamp = None
+        self.heading = 0.0
+        self.pitch = 0.0
+        self.roll = 0.0
+        self._state = RawArray(ctypes.c_double, STATE_WIDTH)
+        self._lock = Lock()
+
+    def _tilt(self, ACCx, ACCy, ACCz):
+        acc_magnitude = math.sqrt(ACCx ** 2 + ACCy ** 2 + ACCz ** 2)
+        if acc_magnitude == 0:
+            return None
+        pitch = math.asin(ACCx / acc_magnitude)
+        if math.cos(pitch) == 0:
+            roll = 0.0
+        else:
+            roll = -math.asin(max(-1.0, min(1.0, (ACCy / acc_magnitude) / math.cos(pitch))))
+        return pitch, roll
+
+    def _mag_heading(self, MAGx, MAGy, MAGz, pitch, roll):
+        magXcomp = MAGx * math.cos(pitch) + MAGz * math.sin(pitch)
+        magYcomp = (MAGx * math.sin(roll) * math.sin(pitch) +
+                    MAGy * math.cos(roll) -
+                    MAGz * math.sin(roll) * math.cos(pitch))
+        return math.degrees(math.atan2(magYcomp, magXcomp)) % 360.0
+
+    def update(self, timestamp, acc, gyr, mag):
+        ACCx, ACCy, ACCz = self.acc_calibration.apply(acc)
+        MAGx, MAGy, MAGz = self.mag_calibration.apply(mag)
+        # Body rates in dps. With z up, positive rotation about y lowers pitch as
+        # computed from ACCx, positive rotation about x lowers roll and positive
+        # rotation about z turns the compass heading anticlockwise.
+        pitch_rate = -gyr[1] * self.gyr_gain
+        roll_rate = -gyr[0] * self.gyr_gain
+        yaw_rate = -gyr[2] * self.gyr_gain
+
+        tilt = self._tilt(ACCx, ACCy, ACCz)
+        first = self.last_timestamp is None or timestamp - self.last_timestamp > self.max_gap
+        dt = 0.0 if first else timestamp - self.last_timestamp
+        self.last_timestamp = timestamp
+
+        if first:
+            if tilt is None:
+                self.last_timestamp = None
+                return
+            self.pitch = math.degrees(tilt[0])
+            self.roll = math.degrees(tilt[1])
+        else:
+            self.pitch += pitch_rate * dt
+            self.roll += roll_rate * dt
+            if tilt is not None:
+                self.pitch = self.alpha * self.pitch + (1 - self.alpha) * math.degrees(tilt[0])
+                self.roll = self.alpha * self.roll + (1 - self.alpha) * math.degrees(tilt[1])
+
+        mag_heading = self._mag_heading(MAGx, MAGy, MAGz, math.radians(self.pitch), math.radians(self.roll))
+        if first:
+            self.heading = mag_heading
+        else:
+            predicted = self.heading + yaw_rate * dt
+            self.heading = (predicted + (1 - self.alpha) * wrap_degrees(mag_heading - predicted)) % 360.0
+
+        with self._lock:
+            self._state[STATE_TIMESTAMP] = timestamp
+            self._state[STATE_HEADING] = self.heading
+            self._state[STATE_PITCH] = self.pitch
+            self._state[STATE_ROLL] = self.roll
+            self._state[STATE_YAW_RATE] = yaw_rate
+            self._state[STATE_VALID] = 1.0
+
+    def snapshot(self):
+        """
+        Returns the latest estimate as a dict (timestamp on the sampler's
+        time.monotonic clock, angles in degrees, yaw_rate in dps), or None
+        before the first update.
+        """
+        with self._lock:
+            state = self._state[:]
+        if not state[STATE_VALID]:
+            return None
+        return {
+            'timestamp': state[STATE_TIMESTAMP],
+            'heading': state[STATE_HEADING],
+            'pitch': state[STATE_PITCH],
+            'roll': state[STATE_ROLL],
+            'yaw_rate': state[STATE_YAW_RATE],
+        }
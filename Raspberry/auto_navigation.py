@@ -1,14 +1,20 @@
 # auto_navigation.py
 
 import numpy as np
+import queue
 import time
 import math
-from pyproj import Proj
+from functools import lru_cache
+from projection import make_projection, to_xy_array
+from segment_index import SegmentIndex
 import IMU
-import gpsd
+from imu_calibration import Calibration, load_calibration
+from heading_service import HeadingService
+from gps_reader import GPSReader
+from imu_sampler import COL_TIME, COL_ACC
 import logging
 
-dt = 0.1  # Time step in seconds
+dt = 0.1  # Time step in seconds, also the tracking loop period
 x_est = None
 P_est = None
 
@@ -18,75 +24,91 @@ Q = np.diag([0.05, 0.05, 0.02, 0.02, 0.005, 0.005, 0.002])
 # Measurement noise covariance matrix R
 R = np.diag([10.0, 10.0, 0.1])
 
-proj_utm = None
+# TimedEKF defaults. The acceleration is a measured input there, so velocity
+# gets little process noise and cannot run away between fixes; theta gets a
+# lot, so it follows the compass through turns and the acceleration is
+# rotated with the current heading. Position is unknown until the first fix
+# and the robot starts at rest
+TIMED_EKF_Q = np.diag([0.001, 0.001, 0.0005, 0.0005, 0.005, 0.005, 0.1])
+TIMED_EKF_P0 = np.diag([500., 500., 1., 1., 1., 1., 1.])
+
+projection = None  # Local ENU plane for small fields, UTM otherwise
 waypoints = []
 ref_lat, ref_lon = 0.0, 0.0
 
-def calculate_heading():
+# Pure pursuit tracking
+LOOK_AHEAD_DISTANCE = 2.0   # Meters
+GOAL_TOLERANCE = 1.0        # Meters from the last waypoint to count as arrived
+GPS_TIMEOUT = 2.0           # Seconds without a fix before the robot is stopped
+MAX_STEER_ANGLE = 45.0      # Heading error (degrees) that gives full steering
+TURN_IN_PLACE_ANGLE = 60.0  # Heading error (degrees) above which the robot stops to turn
+FORWARD_COMMAND = 96        # Front/back command while tracking (64 stop, 126 max forward)
+STATS_INTERVAL = 5.0        # Seconds between loop timing reports
+IDLE_POLL = 0.5             # Seconds an inactive worker waits for a control message before checking stop_event
+GOAL_SEARCH_WINDOW = 32     # Segments tested per vectorized goal point step
+GOAL_ADVANCE_WINDOW = 2 * LOOK_AHEAD_DISTANCE  # Meters of path past the robot the indexed goal search may reach
+
+# Raw accelerometer counts to m/s^2: the driver's g/LSB times standard gravity.
+# Every driver sets the accelerometer to +/-8g (0.000244 g/LSB); the gain of
+# the detected IMU is used when there is one
+GRAVITY = 9.80665
+ACCEL_SCALE = 0.000244 * GRAVITY
+ACCEL_VARIANCE = 0.05  # (m/s^2)^2, accelerometer noise plus tilt and mounting error
+NO_ACCEL = (0.0, 0.0)
+
+# Shared IMU sampler and heading service from the central script; None means read the bus directly
+imu_sampler = None
+heading_service = None
+
+# Accelerometer calibration for the detected IMU, loaded when the process starts
+acc_calibration = Calibration()
+
+def accel_scale():
+    """m/s^2 per raw accelerometer count of the detected IMU."""
+    if IMU.driver is not None:
+        return IMU.driver.ACC_GAIN * GRAVITY
+    return ACCEL_SCALE
+
+def read_accelerometer_samples(since):
     """
-    Calculate the robot's heading using IMU readings.
-    Returns the heading in degrees.
+    Accelerometer samples of the shared sampler newer than `since` (at most
+    the last second) as (timestamps, accel), accel being (N, 2) body frame
+    x (forward) / y (left) m/s^2. None when there is no sampler.
     """
-    ACCx = IMU.readACCx()
-    ACCy = IMU.readACCy()
-    ACCz = IMU.readACCz()
-    MAGx = IMU.readMAGx()
-    MAGy = IMU.readMAGy()
-    MAGz = IMU.readMAGz()
-
-    # Normalize accelerometer raw values.
-    acc_magnitude = math.sqrt(ACCx ** 2 + ACCy ** 2 + ACCz ** 2)
-    if acc_magnitude == 0:
-        print("Error: Accelerometer magnitude is zero.")
-        return 0
-    accXnorm = ACCx / acc_magnitude
-    accYnorm = ACCy / acc_magnitude
-
-    pitch = math.asin(accXnorm)
-    if math.cos(pitch) == 0:
-        roll = 0
-    else:
-        roll = -math.asin(accYnorm / math.cos(pitch))
-
-    # Tilt compensation
-    magXcomp = MAGx * math.cos(pitch) + MAGz * math.sin(pitch)
-    magYcomp = (MAGx * math.sin(roll) * math.sin(pitch) +
-               MAGy * math.cos(roll) -
-               MAGz * math.sin(roll) * math.cos(pitch))
+    if imu_sampler is None:
+        return None
+    rows = imu_sampler.window(seconds=1.0)
+    rows = rows[rows[:, COL_TIME] > since]
+    accel = acc_calibration.apply(rows[:, COL_ACC])[:, :2] * accel_scale()
+    return rows[:, COL_TIME], accel
 
-    heading = math.degrees(math.atan2(magYcomp, magXcomp))
-    if heading < 0:
-        heading += 360
+def read_accelerometer():
+    sample = imu_sampler.latest() if imu_sampler is not None else None
+    if sample is not None:
+        timestamp, acc, gyr, mag = sample
+    else:
+        acc = IMU.readACC()
+    return acc_calibration.apply(acc)
 
-    return heading
+# Shared GPS reader from the central script, or one owned by this process
+gps_reader = None
 
 def receive_gps_data():
-    try:
-        packet = gpsd.get_current()
-        if packet.mode >= 2:
-            current_lat = packet.lat
-            current_lon = packet.lon
-            return current_lat, current_lon
-        else:
-            return None, None
-    except Exception as e:
-        print(f"Error retrieving GPS data: {e}")
-        return None, None
-
-def initialize_projection(ref_lat, ref_lon):
-    global proj_utm
-    # Determine the UTM zone based on reference longitude
-    zone_number = int((ref_lon + 180) / 6) + 1
-    hemisphere = 'north' if ref_lat >= 0 else 'south'
-    proj_utm = Proj(proj='utm', zone=zone_number, ellps='WGS84', hemisphere=hemisphere)
+    return gps_reader.position(max_age=GPS_TIMEOUT)
+
+def initialize_projection(ref_lat, ref_lon, latlon=None):
+    """
+    Picks the metric frame for a mission: the tangent plane at the reference
+    point if every (lat, lon) row of `latlon` is close to it, otherwise UTM.
+    """
+    global projection
+    projection = make_projection(ref_lat, ref_lon, latlon)
 
 def latlon_to_xy(lat, lon):
-    x, y = proj_utm(lon, lat)
-    return x, y
+    return projection.to_xy(lat, lon)
 
 def xy_to_latlon(x, y):
-    lon, lat = proj_utm(x, y, inverse=True)
-    return lat, lon
+    return projection.to_latlon(x, y)
 
 def pt_to_pt_distance(pt1, pt2):
     return math.hypot(pt2[0] - pt1[0], pt2[1] - pt1[1])
@@ -103,6 +125,8 @@ def line_circle_intersection(current_pos, pt1, pt2, look_ahead_distance):
     dx = x2 - x1
     dy = y2 - y1
     dr = math.hypot(dx, dy)
+    if dr == 0:
+        return []  # Repeated waypoint; no line to intersect
     D = x1 * y2 - x2 * y1
     discriminant = (look_ahead_distance ** 2) * (dr ** 2) - D ** 2
 
@@ -124,15 +148,148 @@ def line_circle_intersection(current_pos, pt1, pt2, look_ahead_distance):
 
     return intersections
 
-def find_goal_point(path, current_pos, look_ahead_distance, last_found_index):
-    for i in range(last_found_index, len(path) - 1):
+def _scan_goal_point(path, current_pos, look_ahead_distance, start, end):
+    """find_goal_point()'s search over segments start to end - 1: (goal_point, i), or None."""
+    for i in range(start, end):
         pt1 = path[i]
         pt2 = path[i + 1]
         intersections = line_circle_intersection(current_pos, pt1, pt2, look_ahead_distance)
         if intersections:
             goal_point = min(intersections, key=lambda pt: pt_to_pt_distance(pt, pt2))
-            return goal_point, i
-    return path[-1], len(path) - 1
+            # Only a point that makes progress along the segment counts; near the
+            # end of a segment the remaining intersection is behind the robot
+            if pt_to_pt_distance(goal_point, pt2) < pt_to_pt_distance(current_pos, pt2):
+                return goal_point, i
+    return None
+
+def find_goal_point(path, current_pos, look_ahead_distance, last_found_index):
+    found = _scan_goal_point(path, current_pos, look_ahead_distance, last_found_index, len(path) - 1)
+    if found is not None:
+        return found
+    # Lost the path (further than the look-ahead distance); head for the next waypoint
+    next_index = min(last_found_index + 1, len(path) - 1)
+    return path[next_index], last_found_index
+
+def _segment_goal_points(pt1, pt2, current_pos, look_ahead_distance):
+    """
+    Intersections of the look-ahead circle with each pt1[i] -> pt2[i] segment,
+    picked like find_goal_point(): the one closest to the segment's end.
+    Returns (goal_points, ahead), ahead being true where that intersection
+    exists and is closer to the segment's end than the robot is.
+    """
+    cx, cy = current_pos
+    x1 = pt1[:, 0] - cx
+    y1 = pt1[:, 1] - cy
+    x2 = pt2[:, 0] - cx
+    y2 = pt2[:, 1] - cy
+    dx = x2 - x1
+    dy = y2 - y1
+    dr = np.hypot(dx, dy)
+    dr_sq = dr ** 2
+    D = x1 * y2 - x2 * y1
+    discriminant = (look_ahead_distance ** 2) * dr_sq - D ** 2
+    hit = (discriminant >= 0) & (dr != 0)
+    if not hit.any():
+        return None, hit
+    sqrt_discriminant = np.sqrt(np.where(hit, discriminant, 0.0))
+    sign_dy = np.where(dy < 0, -1.0, 1.0)
+    safe_dr_sq = np.where(dr != 0, dr_sq, 1.0)
+
+    # Candidates for sign = +1 and -1, in the scalar order
+    signs = np.array([[1.0], [-1.0]])
+    x = (D * dy + signs * sign_dy * dx * sqrt_discriminant) / safe_dr_sq + cx
+    y = (-D * dx + np.abs(dy) * sqrt_discriminant * signs) / safe_dr_sq + cy
+    valid = (hit &
+             (np.minimum(pt1[:, 0], pt2[:, 0]) - 1e-6 <= x) & (x <= np.maximum(pt1[:, 0], pt2[:, 0]) + 1e-6) &
+             (np.minimum(pt1[:, 1], pt2[:, 1]) - 1e-6 <= y) & (y <= np.maximum(pt1[:, 1], pt2[:, 1]) + 1e-6))
+
+    # Closest valid candidate to each segment end; ties keep the + candidate
+    to_end = np.where(valid, np.hypot(x - pt2[:, 0], y - pt2[:, 1]), np.inf)
+    pick = np.where(to_end[1] < to_end[0], 1, 0)
+    columns = np.arange(len(pt1))
+    goal_points = np.column_stack([x[pick, columns], y[pick, columns]])
+    robot_to_end = np.hypot(cx - pt2[:, 0], cy - pt2[:, 1])
+    return goal_points, to_end[pick, columns] < robot_to_end
+
+def find_goal_point_vectorized(path, current_pos, look_ahead_distance, last_found_index,
+                               window=GOAL_SEARCH_WINDOW):
+    """
+    NumPy version of find_goal_point() for an (N, 2) path, with the same
+    result: the first segment from last_found_index with an intersection
+    ahead of the robot, and that segment's intersection closest to its end.
+    While tracking, the goal is on one of the first few segments, where the
+    scalar loop is cheaper than building arrays, so the first `window`
+    segments are scanned by find_goal_point()'s loop. Only a longer scan,
+    like a robot that lost the path, goes on in NumPy, testing segments
+    `window` at a time and doubling the window each step.
+    """
+    path = np.asarray(path, dtype=float)
+    n_segments = len(path) - 1
+    start = last_found_index
+    end = min(start + window, n_segments)
+    if start < end:
+        # Python floats; the loop is slower on NumPy scalars
+        found = _scan_goal_point(path[start:end + 1].tolist(), current_pos, look_ahead_distance, 0, end - start)
+        if found is not None:
+            return found[0], start + found[1]
+        start = end
+        window *= 2
+    while start < n_segments:
+        end = min(start + window, n_segments)
+        goal_points, ahead = _segment_goal_points(path[start:end], path[start + 1:end + 1],
+                                                  current_pos, look_ahead_distance)
+        ahead = np.flatnonzero(ahead)
+        if len(ahead):
+            k = ahead[0]
+            return list(goal_points[k]), start + k
+        # Nothing ahead here; look further in bigger steps
+        start = end
+        window *= 2
+    # Lost the path (further than the look-ahead distance); head for the next waypoint
+    next_index = min(last_found_index + 1, len(path) - 1)
+    return path[next_index], last_found_index
+
+def find_goal_point_indexed(index, current_pos, look_ahead_distance, last_found_index,
+                            max_advance=GOAL_ADVANCE_WINDOW):
+    """
+    find_goal_point() through a SegmentIndex of the path, limited to the
+    segments that start within max_advance meters of path past the robot's
+    progress on segment last_found_index. A later part of the path that
+    happens to come within the look-ahead distance, such as the next row of
+    a coverage pattern, is out of reach until the robot has driven up to it,
+    so a noisy pose cannot make the search skip the rest of the current row.
+    When no segment in the window is close enough, the goal is the point
+    look_ahead_distance further along the path than the closest point of the
+    window, so the robot rejoins the path where it left it;
+    last_found_index stays where it was.
+    Returns (goal_point, last_found_index, location), location being
+    index.location() for the robot on the closest segment of the window
+    (from the segment before last_found_index on).
+    """
+    n_segments = len(index)
+    if n_segments == 0:
+        return index.path[0], last_found_index, None
+    current = min(last_found_index, n_segments - 1)
+    # Robot's progress along the path, measured on the current segment
+    _, t = index.project(current_pos, [current])
+    progress = index.cumulative[current] + t[0] * math.sqrt(index.length_sq[current])
+    end = int(np.searchsorted(index.cumulative, progress + max_advance, side='right'))
+    segments = np.arange(max(current - 1, 0), min(max(end, current + 1), n_segments))
+    distance, t = index.project(current_pos, segments)
+    closest = int(np.argmin(distance))
+    location = index.location(current_pos, segments[closest], distance[closest], t[closest])
+
+    # A little slack for the 1e-6 bounds tolerance of the intersection test
+    candidates = segments[(segments >= current) & (distance <= look_ahead_distance + 1e-3)]
+    if len(candidates):
+        goal_points, ahead = _segment_goal_points(index.start[candidates], index.path[candidates + 1],
+                                                  current_pos, look_ahead_distance)
+        ahead = np.flatnonzero(ahead)
+        if len(ahead):
+            k = ahead[0]
+            return list(goal_points[k]), int(candidates[k]), location
+    goal_point = index.point_at(location['progress'] + look_ahead_distance)
+    return goal_point, last_found_index, location
 
 def find_min_angle(abs_target_angle, current_heading):
     min_angle = abs_target_angle - current_heading
@@ -144,15 +301,12 @@ def find_min_angle(abs_target_angle, current_heading):
 
 def get_accelerometer_data():
     # Read accelerometer data
-    ACCx = IMU.readACCx()
-    ACCy = IMU.readACCy()
-    ACCz = IMU.readACCz()
+    ACCx, ACCy, ACCz = read_accelerometer()
 
-    # Convert raw accelerometer data to m/s^2 (assuming proper scaling)
-    # Adjust the scaling_factor based on your accelerometer's sensitivity
-    scaling_factor = 0.000598550415  # Example scaling factor for a ±2g accelerometer
-    accel_x = ACCx * scaling_factor
-    accel_y = ACCy * scaling_factor
+    # Convert raw accelerometer data to m/s^2, body frame x forward, y left
+    scale = accel_scale()
+    accel_x = ACCx * scale
+    accel_y = ACCy * scale
 
     return [accel_x, accel_y]
 
@@ -223,36 +377,671 @@ def initialize_ekf(initial_x, initial_y, initial_theta):
     P_est = np.eye(7) * 500.
     logging.info(f"EKF Initialized with State: {x_est.flatten()} and Covariance: \n{P_est}")
 
-def auto_navigation_process(command_queue, client, stop_event):
-    global waypoints, ref_lat, ref_lon, x_est, P_est
+MEASURED_STATES = [0, 1, 6]  # x, y and theta are observed by GPS and the compass
+POSITION_STATES = [0, 1]
+HEADING_STATES = [6]
+
+@lru_cache(maxsize=64)
+def transition_matrix(step):
+    """Read-only state transition matrix F of ekf_predict() for a time step."""
+    F = np.eye(7)
+    F[0, 2] = F[1, 3] = F[2, 4] = F[3, 5] = step
+    F[0, 4] = F[1, 5] = 0.5 * step ** 2
+    F.setflags(write=False)
+    return F
+
+def cholesky_factor(S, L):
+    """
+    Writes the lower Cholesky factor of a small symmetric (m, m) array S
+    into L. Returns False as soon as a pivot is not positive, i.e. S is not
+    positive definite. Up to 3x3 the factorization is written out on floats,
+    since LAPACK calls cost more than the arithmetic at that size.
+    """
+    m = S.shape[0]
+    item = S.item
+    if m > 3:
+        factor = L.item
+        for j in range(m):
+            pivot = item(j, j)
+            for k in range(j):
+                pivot -= factor(j, k) ** 2
+            if not pivot > 0:
+                return False
+            pivot = math.sqrt(pivot)
+            L[j, j] = pivot
+            for i in range(j + 1, m):
+                value = item(i, j)
+                for k in range(j):
+                    value -= factor(i, k) * factor(j, k)
+                L[i, j] = value / pivot
+        return True
+    a = item(0, 0)
+    if not a > 0:
+        return False
+    a = L[0, 0] = math.sqrt(a)
+    if m == 1:
+        return True
+    b = L[1, 0] = item(1, 0) / a
+    c = item(1, 1) - b * b
+    if not c > 0:
+        return False
+    c = L[1, 1] = math.sqrt(c)
+    if m == 2:
+        return True
+    d = L[2, 0] = item(2, 0) / a
+    e = L[2, 1] = (item(2, 1) - d * b) / c
+    f = item(2, 2) - d * d - e * e
+    if not f > 0:
+        return False
+    L[2, 2] = math.sqrt(f)
+    return True
+
+def cholesky_solve(L, X):
+    """
+    Solves S X = B in place for the (m, n) array X holding B, S = L L^T
+    being factored by cholesky_factor(): forward substitution with L, then
+    back substitution with L^T. Up to 3x3 this runs column by column on
+    floats; larger systems go a row of X at a time.
+    """
+    m, n = X.shape
+    factor = L.item
+    if m > 3:
+        for i in range(m):
+            for k in range(i):
+                X[i] -= factor(i, k) * X[k]
+            X[i] /= factor(i, i)
+        for i in range(m - 1, -1, -1):
+            for k in range(i + 1, m):
+                X[i] -= factor(k, i) * X[k]
+            X[i] /= factor(i, i)
+        return X
+    value = X.item
+    a = factor(0, 0)
+    if m == 1:
+        X *= 1 / (a * a)
+        return X
+    b = factor(1, 0)
+    c = factor(1, 1)
+    if m == 2:
+        for j in range(n):
+            z0 = value(0, j) / a
+            x1 = (value(1, j) - b * z0) / (c * c)
+            X[0, j] = (z0 - b * x1) / a
+            X[1, j] = x1
+        return X
+    d = factor(2, 0)
+    e = factor(2, 1)
+    f = factor(2, 2)
+    for j in range(n):
+        z0 = value(0, j) / a
+        z1 = (value(1, j) - b * z0) / c
+        x2 = (value(2, j) - d * z0 - e * z1) / (f * f)
+        x1 = (z1 - e * x2) / c
+        X[0, j] = (z0 - b * x1 - d * x2) / a
+        X[1, j] = x1
+        X[2, j] = x2
+    return X
+
+class _MeasurementBuffers:
+    """Scratch matrices for updates that observe one set of states."""
+
+    def __init__(self, states):
+        m = len(states)
+        self.states = states
+        self.S = np.empty((m, m))
+        self.L = np.zeros((m, m))  # Cholesky factor of S
+        self.Kt = np.empty((m, 7))  # Gain, transposed so its rows are contiguous
+        self.KR = np.empty((7, m))
+        self.y = np.empty((m, 1))
+        self.A = np.eye(7)  # I - K H; only the measured columns change
+        self.I_measured = np.eye(7)[:, states]
+
+class EKF:
+    """
+    The ekf_predict()/ekf_update() filter with preallocated matrices.
+
+    State, covariance and the intermediate products of predict() and the
+    gain live in buffers allocated once; F comes from a cache keyed by the
+    time step, and H is applied by picking the measured rows and columns
+    instead of multiplying. The gain comes from forward and back substitution
+    with the Cholesky factor of the small innovation covariance S, both
+    written into scratch buffers; a pivot that is not positive rejects an S
+    that is not positive definite. The covariance update uses the Joseph
+    form, which keeps a positive definite P positive definite for any gain,
+    so the new P needs no check of its own. A correction allocates no
+    arrays. x is a (7, 1) column like x_est.
+    """
+
+    def __init__(self, x0, P0, process_noise=Q, measurement_noise=R, step=dt):
+        self.x = np.array(x0, dtype=float).reshape(7, 1)
+        self.P = np.array(P0, dtype=float)
+        self.Q = np.array(process_noise, dtype=float)
+        self.R = np.array(measurement_noise, dtype=float)
+        self.dt = step
+        # Scratch buffers; new values are built in the spares and swapped in
+        self._x = np.empty((7, 1))
+        self._P = np.empty((7, 7))
+        self._FP = np.empty((7, 7))
+        self._F = np.eye(7)
+        self._Q = np.empty((7, 7))
+        self._measurements = {}
+
+    def _transition(self, step):
+        if step == self.dt:
+            return transition_matrix(step), self.Q
+        # Odd steps would only fill the cache; Q is noise per dt, so it scales with the step
+        F = self._F
+        F[0, 2] = F[1, 3] = F[2, 4] = F[3, 5] = step
+        F[0, 4] = F[1, 5] = 0.5 * step ** 2
+        np.multiply(self.Q, step / self.dt, out=self._Q)
+        return F, self._Q
+
+    def predict(self, accel_data, step=None):
+        """Predicts `step` seconds ahead (dt by default) with the acceleration input."""
+        step = self.dt if step is None else step
+        F, Q_step = self._transition(step)
+        np.matmul(F, self.x, out=self._x)
+        self._x[4, 0] += accel_data[0] * step
+        self._x[5, 0] += accel_data[1] * step
+        self.x, self._x = self._x, self.x
+
+        np.matmul(F, self.P, out=self._FP)
+        np.matmul(self._FP, F.T, out=self._P)
+        self._P += Q_step
+        self.P, self._P = self._P, self.P
+
+    def update(self, z_meas):
+        """
+        Fuses a (gps_x, gps_y, theta_radians) measurement. Returns False if the
+        update was rejected, leaving the covariance (and, for a singular
+        innovation covariance, the state) as predicted.
+        """
+        if isinstance(z_meas, np.ndarray):
+            z_meas = z_meas.reshape(-1)  # A view of a (3, 1) column, no copy
+        return self.correct(z_meas, MEASURED_STATES, self.R)
+
+    def correct(self, values, states, noise):
+        """
+        Fuses measured values of the given states (indices into x, e.g.
+        POSITION_STATES) with measurement noise covariance `noise`.
+        Returns False if the update was rejected, like update().
+        """
+        key = tuple(states)
+        buffers = self._measurements.get(key)
+        if buffers is None:
+            buffers = self._measurements[key] = _MeasurementBuffers(states)
+        x = self.x
+        y = buffers.y
+        for i, state in enumerate(states):
+            y[i, 0] = values[i] - x[state, 0]
+            if state == 6:
+                y[i, 0] = ((y[i, 0] + np.pi) % (2 * np.pi)) - np.pi  # Normalize angle
+
+        # K = P H^T S^-1, i.e. S K^T = H P, solved with the factor of S
+        Kt = buffers.Kt
+        self.P.take(states, axis=0, out=Kt)
+        Kt.take(states, axis=1, out=buffers.S)
+        buffers.S += noise
+        if not cholesky_factor(buffers.S, buffers.L):
+            logging.error("Innovation covariance is not positive definite; skipping update.")
+            return False
+        cholesky_solve(buffers.L, Kt)
+        K = Kt.T
+
+        np.matmul(K, y, out=self._x)
+        x += self._x
+
+        # Joseph form: P = (I - K H) P (I - K H)^T + K R K^T
+        A = buffers.A
+        np.subtract(buffers.I_measured, K, out=buffers.KR)
+        for i, state in enumerate(states):
+            A[:, state] = buffers.KR[:, i]
+        np.matmul(A, self.P, out=self._FP)
+        np.matmul(self._FP, A.T, out=self._P)
+        np.matmul(K, noise, out=buffers.KR)
+        np.matmul(buffers.KR, Kt, out=self._FP)
+        self._P += self._FP
+        # Remove the rounding asymmetry
+        np.add(self._P, self._P.T, out=self._FP)
+        self._FP *= 0.5
+        self.P, self._FP = self._FP, self.P
+        return True
+
+# Event kinds of the TimedEKF history
+EVENT_ACCEL = 0
+EVENT_GPS = 1
+EVENT_HEADING = 2
+
+class TimedEKF(EKF):
+    """
+    EKF driven by the timestamps of its inputs instead of a fixed dt.
+
+    Accelerometer samples (at IMU rate), GPS fixes and compass headings are
+    fed in with the time.monotonic() time they were measured. Each input
+    first predicts the state from its current time to the input's time, then
+    is applied. Accelerometer samples are body frame (x forward, y left);
+    they are rotated into east/north by the filtered heading and replace the
+    acceleration states with variance ACCEL_VARIANCE, so the acceleration is
+    held as a known input until the next sample rather than integrated into
+    itself. P0 and process_noise default to TIMED_EKF_P0 and TIMED_EKF_Q,
+    which are tuned for that model; the legacy Q and P_est are left to
+    ekf_predict()/ekf_update(). Every input and the state after it is kept
+    for history_seconds (up to history_size inputs); an input older than the
+    state, like a GPS fix that arrives after IMU samples taken later, rewinds
+    the state to the last input before it and replays everything after it in
+    time order. Inputs older than the history are dropped. pose_at()
+    extrapolates the state to the present without changing it.
+    """
+
+    def __init__(self, x0, timestamp, P0=TIMED_EKF_P0, process_noise=TIMED_EKF_Q, measurement_noise=R,
+                 step=dt, history_seconds=1.0, history_size=512):
+        super().__init__(x0, P0, process_noise, measurement_noise, step)
+        self.timestamp = timestamp
+        # R is ordered like MEASURED_STATES: x, y, theta
+        self.gps_noise = self.R[:2, :2].copy()
+        self.heading_noise = self.R[2:, 2:].copy()
+        self.history_seconds = history_seconds
+        self.replays = 0
+        self.dropped = 0
+        # Ring of inputs and the state after each
+        self._size = history_size
+        self._start = 0
+        self._count = 0
+        self._times = np.zeros(history_size)
+        self._kinds = np.zeros(history_size, dtype=np.int8)
+        self._values = np.zeros((history_size, 2))
+        self._xs = np.zeros((history_size, 7, 1))
+        self._Ps = np.zeros((history_size, 7, 7))
+        self._pose = np.empty((7, 1))
+
+    def accel(self, timestamp, accel_data):
+        """Body frame acceleration (m/s^2, x forward, y left) measured at timestamp."""
+        return self._add(timestamp, EVENT_ACCEL, accel_data[0], accel_data[1])
+
+    def gps(self, timestamp, x, y):
+        """GPS position in meters measured at timestamp."""
+        return self._add(timestamp, EVENT_GPS, x, y)
+
+    def heading(self, timestamp, theta):
+        """Compass heading in radians measured at timestamp."""
+        return self._add(timestamp, EVENT_HEADING, theta, 0.0)
+
+    def _apply(self, timestamp, kind, a, b):
+        step = timestamp - self.timestamp
+        if step > 0:
+            self.predict(NO_ACCEL, step)
+            self.timestamp = timestamp
+        if kind == EVENT_ACCEL:
+            # Heading is clockwise from north: forward is (sin, cos) and left
+            # is (-cos, sin) in east/north
+            theta = self.x[6, 0]
+            sin, cos = math.sin(theta), math.cos(theta)
+            self.x[4, 0] = a * sin - b * cos
+            self.x[5, 0] = a * cos + b * sin
+            self.P[4:6, :] = 0.0
+            self.P[:, 4:6] = 0.0
+            self.P[4, 4] = self.P[5, 5] = ACCEL_VARIANCE
+        elif kind == EVENT_GPS:
+            self.correct((a, b), POSITION_STATES, self.gps_noise)
+        else:
+            self.correct((a,), HEADING_STATES, self.heading_noise)
+
+        # Record the input and the state after it
+        if self._count == self._size:
+            self._start = (self._start + 1) % self._size
+            self._count -= 1
+        i = (self._start + self._count) % self._size
+        self._count += 1
+        self._times[i] = timestamp
+        self._kinds[i] = kind
+        self._values[i] = a, b
+        self._xs[i] = self.x
+        self._Ps[i] = self.P
+        # Forget what is too old to be replayed
+        while self._count > 1 and timestamp - self._times[self._start] > self.history_seconds:
+            self._start = (self._start + 1) % self._size
+            self._count -= 1
+
+    def _add(self, timestamp, kind, a, b):
+        if timestamp >= self.timestamp:
+            self._apply(timestamp, kind, a, b)
+            return True
+
+        # Out of sequence: find the last recorded input at or before it
+        k = self._count - 1
+        while k >= 0 and self._times[(self._start + k) % self._size] > timestamp:
+            k -= 1
+        if k < 0:
+            self.dropped += 1
+            return False
+        self.replays += 1
+        later = []
+        for j in range(k + 1, self._count):
+            i = (self._start + j) % self._size
+            later.append((self._times[i], self._kinds[i], self._values[i, 0], self._values[i, 1]))
+        i = (self._start + k) % self._size
+        self._count = k + 1
+        self.timestamp = self._times[i]
+        np.copyto(self.x, self._xs[i])
+        np.copyto(self.P, self._Ps[i])
+
+        self._apply(timestamp, kind, a, b)
+        for event in later:
+            self._apply(*event)
+        return True
+
+    def pose_at(self, timestamp):
+        """
+        (x, y, theta) extrapolated from the latest state to timestamp with
+        the held acceleration, for a smooth pose between inputs.
+        """
+        step = timestamp - self.timestamp
+        if step <= 0:
+            return self.x[0, 0], self.x[1, 0], self.x[6, 0]
+        F = self._transition(step)[0]
+        np.matmul(F, self.x, out=self._pose)
+        return self._pose[0, 0], self._pose[1, 0], self._pose[6, 0]
+
+def steering_command(min_angle):
+    """
+    Maps the heading error (degrees, positive when the goal is clockwise of the
+    heading) to (front_back_command, side_side_command). Side commands are
+    0-126 with 64 as center and larger values steering left.
+    """
+    steer = max(-1.0, min(1.0, min_angle / MAX_STEER_ANGLE))
+    side_side_command = int(round(64 - steer * 62))
+    if abs(min_angle) > TURN_IN_PLACE_ANGLE:
+        front_back_command = 64  # Turn towards the path before driving
+    else:
+        front_back_command = FORWARD_COMMAND
+    return front_back_command, side_side_command
+
+def publish_command(client, front_back_command, side_side_command):
+    command_string = f"{front_back_command} {side_side_command}"
+    client.publish("robot/control", command_string)
+
+def build_path(start_xy):
+    """
+    (N, 2) array of path points in meters, from the robot's start position
+    through the waypoints, converted in one call.
+    """
+    return np.vstack([start_xy, to_xy_array(projection, waypoints)])
+
+def auto_navigation_process(command_queue, client, stop_event, sampler=None, heading_source=None,
+                            gps_source=None, pose_queue=None, clock=time, ready_event=None,
+                            active_event=None, start_active=True, estop_event=None):
+    """
+    Fixed-rate pure pursuit tracker. Every dt seconds it runs the EKF
+    prediction (and an update when a new GPS fix arrived), finds the goal
+    point on the waypoint path and publishes a robot/control command.
+    The estimated pose and loop timing stats are put on pose_queue as
+    ('pose', dict) and ('stats', dict) messages when one is given, and
+    ('arrived', dict) when the final waypoint is reached.
+    clock provides monotonic() and sleep() and defaults to the time module.
+
+    Meant to run as one long-lived worker: ('activate', None) and
+    ('deactivate', None) on command_queue start and stop tracking without
+    leaving the process. An inactive worker publishes nothing and blocks on
+    the queue, so it wakes as soon as a message arrives. Waypoints sent while
+    inactive are kept until activation; deactivating or ('estop', None) stops
+    the robot and drops the mission. ready_event is set once the sensors are
+    set up and active_event mirrors the active state. stop_event ends the
+    worker. While estop_event is set the loop publishes a stop instead of
+    drive commands.
+    """
+    global waypoints, ref_lat, ref_lon, x_est, P_est, imu_sampler, heading_service
+    global acc_calibration, gps_reader
+    imu_sampler = sampler
+    if imu_sampler is None and IMU.driver is None:
+        # Started on its own rather than forked from the central script
+        if IMU.detectIMU() is None:
+            logging.error("No BerryIMU found; auto-navigation cannot run.")
+            return
+        IMU.initIMU()
+    acc_calibration = load_calibration(IMU.BerryIMUversion, 'acc')
+    heading_service = heading_source
+    if heading_service is None:
+        heading_service = HeadingService(imu_sampler, acc_calibration=acc_calibration,
+                                         mag_calibration=load_calibration(IMU.BerryIMUversion, 'mag'),
+                                         read_sample=IMU.readAll)
+    gps_reader = gps_source
+    if gps_reader is None:
+        gps_reader = GPSReader()
+        gps_reader.start()
+
+    ekf = None
+    path = None
+    path_index = None
+    location = None
+    pending_waypoints = None
+    last_found_index = 0
+    last_fix_timestamp = None
+    last_imu_timestamp = None
+    last_heading_timestamp = None
+    stopped = True
+    active = start_active
+    message = None  # Control message taken off the queue while waiting for the next tick
+    if active_event is not None:
+        if active:
+            active_event.set()
+        else:
+            active_event.clear()
+    if ready_event is not None:
+        ready_event.set()
+
+    period = dt
+    next_tick = clock.monotonic()
+    report_start = next_tick
+    report_ticks = 0
+    report_overruns = 0
+    work_total = 0.0
+    work_max = 0.0
+    late_max = 0.0
+    cross_track_max = 0.0
 
     while not stop_event.is_set():
-        if not command_queue.empty():
-            command, data = command_queue.get()
-            if command == 'set_waypoints':
-                coordinates = data
-                waypoints = [(point['lat'], point['lng']) for point in coordinates]
-                if waypoints:
-                    ref_lat, ref_lon = waypoints[0]
-                    initialize_projection(ref_lat, ref_lon)
-                    initial_x, initial_y = latlon_to_xy(ref_lat, ref_lon)
-                    initial_theta = calculate_heading()
-                    initialize_ekf(initial_x, initial_y, initial_theta)
-                    logging.info("Waypoints set for auto-navigation.")
+        if active:
+            tick_start = clock.monotonic()
+            late_max = max(late_max, tick_start - next_tick)
+            if message is not None:
+                (command, data), message = message, None
+            else:
+                try:
+                    command, data = command_queue.get_nowait()
+                except queue.Empty:
+                    command = None
+        else:
+            try:
+                command, data = command_queue.get(timeout=IDLE_POLL)
+            except queue.Empty:
+                command = None
+
+        if command == 'set_waypoints':
+            pending_waypoints = data
+        elif command == 'activate' and not active:
+            active = True
+            # Restart the schedule and the report period from now
+            tick_start = next_tick = report_start = clock.monotonic()
+            report_ticks = report_overruns = 0
+            work_total = work_max = late_max = cross_track_max = 0.0
+            if active_event is not None:
+                active_event.set()
+            logging.info("Auto-navigation activated.")
+        elif command in ('deactivate', 'estop'):
+            if not stopped or command == 'estop':
+                publish_command(client, 64, 64)  # Stop, neutral steering
+            stopped = True
+            ekf = None
+            path = None
+            path_index = None
+            location = None
+            pending_waypoints = None
+            waypoints = []
+            if active:
+                active = False
+                if active_event is not None:
+                    active_event.clear()
+                logging.info("Auto-navigation deactivated.")
+        if not active:
+            continue
+
+        if pending_waypoints is not None:
+            coordinates = pending_waypoints
+            pending_waypoints = None
+            waypoints = [(point['lat'], point['lng']) for point in coordinates]
+            if waypoints:
+                ref_lat, ref_lon = waypoints[0]
+                # Start from the robot's own fix when there is one
+                lat, lon = receive_gps_data()
+                if lat is None:
+                    lat, lon = ref_lat, ref_lon
+                initialize_projection(ref_lat, ref_lon, waypoints + [(lat, lon)])
+                initial_x, initial_y = latlon_to_xy(lat, lon)
+                initial_theta = heading_service.heading()
+                initialize_ekf(initial_x, initial_y, initial_theta)
+                ekf = TimedEKF(x_est, clock.monotonic())
+                last_imu_timestamp = last_heading_timestamp = ekf.timestamp
+                path = build_path((initial_x, initial_y))
+                path_index = SegmentIndex(path)
+                last_found_index = 0
+                last_fix_timestamp = None
+                logging.info("Waypoints set for auto-navigation.")
+            else:
+                logging.error("No waypoints received.")
+
+        if path is not None:
+            fix = gps_reader.latest()
+            now = clock.monotonic()
+            heading_timestamp, heading, heading_stale = heading_service.heading_status()
+            if estop_event is not None and estop_event.is_set():
+                if not stopped:
+                    logging.warning("E-stop active; auto-navigation holds the robot.")
+                    publish_command(client, 64, 64)
+                    stopped = True
+            elif fix is None or fix['mode'] < 2 or now - fix['timestamp'] > GPS_TIMEOUT:
+                # Hold still rather than drive on dead reckoning alone
+                if not stopped:
+                    logging.warning("GPS fix lost; stopping until it returns.")
+                    publish_command(client, 64, 64)
+                    stopped = True
+            elif heading_stale:
+                # The IMU sampler stalled and this process may not read the bus
+                if not stopped:
+                    logging.warning("Heading is stale; stopping until the IMU sampler recovers.")
+                    publish_command(client, 64, 64)
+                    stopped = True
+            else:
+                # Feed every input at the time it was measured; the filter
+                # replays its history for the ones that arrive late
+                samples = read_accelerometer_samples(last_imu_timestamp)
+                if samples is None:
+                    ekf.accel(now, get_accelerometer_data())
+                elif len(samples[0]):
+                    for timestamp, accel in zip(samples[0].tolist(), samples[1].tolist()):
+                        ekf.accel(timestamp, accel)
+                    last_imu_timestamp = samples[0][-1]
+                if heading_timestamp > last_heading_timestamp:
+                    ekf.heading(heading_timestamp, math.radians(heading))
+                    last_heading_timestamp = heading_timestamp
+                if fix['timestamp'] != last_fix_timestamp:
+                    gps_x, gps_y = latlon_to_xy(fix['lat'], fix['lon'])
+                    ekf.gps(fix['timestamp'], gps_x, gps_y)
+                    last_fix_timestamp = fix['timestamp']
+                x_est, P_est = ekf.x, ekf.P
+
+                # Extrapolated to now, so the pose moves smoothly between GPS fixes
+                pose_x, pose_y, pose_theta = ekf.pose_at(now)
+                current_pos = (pose_x, pose_y)
+                if (last_found_index >= len(path) - 2 and
+                        pt_to_pt_distance(current_pos, path[-1]) < GOAL_TOLERANCE):
+                    logging.info("Final waypoint reached; auto-navigation finished.")
+                    publish_command(client, 64, 64)
+                    if pose_queue is not None:
+                        pose_queue.put(('arrived', {'timestamp': now}))
+                    stopped = True
+                    path = None
+                    path_index = None
+                    location = None
+                    waypoints = []
                 else:
-                    logging.error("No waypoints received.")
-            elif command == 'estop':
-                stop_event.set()
-                front_back_command = 64  # Stop
-                side_side_command = 64    # Neutral steering
-                command_string = f"{front_back_command} {side_side_command}"
-                client.publish("robot/control", command_string)
+                    goal_point, last_found_index, location = find_goal_point_indexed(path_index, current_pos,
+                                                                                     LOOK_AHEAD_DISTANCE,
+                                                                                     last_found_index)
+                    # Bearing clockwise from north, the same convention as the compass heading
+                    target_angle = math.degrees(math.atan2(goal_point[0] - current_pos[0],
+                                                           goal_point[1] - current_pos[1])) % 360
+                    min_angle = find_min_angle(target_angle, heading)
+                    front_back_command, side_side_command = steering_command(min_angle)
+                    publish_command(client, front_back_command, side_side_command)
+                    stopped = False
+                    if location is not None:
+                        cross_track_max = max(cross_track_max, abs(location['cross_track']))
+
+                if pose_queue is not None:
+                    est_lat, est_lon = xy_to_latlon(*current_pos)
+                    pose_queue.put(('pose', {
+                        'timestamp': now,
+                        'lat': est_lat,
+                        'lon': est_lon,
+                        'theta': math.degrees(pose_theta) % 360,
+                        'goal_index': last_found_index,
+                        'cross_track': location['cross_track'] if location else None,
+                        'progress': location['progress'] if location else None,
+                        'remaining': location['remaining'] if location else None,
+                    }))
+
+        # Deadline based scheduling so work time does not stretch the period
+        work = clock.monotonic() - tick_start
+        work_total += work
+        work_max = max(work_max, work)
+        report_ticks += 1
+        next_tick += period
+        delay = next_tick - clock.monotonic()
+        if delay > 0:
+            if clock is time:
+                # Wait on the queue instead of sleeping so a deactivate or
+                # estop is handled at once rather than on the next tick.
+                # Waypoints are kept for the next tick, which stays on schedule
+                while delay > 0:
+                    try:
+                        command, data = command_queue.get(timeout=delay)
+                    except queue.Empty:
+                        break
+                    if command in ('deactivate', 'estop'):
+                        message = (command, data)
+                        break
+                    if command == 'set_waypoints':
+                        pending_waypoints = data
+                    delay = next_tick - clock.monotonic()
+            else:
+                clock.sleep(delay)
         else:
-            if not waypoints:
-                time.sleep(0.1)
-                continue
-            # Auto-navigation logic here
-            # Implement the track_robot function from your original script
-            # For brevity, the function is not included here
-            # You can adapt it to fit into this process
-            time.sleep(0.1)
+            # Missed the slot; skip ahead instead of bursting to catch up
+            report_overruns += 1
+            next_tick = clock.monotonic()
+
+        now = clock.monotonic()
+        if now - report_start >= STATS_INTERVAL:
+            stats = {
+                'rate_hz': 1.0 / period,
+                'achieved_hz': report_ticks / (now - report_start),
+                'work_ms_mean': work_total / report_ticks * 1000,
+                'work_ms_max': work_max * 1000,
+                'late_ms_max': late_max * 1000,
+                'overruns': report_overruns,
+                'ekf_replays': ekf.replays if ekf is not None else 0,
+                'ekf_dropped': ekf.dropped if ekf is not None else 0,
+                'cross_track_max': cross_track_max,
+            }
+            if report_overruns:
+                logging.warning(f"Navigation loop overran {report_overruns} times in the last "
+                                f"{now - report_start:.1f}s, achieved {stats['achieved_hz']:.1f} Hz")
+            if pose_queue is not None:
+                pose_queue.put(('stats', stats))
+            report_start = now
+            report_ticks = 0
+            report_overruns = 0
+            work_total = 0.0
+            work_max = 0.0
+            late_max = 0.0
+            cross_track_max = 0.0
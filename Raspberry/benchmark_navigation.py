@@ -0,0 +1,505 @@
+# benchmark_navigation.py
+#
+# Benchmark suite for the navigation stack: the pure pursuit geometry, the
+# goal point searches, the segment index, the EKF variants and coordinate
+# projection, across path sizes from 10 to 100k waypoints, plus the cost of
+# one navigation tick against its budget (half of dt by default). Results are
+# written as JSON. Against a stored baseline the run is a regression check:
+# the exit status is 1 when a case got more than --threshold slower (after
+# scaling by a reference workload timed on both runs) or a tick is over budget.
+# Without a baseline nothing is compared; --require-baseline makes that a
+# failure too, for a check that must not pass vacuously.
+#
+# Store the baseline on the machine it will be checked on, then compare:
+#   python3 benchmark_navigation.py --save-baseline
+#   python3 benchmark_navigation.py --require-baseline --output results.json
+#   python3 benchmark_navigation.py --only ekf --only find_goal_point --sizes 10,1000
+
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+# IMU.py opens the I2C bus on import; no case reads the IMU, so an emulated
+# bus is enough and the suite runs the same on and off the robot
+os.environ.setdefault('IMU_BUS', 'fake:lsm6dsl')
+
+import auto_navigation as nav
+from projection import ENUProjection, UTMProjection, to_xy_array
+from segment_index import SegmentIndex
+
+SIZES = (10, 100, 1000, 10000, 100000)
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+REF_LAT, REF_LON = 35.0, -86.0
+
+
+def _time_call(fn, min_time=0.05, repeat=7):
+    """
+    Microseconds per call of fn(): the best of `repeat` runs of at least
+    min_time seconds each, with garbage collection off as in timeit.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+            number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+        best = elapsed / number
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            best = min(best, (time.perf_counter() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+    return best * 1e6
+
+
+def _reference_workload():
+    # Fixed mix of interpreter and small-array work, the kind the navigation code does
+    total = 0.0
+    for i in range(200):
+        total += math.hypot(i, total % 7.0)
+    a = np.arange(64.0).reshape(8, 8)
+    for _ in range(20):
+        a = a @ a.T * 1e-3
+    return total
+
+
+def calibrate(min_time=0.05, repeat=7):
+    """Microseconds for _reference_workload(); compare() uses it to take out machine speed drift."""
+    return _time_call(_reference_workload, min_time, repeat)
+
+
+def serpentine_path(size, spacing=1.0, row_length=50.0, row_spacing=2.0):
+    """(size, 2) coverage path in meters with a waypoint every `spacing` meters."""
+    per_row = int(row_length / spacing) + 1
+    rows = []
+    for row in range(math.ceil(size / per_row)):
+        y = np.linspace(0.0, row_length, per_row)
+        rows.append(np.column_stack([np.full(per_row, row * row_spacing), y if row % 2 == 0 else y[::-1]]))
+    return np.vstack(rows)[:size]
+
+
+def _near(path, index):
+    """A point 0.3 m beside path[index], inside the look-ahead circle of the segments there."""
+    return (path[index][0] + 0.3, path[index][1] + 0.2)
+
+
+# Each case takes a path size and returns the function to time; the EKF
+# cases do not depend on the path and run once
+
+def case_line_circle_intersection(size):
+    path = serpentine_path(size)
+    position = _near(path, size // 2)
+    segments = list(zip(path[:-1].tolist(), path[1:].tolist()))
+
+    def run():
+        for pt1, pt2 in segments:
+            nav.line_circle_intersection(position, pt1, pt2, nav.LOOK_AHEAD_DISTANCE)
+    return run
+
+
+def case_find_goal_point_tracking(size):
+    path = serpentine_path(size)
+    path_list = path.tolist()
+    position = _near(path, 0)
+    return lambda: nav.find_goal_point(path_list, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_find_goal_point_recovery(size):
+    # Robot near the end of the path with the search starting at the beginning
+    path = serpentine_path(size)
+    path_list = path.tolist()
+    position = _near(path, size - 2)
+    return lambda: nav.find_goal_point(path_list, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_find_goal_point_vectorized_tracking(size):
+    path = serpentine_path(size)
+    position = _near(path, 0)
+    return lambda: nav.find_goal_point_vectorized(path, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_find_goal_point_vectorized_recovery(size):
+    path = serpentine_path(size)
+    position = _near(path, size - 2)
+    return lambda: nav.find_goal_point_vectorized(path, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_find_goal_point_indexed_tracking(size):
+    path = serpentine_path(size)
+    index = SegmentIndex(path)
+    position = _near(path, 0)
+    return lambda: nav.find_goal_point_indexed(index, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_find_goal_point_indexed_recovery(size):
+    path = serpentine_path(size)
+    index = SegmentIndex(path)
+    position = _near(path, size - 2)
+    return lambda: nav.find_goal_point_indexed(index, position, nav.LOOK_AHEAD_DISTANCE, 0)
+
+
+def case_segment_index_build(size):
+    path = serpentine_path(size)
+    return lambda: SegmentIndex(path)
+
+
+def _latlon(size):
+    path = serpentine_path(size)
+    lat, lon = ENUProjection(REF_LAT, REF_LON).to_latlon(path[:, 0], path[:, 1])
+    return np.column_stack([lat, lon])
+
+
+def case_projection_enu_array(size):
+    latlon = _latlon(size)
+    projection = ENUProjection(REF_LAT, REF_LON)
+    return lambda: to_xy_array(projection, latlon)
+
+
+def case_projection_utm_array(size):
+    latlon = _latlon(size)
+    projection = UTMProjection(REF_LAT, REF_LON)
+    return lambda: to_xy_array(projection, latlon)
+
+
+def case_projection_utm_points(size):
+    # One call per point, as the waypoint loop did before the array call
+    points = _latlon(size).tolist()
+    projection = UTMProjection(REF_LAT, REF_LON)
+
+    def run():
+        for lat, lon in points:
+            projection.to_xy(lat, lon)
+    return run
+
+
+def _filter_inputs():
+    nav.initialize_ekf(0.0, 0.0, 30.0)
+    return nav.x_est.copy(), nav.P_est.copy(), (0.1, -0.05), np.array([[1.0], [2.0], [0.5]])
+
+
+def case_ekf_predict_legacy():
+    x, P, accel, z = _filter_inputs()
+    return lambda: nav.ekf_predict(x, P, accel)
+
+
+def case_ekf_update_legacy():
+    x, P, accel, z = _filter_inputs()
+    return lambda: nav.ekf_update(x, P, z)
+
+
+def case_ekf_predict():
+    x, P, accel, z = _filter_inputs()
+    ekf = nav.EKF(x, P)
+    return lambda: ekf.predict(accel)
+
+
+def case_ekf_update():
+    x, P, accel, z = _filter_inputs()
+    ekf = nav.EKF(x, P)
+
+    def run():
+        # Start every update from the same covariance so it cannot converge away
+        ekf.P[:] = P
+        ekf.update(z)
+    return run
+
+
+def case_timed_ekf_input():
+    # One second of inputs at navigation rates: 50 accel samples, 50 headings, 5 GPS fixes
+    x, P, accel, z = _filter_inputs()
+    events = []
+    for i in range(50):
+        events.append(('accel', i * 0.02, accel))
+        events.append(('heading', i * 0.02 + 0.001, 0.5))
+        if i % 10 == 0:
+            events.append(('gps', i * 0.02 + 0.005, 1.0, 2.0))
+
+    def run():
+        ekf = nav.TimedEKF(x, 0.0, P)
+        for kind, timestamp, *values in events:
+            getattr(ekf, kind)(timestamp, *values)
+    return run, len(events)
+
+
+def case_navigation_tick(size):
+    # What one tick of auto_navigation_process() computes at 50 Hz IMU and
+    # 5 Hz GPS: 5 accel samples, a heading, a fix every other tick, the goal
+    # search, the steering command and the pose back in lat/lon
+    x, P, accel, z = _filter_inputs()
+    path = serpentine_path(size)
+    index = SegmentIndex(path)
+    nav.projection = ENUProjection(REF_LAT, REF_LON)
+    ekf = nav.TimedEKF(x, 0.0, P)
+    position = _near(path, size // 2)
+    state = {'now': 0.0, 'ticks': 0, 'last_found_index': max(size // 2 - 2, 0)}
+
+    def run():
+        now = state['now'] = state['now'] + nav.dt
+        state['ticks'] += 1
+        for k in range(5):
+            ekf.accel(now - 0.08 + k * 0.02, accel)
+        ekf.heading(now - 0.005, 0.5)
+        if state['ticks'] % 2 == 0:
+            ekf.gps(now - 0.05, position[0], position[1])
+        pose_x, pose_y, pose_theta = ekf.pose_at(now)
+        goal_point, index_found, location = nav.find_goal_point_indexed(
+            index, position, nav.LOOK_AHEAD_DISTANCE, state['last_found_index'])
+        target_angle = math.degrees(math.atan2(goal_point[0] - position[0], goal_point[1] - position[1])) % 360
+        nav.steering_command(nav.find_min_angle(target_angle, 30.0))
+        nav.xy_to_latlon(pose_x, pose_y)
+    return run
+
+
+SIZED_CASES = {
+    'line_circle_intersection': case_line_circle_intersection,
+    'find_goal_point_tracking': case_find_goal_point_tracking,
+    'find_goal_point_recovery': case_find_goal_point_recovery,
+    'find_goal_point_vectorized_tracking': case_find_goal_point_vectorized_tracking,
+    'find_goal_point_vectorized_recovery': case_find_goal_point_vectorized_recovery,
+    'find_goal_point_indexed_tracking': case_find_goal_point_indexed_tracking,
+    'find_goal_point_indexed_recovery': case_find_goal_point_indexed_recovery,
+    'segment_index_build': case_segment_index_build,
+    'projection_enu_array': case_projection_enu_array,
+    'projection_utm_array': case_projection_utm_array,
+    'projection_utm_points': case_projection_utm_points,
+    'navigation_tick': case_navigation_tick,
+}
+
+FIXED_CASES = {
+    'ekf_predict_legacy': case_ekf_predict_legacy,
+    'ekf_update_legacy': case_ekf_update_legacy,
+    'ekf_predict': case_ekf_predict,
+    'ekf_update': case_ekf_update,
+    'timed_ekf_input': case_timed_ekf_input,
+}
+
+
+def _inputs(steps, seed):
+    rng = np.random.default_rng(seed)
+    accel = rng.normal(scale=0.2, size=(steps, 2))
+    # GPS positions near a slow straight track, compass headings around 30 degrees
+    track = np.cumsum(rng.normal(scale=0.05, size=(steps, 2)), axis=0)
+    gps = track + rng.normal(scale=3.0, size=(steps, 2))
+    theta = np.radians(30.0 + rng.normal(scale=5.0, size=steps))
+    return accel.tolist(), [(x, y, t) for (x, y), t in zip(gps.tolist(), theta.tolist())]
+
+
+def benchmark_ekf(steps=20000, seed=0):
+    """
+    Runs `steps` predict and update steps through both implementations and
+    returns the mean microseconds per step and the largest state and
+    covariance difference between them.
+    """
+    accel, measurements = _inputs(steps, seed)
+    nav.initialize_ekf(0.0, 0.0, 30.0)
+    x0, P0 = nav.x_est.copy(), nav.P_est.copy()
+
+    x, P = x0, P0
+    predict_time = update_time = 0.0
+    for a, z in zip(accel, measurements):
+        start = time.perf_counter()
+        x, P = nav.ekf_predict(x, P, a)
+        middle = time.perf_counter()
+        x, P = nav.ekf_update(x, P, np.array(z).reshape(3, 1))
+        predict_time += middle - start
+        update_time += time.perf_counter() - middle
+    legacy = {'predict_us': predict_time / steps * 1e6, 'update_us': update_time / steps * 1e6}
+
+    ekf = nav.EKF(x0, P0)
+    predict_time = update_time = 0.0
+    for a, z in zip(accel, measurements):
+        start = time.perf_counter()
+        ekf.predict(a)
+        middle = time.perf_counter()
+        ekf.update(z)
+        predict_time += middle - start
+        update_time += time.perf_counter() - middle
+    current = {'predict_us': predict_time / steps * 1e6, 'update_us': update_time / steps * 1e6}
+
+    return {
+        'steps': steps,
+        'legacy': legacy,
+        'ekf': current,
+        'max_state_diff': float(np.max(np.abs(ekf.x - x))),
+        'max_covariance_diff': float(np.max(np.abs(ekf.P - P))),
+    }
+
+
+def time_case(name, size=None, min_time=0.05, repeat=7):
+    """Times one case and returns its {'name', 'size', 'us'} record."""
+    fn = FIXED_CASES[name]() if size is None else SIZED_CASES[name](size)
+    record = {'name': name, 'size': size}
+    if isinstance(fn, tuple):
+        fn, inputs = fn
+        record['us'] = _time_call(fn, min_time, repeat)
+        record['per_input_us'] = record['us'] / inputs
+    else:
+        record['us'] = _time_call(fn, min_time, repeat)
+    return record
+
+
+def run_suite(sizes=SIZES, only=None, min_time=0.05, repeat=7, progress=None):
+    """
+    Times every case whose name starts with one of `only` (all if None) and
+    returns a list of time_case() records; 'per_input_us' is added for the
+    TimedEKF case. Sizes do not apply to the EKF cases.
+    """
+    cases = [(name, None) for name in FIXED_CASES]
+    cases += [(name, size) for name in SIZED_CASES for size in sizes]
+    results = []
+    for name, size in cases:
+        if only is not None and not any(name.startswith(prefix) for prefix in only):
+            continue
+        record = time_case(name, size, min_time, repeat)
+        results.append(record)
+        if progress:
+            progress(record)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'node': platform.node(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold=0.25, noise_floor_us=2.0, calibration_us=None):
+    """
+    Returns (name, size, baseline_us, us, ratio) for the cases that are more
+    than `threshold` (0.25 = 25%) slower than in the baseline, ignoring
+    differences under noise_floor_us. With calibration_us from this run and
+    one stored in the baseline, baseline times are first scaled by how much
+    slower the machine runs the reference workload now.
+    """
+    scale = 1.0
+    if calibration_us and baseline.get('calibration_us'):
+        scale = calibration_us / baseline['calibration_us']
+    reference = {(record['name'], record['size']): record['us'] * scale for record in baseline['results']}
+    regressions = []
+    for record in results:
+        key = (record['name'], record['size'])
+        if key not in reference:
+            continue
+        before = reference[key]
+        ratio = record['us'] / before if before > 0 else math.inf
+        if ratio > 1 + threshold and record['us'] - before > noise_floor_us:
+            regressions.append((record['name'], record['size'], before, record['us'], ratio))
+    return regressions
+
+
+def _format(record):
+    size = '' if record['size'] is None else f"n={record['size']}"
+    us = record['us']
+    value = f"{us / 1000:10.2f} ms" if us >= 1000 else f"{us:10.1f} us"
+    extra = f"  ({record['per_input_us']:.1f} us per input)" if 'per_input_us' in record else ''
+    return f"{record['name']:<38} {size:<9} {value}{extra}"
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the navigation stack")
+    parser.add_argument('--sizes', type=lambda text: [int(size) for size in text.split(',')], default=list(SIZES),
+                        help="comma separated path sizes (default: 10,100,1000,10000,100000)")
+    parser.add_argument('--only', action='append', help="run only cases whose name starts with this (repeatable)")
+    parser.add_argument('--min-time', type=float, default=0.05, help="seconds per timing run")
+    parser.add_argument('--repeat', type=int, default=7, help="timing runs per case, the best counts")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--require-baseline', action='store_true',
+                        help="fail when there is no baseline to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="fail when a case is this much slower than the baseline (0.25 = 25%%)")
+    parser.add_argument('--tick-budget', type=float, default=nav.dt * 1000 / 2,
+                        help="fail when a navigation tick takes longer, ms (default: half of dt)")
+    parser.add_argument('--check-ekf', action='store_true',
+                        help="also run both EKF implementations on the same data and compare them")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.only, args.min_time, args.repeat,
+                        progress=lambda record: print(_format(record), flush=True))
+    report = {'environment': environment(), 'calibration_us': calibrate(args.min_time, args.repeat),
+              'results': results}
+    if args.check_ekf:
+        result = report['ekf_equivalence'] = benchmark_ekf()
+        for name in ('legacy', 'ekf'):
+            timing = result[name]
+            print(f"{name:>6}: predict {timing['predict_us']:.1f} us, update {timing['update_us']:.1f} us, "
+                  f"step {timing['predict_us'] + timing['update_us']:.1f} us")
+        legacy_us = result['legacy']['predict_us'] + result['legacy']['update_us']
+        ekf_us = result['ekf']['predict_us'] + result['ekf']['update_us']
+        print(f"speedup {legacy_us / ekf_us:.2f}x, max difference: state {result['max_state_diff']:.2e}, "
+              f"covariance {result['max_covariance_diff']:.2e}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    over_budget = [record for record in results
+                   if record['name'] == 'navigation_tick' and record['us'] / 1000 > args.tick_budget]
+    for record in over_budget:
+        print(f"OVER BUDGET: navigation_tick n={record['size']} takes {record['us'] / 1000:.2f} ms, "
+              f"budget {args.tick_budget:.2f} ms")
+
+    regressions = []
+    missing_baseline = not args.save_baseline and not os.path.exists(args.baseline)
+    if missing_baseline:
+        status = "FAILED" if args.require_baseline else "Note"
+        print(f"{status}: no baseline at {args.baseline}, nothing compared "
+              f"(store one with --save-baseline)")
+    elif not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('machine') != platform.machine():
+            print(f"Note: baseline is from {baseline.get('environment', {}).get('machine')}, "
+                  f"this is {platform.machine()}")
+        calibration_us = report['calibration_us']
+        if baseline.get('calibration_us'):
+            print(f"Machine speed against the baseline: {baseline['calibration_us'] / calibration_us:.2f}x")
+        regressions = compare(results, baseline, args.threshold, calibration_us=calibration_us)
+        if regressions:
+            # Time the slow cases once more before failing, a busy CPU can
+            # hold back a single run
+            retimed = {(name, size) for name, size, *_ in regressions}
+            for i, record in enumerate(results):
+                if (record['name'], record['size']) in retimed:
+                    again = time_case(record['name'], record['size'], args.min_time, args.repeat)
+                    if again['us'] < record['us']:
+                        results[i] = again
+            regressions = compare(results, baseline, args.threshold, calibration_us=calibration_us)
+        for name, size, before, after, ratio in regressions:
+            size = '' if size is None else f" n={size}"
+            print(f"REGRESSION: {name}{size} {before:.1f} us -> {after:.1f} us ({ratio:.2f}x)")
+        if not regressions:
+            print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+    if args.output:
+        report['tick_budget_ms'] = args.tick_budget
+        report['over_budget'] = [record['size'] for record in over_budget]
+        report['baseline_compared'] = not args.save_baseline and not missing_baseline
+        report['regressions'] = [{'name': name, 'size': size, 'baseline_us': before, 'us': after, 'ratio': ratio}
+                                 for name, size, before, after, ratio in regressions]
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if over_budget or regressions or (missing_baseline and args.require_baseline) else 0)
@@ -9,7 +9,6 @@ import json
 import math
 import sys
 import base64
-import gpsd
 import os
 from datetime import datetime
 import serial
@@ -18,6 +17,15 @@ import csv
 #.py files
 import IMU  # Importing the IMU module
 import GUI
+from imu_sampler import IMUSampler
+from imu_calibration import load_calibration
+from ahrs import ComplementaryAHRS
+from heading_service import HeadingService
+from gps_reader import GPSReader
+from track_store import TrackStore, to_json_points
+from track_simplify import TrackSimplifier
+from telemetry import TelemetryHub
+from telemetry_log import TelemetryLog
 
 from flask import Flask, Response, jsonify, request, render_template_string
 import logging
@@ -37,6 +45,23 @@ MQTT_TOPIC_REMOTE_PUMP = "robot/remotepump"
 MQTT_TOPIC_IMU = "imu/data"
 MQTT_TOPIC_DATA = "moisture/data"
 
+# IMU sampling rate for the background sampler thread
+IMU_SAMPLE_RATE = 50  # Hz
+HEADING_MAX_AGE = 0.2  # Seconds before a cached heading is considered stale
+
+# gpsd connection for the background GPS reader
+GPSD_HOST = "127.0.0.1"
+GPSD_PORT = 2947
+
+# In-memory GPS track points before older halves are spilled to disk
+TRACK_CAPACITY = 20000
+
+# Fastest telemetry event rate per dashboard client
+TELEMETRY_MIN_INTERVAL = 0.05  # Seconds
+
+# Binary GPS/IMU/heading/command logs (see telemetry_log.py)
+ENABLE_TELEMETRY_LOG = True
+
 app = Flask(__name__)
 
 # Global variables
@@ -50,8 +75,18 @@ moisture_threshold = 100  # For pump control with moisture
 # GPS and heading data
 current_lat, current_lon = None, None
 robot_heading = 0.0
-gps_data = []
-gps_data_lock = threading.Lock()
+nav_estimate = None  # Latest EKF pose from auto navigation
+nav_stats = None     # Latest navigation loop timing report
+NAV_ESTIMATE_MAX_AGE = 1.0  # Seconds an EKF pose is shown after navigation stops sending
+NAV_SWITCH_TIMEOUT = 0.5    # Seconds /set_mode waits for the navigation worker to confirm
+gps_track = TrackStore(capacity=TRACK_CAPACITY)
+gps_track_lod = TrackSimplifier(gps_track)
+
+# State pushed to the dashboard over /telemetry_stream
+telemetry = TelemetryHub(min_interval=TELEMETRY_MIN_INTERVAL)
+
+# Append-only binary history for replay and analysis
+telemetry_log = TelemetryLog() if ENABLE_TELEMETRY_LOG else None
 
 # PID Controller Parameters
 w, h = 640, 480  # Frame dimensions for visualization (can be adjusted)
@@ -68,11 +103,15 @@ current_mode = 'basic_movement'  # Default mode
 command_queue = Queue()
 detection_queue = Queue()
 camera_frame_queue = Queue()
-gps_data_queue = Queue()
+gps_data_queue = Queue()  # ('pose', dict) and ('stats', dict) from auto_navigation_process
 imu_queue = Queue()
+nav_queue = Queue()  # set_waypoints, activate, deactivate and estop for the navigation worker
 
 # Events to control processes
-stop_event = Event()
+stop_event = Event()  # Ends the navigation worker
+nav_ready = Event()   # Set by the navigation worker once it is running
+nav_active = Event()  # Set while the navigation worker is tracking
+nav_estop = Event()   # Set while the e-stop is active; the navigation worker publishes no drive commands
 
 # CSV section
 
@@ -83,6 +122,14 @@ csv_file = open(filename, mode='a', newline='')
 writer = csv.writer(csv_file)
 if not file_exists:
     writer.writerow(['Timestamp', 'Mac Address', 'Data'])
+else:
+    # Show the last logged reading on the dashboard until a new one arrives
+    with open(filename, newline='') as f:
+        last_row = None
+        for last_row in csv.reader(f):
+            pass
+    if last_row and last_row[0] != 'Timestamp':
+        telemetry.publish(moisture={'timestamp': last_row[0], 'mac': last_row[1], 'value': last_row[2]})
     
 
 # Mainly for the Remote Pump Controls
@@ -107,11 +154,29 @@ pump_states = {
     "B": False,
     "C": False
 }
+
+telemetry.publish(mode=current_mode, e_stop=e_stop_active, pumps=dict(pump_states))
     
 
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        print(f"Connected to MQTT server {MQTT_SERVER} successfully.")
+        # Our own drive commands are subscribed to as well so every publisher gets logged
+        client.subscribe([(MQTT_TOPIC_DETECTIONS, 0),
+                          (MQTT_TOPIC_CAMERA, 0),
+                          (MQTT_TOPIC_DATA, 0),
+                          (MQTT_TOPIC_COMMAND, 0)])
+    else:
+        print(f"Failed to connect to MQTT server, return code {rc}")
+
 def on_message(client, userdata, msg):
     try:
-        if msg.topic == MQTT_TOPIC_DETECTIONS:
+        if msg.topic == MQTT_TOPIC_COMMAND:
+            if telemetry_log is not None:
+                front_back_command, side_side_command = map(int, msg.payload.decode().split())
+                telemetry_log.log('commands', time.monotonic(),
+                                  front=front_back_command, side=side_side_command)
+        elif msg.topic == MQTT_TOPIC_DETECTIONS:
             detection_data = json.loads(msg.payload.decode())
             detection_queue.put(detection_data)
         elif msg.topic == MQTT_TOPIC_CAMERA:
@@ -136,6 +201,7 @@ def on_message(client, userdata, msg):
             #print(f"Received | {timestamp}, {mac}, {value}")
             writer.writerow([timestamp, mac, value])
             csv_file.flush()
+            telemetry.publish(moisture={'timestamp': timestamp, 'mac': mac, 'value': value})
             
             cmd_value = int(value)
             
@@ -172,6 +238,7 @@ def on_message(client, userdata, msg):
                     print(f"[ZONE {zone}] Moisture good. Turning Pump OFF")
                     client.publish(MQTT_TOPIC_REMOTE_PUMP, pump_cmd)
                     pump_states[zone] = False
+                telemetry.publish(pumps=dict(pump_states))
                 
             else:
                 print(f"Unknown MAC address {mac}. Ignoring.")
@@ -188,72 +255,54 @@ client.connect(MQTT_SERVER, MQTT_PORT, 60)
 client.loop_start()
 
 # Initialize IMU
-IMU.detectIMU()
-if IMU.BerryIMUversion == 99:
+imu = IMU.detectIMU()
+if imu is None:
     print("No BerryIMU found... exiting")
     sys.exit()
-IMU.initIMU()
-
-# Connect to GPSD
-gpsd.connect()
-
-def calculate_heading():
-    """
-    Calculate the robot's heading using IMU readings.
-    Returns the heading in degrees.
-    """
-    ACCx = IMU.readACCx()
-    ACCy = IMU.readACCy()
-    ACCz = IMU.readACCz()
-    MAGx = IMU.readMAGx()
-    MAGy = IMU.readMAGy()
-    MAGz = IMU.readMAGz()
-
-    # Normalize accelerometer raw values.
-    acc_magnitude = math.sqrt(ACCx ** 2 + ACCy ** 2 + ACCz ** 2)
-    if acc_magnitude == 0:
-        print("Error: Accelerometer magnitude is zero.")
-        return 0
-    accXnorm = ACCx / acc_magnitude
-    accYnorm = ACCy / acc_magnitude
-
-    pitch = math.asin(accXnorm)
-    if math.cos(pitch) == 0:
-        roll = 0
-    else:
-        roll = -math.asin(accYnorm / math.cos(pitch))
-
-    # Tilt compensation
-    magXcomp = MAGx * math.cos(pitch) + MAGz * math.sin(pitch)
-    magYcomp = (MAGx * math.sin(roll) * math.sin(pitch) +
-               MAGy * math.cos(roll) -
-               MAGz * math.sin(roll) * math.cos(pitch))
-
-    heading = math.degrees(math.atan2(magYcomp, magXcomp))
-    if heading < 0:
-        heading += 360
-
-    return heading
+imu.init()
+
+# Hard/soft-iron and accelerometer corrections from imu_calibration.py
+mag_calibration = load_calibration(imu.version, 'mag')
+acc_calibration = load_calibration(imu.version, 'acc')
+
+# Poll the IMU off the control loop; consumers read from the ring buffer
+imu_sampler = IMUSampler(rate_hz=IMU_SAMPLE_RATE, read_sample=imu.readAll)
+
+# Gyro-fused heading, pitch and roll updated on every IMU sample
+ahrs = ComplementaryAHRS(imu.GYR_GAIN * imu.GYR_SIGN,
+                         acc_calibration=acc_calibration, mag_calibration=mag_calibration)
+imu_sampler.add_listener(ahrs.update)
+if telemetry_log is not None:
+    def log_imu_sample(timestamp, acc, gyr, mag):
+        telemetry_log.log('imu', timestamp, acc=acc, gyr=gyr, mag=mag)
+    imu_sampler.add_listener(log_imu_sample)
+imu_sampler.start()
+
+# Heading for every consumer, computed at most once per IMU sample
+heading_service = HeadingService(imu_sampler, ahrs, acc_calibration, mag_calibration,
+                                 read_sample=imu.readAll, max_age=HEADING_MAX_AGE)
+
+# Stream fixes from gpsd in the background; reads below never block on the socket
+gps_reader = GPSReader(GPSD_HOST, GPSD_PORT)
+if telemetry_log is not None:
+    def log_gps_fix(fix):
+        telemetry_log.log('gps', fix['timestamp'], lat=fix['lat'], lon=fix['lon'], mode=fix['mode'],
+                          hdop=fix['hdop'], speed=fix['speed'], track=fix['track'])
+    gps_reader.add_listener(log_gps_fix)
+gps_reader.start()
 
 def receive_gps_data():
     global current_lat, current_lon
-    try:
-        packet = gpsd.get_current()
-        if packet.mode >= 2:
-            current_lat = packet.lat
-            current_lon = packet.lon
-            return current_lat, current_lon
-        else:
-            return None, None
-    except Exception as e:
-        print(f"Error retrieving GPS data: {e}")
-        return None, None
+    lat, lon = gps_reader.position()
+    if lat is not None:
+        current_lat, current_lon = lat, lon
+    return lat, lon
 
 def main_loop():
         global latest_detection, latest_camera_frame
         global output_frame, lock, e_stop_active
-        global current_lat, current_lon, robot_heading, gps_data
-        global current_mode
+        global current_lat, current_lon, robot_heading
+        global current_mode, nav_estimate, nav_stats
         check = False
 
         # Initialize last_img with a black image
@@ -283,7 +332,10 @@ def main_loop():
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
                 # Optionally display IMU heading
-                imu_heading = calculate_heading()
+                imu_heading = heading_service.heading()
+                telemetry.publish(heading=round(imu_heading, 1))
+                if telemetry_log is not None:
+                    telemetry_log.log('heading', time.monotonic(), heading=imu_heading)
                 cv2.putText(img, f"IMU Heading: {imu_heading:.2f}", (10, 60),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
@@ -292,15 +344,34 @@ def main_loop():
                     cv2.putText(img, "E-STOP ACTIVE!", (10, 90),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
+                # Estimated pose and loop stats from auto navigation
+                while not gps_data_queue.empty():
+                    kind, data = gps_data_queue.get()
+                    if kind == 'pose':
+                        nav_estimate = data
+                    elif kind == 'stats':
+                        nav_stats = data
+                estimate = nav_estimate
+                if estimate is not None and time.monotonic() - estimate['timestamp'] > NAV_ESTIMATE_MAX_AGE:
+                    estimate = None
+                if estimate is not None and estimate.get('cross_track') is not None:
+                    telemetry.publish(path_progress={'cross_track': round(estimate['cross_track'], 2),
+                                                     'progress': round(estimate['progress'], 1),
+                                                     'remaining': round(estimate['remaining'], 1)})
+
                 # Update GPS data
                 current_lat, current_lon = receive_gps_data()
                 if current_lat is not None and current_lon is not None:
-                    with gps_data_lock:
-                        gps_data.append({
-                            'GPS_Lat': current_lat,
-                            'GPS_Lon': current_lon,
-                            'Heading': imu_heading
-                        })
+                    if estimate is not None:
+                        seq = gps_track.append(time.monotonic(), current_lat, current_lon, imu_heading,
+                                               estimate['lat'], estimate['lon'], estimate['theta'])
+                        pose = {'lat': estimate['lat'], 'lon': estimate['lon'],
+                                'heading': round(estimate['theta'], 1)}
+                    else:
+                        seq = gps_track.append(time.monotonic(), current_lat, current_lon, imu_heading)
+                        pose = {'lat': current_lat, 'lon': current_lon, 'heading': round(imu_heading, 1)}
+                    if seq is not None:
+                        telemetry.publish(pose=pose, track_seq=seq)
 
                 # Check for e-stop activation
                 if e_stop_active:
@@ -331,7 +402,7 @@ def main_loop():
                 elif current_mode == 'auto_navigation':
                     # Auto-Navigation Mode
                     check = False
-                    pass  # Handled by auto_navigation_process
+                    pass  # Handled by the navigation worker
                 elif current_mode == 'basic_movement':
                     # Basic Movement Mode
                     if not check:
@@ -401,7 +472,10 @@ def video_feed():
 def estop():
     global e_stop_active
     e_stop_active = True
+    telemetry.publish(e_stop=True)
     print("E-Stop activated!")
+    nav_estop.set()
+    nav_queue.put(('estop', None))  # Drops the mission; navigation stays off until re-enabled
     front_back_command = 64  # Stop
     side_side_command = 64   # Neutral steering
     command_string = f"{front_back_command} {side_side_command}"
@@ -412,7 +486,11 @@ def estop():
 def undo_estop():
     global e_stop_active
     e_stop_active = False
+    telemetry.publish(e_stop=False)
     print("E-Stop deactivated!")
+    nav_estop.clear()
+    if current_mode == 'auto_navigation':
+        nav_queue.put(('activate', None))  # Idle until new waypoints arrive
     return jsonify({"status": "E-Stop deactivated"})
 
 @app.route("/increase_face_area", methods=['POST'])
@@ -441,19 +519,76 @@ def move_center_right():
 
 @app.route('/get_gps_data', methods=['GET'])
 def get_gps_data_route():
-    with gps_data_lock:
-        if gps_data:
-            sanitized_gps_data = [{
-                'GPS_Lat': float(item.get('GPS_Lat', 0)),
-                'GPS_Lon': float(item.get('GPS_Lon', 0)),
-                'Heading': float(item.get('Heading', 0)),
-                'Estimated_Lat': float(item.get('Estimated_Lat', 0)),
-                'Estimated_Lon': float(item.get('Estimated_Lon', 0)),
-                'Estimated_Theta': float(item.get('Estimated_Theta', 0))
-            } for item in gps_data]
-        else:
-            sanitized_gps_data = []
-    return jsonify(sanitized_gps_data)
+    """
+    Without arguments returns the whole in-memory track as a list of points.
+    With ?since=<cursor> returns {points, cursor, reset}: only points newer
+    than the cursor (everything when reset is true, which means the client
+    should replace its track). Start with since=-1; a cursor from another run
+    answers with a reset. Both forms carry an ETag, so an unchanged track
+    answers 304.
+    With ?zoom=<leaflet zoom> or ?tolerance=<meters> the track is simplified
+    for that level and the reply also has a provisional `tail` that replaces
+    the previous one: the polyline is the settled points plus the tail.
+    """
+    since = request.args.get('since')
+    stale = False
+    if since is not None:
+        since = gps_track.parse_cursor(since)
+        stale = since is None
+        if stale:
+            since = -1
+    zoom = request.args.get('zoom', type=int)
+    tolerance = request.args.get('tolerance', type=float)
+    etag = f"{gps_track.run}-{gps_track.last_seq}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif zoom is not None or (tolerance is not None and tolerance > 0):
+        points, tail, cursor, reset = gps_track_lod.changes(-1 if since is None else since,
+                                                            tolerance=tolerance, zoom=zoom)
+        response = jsonify({'points': to_json_points(points), 'tail': to_json_points(tail),
+                            'cursor': gps_track.cursor(cursor), 'reset': reset or stale})
+    elif since is None:
+        points = gps_track.points()
+        if len(points):
+            etag = f"{gps_track.run}-{points['seq'][-1]}"
+        response = jsonify(to_json_points(points))
+    else:
+        points, cursor, reset = gps_track.changes(since)
+        etag = f"{gps_track.run}-{cursor}"
+        response = jsonify({'points': to_json_points(points), 'cursor': gps_track.cursor(cursor),
+                            'reset': reset or stale})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/imu_stats', methods=['GET'])
+def imu_stats():
+    return jsonify({**imu_sampler.stats(), 'ahrs': ahrs.snapshot()})
+
+@app.route('/nav_stats', methods=['GET'])
+def nav_stats_route():
+    return jsonify({'stats': nav_stats, 'estimate': nav_estimate,
+                    'ready': nav_ready.is_set(), 'active': nav_active.is_set()})
+
+@app.route('/gps_status', methods=['GET'])
+def gps_status():
+    fix = gps_reader.latest()
+    if fix is not None:
+        # NaN is not valid JSON; report missing fields as null
+        fix = {key: None if isinstance(value, float) and math.isnan(value) else value
+               for key, value in fix.items()}
+    return jsonify({'fix': fix, **gps_reader.stats()})
+
+@app.route('/telemetry_stream')
+def telemetry_stream():
+    """
+    Server-Sent Events stream of dashboard state. Each event is a JSON object
+    of the fields that changed; ?interval=<seconds> lowers this client's rate.
+    """
+    interval = request.args.get('interval', TELEMETRY_MIN_INTERVAL, type=float)
+    interval = min(max(interval, TELEMETRY_MIN_INTERVAL), 5.0)
+    return Response(telemetry.stream(interval), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/initial_gps', methods=['GET'])
 def initial_gps():
@@ -464,21 +599,36 @@ def initial_gps():
         print("Initial GPS data unavailable.")
         return jsonify({"lat": 0.0, "lon": 0.0})
 
+def wait_nav_active(active, timeout=NAV_SWITCH_TIMEOUT):
+    """Waits until the navigation worker reports the given active state; False on timeout."""
+    deadline = time.monotonic() + timeout
+    while nav_active.is_set() != active:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
 @app.route("/set_mode", methods=['POST'])
 def set_mode():
-    global current_mode, stop_event
+    global current_mode
     data = request.get_json()
     mode = data.get('mode', 'basic_movement')
     if mode in ['basic_movement', 'auto_navigation', 'face_tracking']:
         current_mode = mode
+        telemetry.publish(mode=current_mode)
         print(f"Mode set to {current_mode}")
-        if current_mode == 'auto_navigation':
-            stop_event.clear()
-            auto_nav_proc = Process(target=auto_navigation_process, args=(command_queue, client, stop_event))
-            auto_nav_proc.start()
-        else:
-            stop_event.set()  # Stop auto-navigation
-        return jsonify({"status": f"Mode set to {current_mode}"})
+        # The navigation worker runs all the time; switching only toggles it
+        active = current_mode == 'auto_navigation'
+        if active and e_stop_active:
+            # /undo_estop activates it once the e-stop is released
+            return jsonify({"status": f"Mode set to {current_mode}; navigation starts when the E-Stop is released",
+                            "navigation": {"ready": nav_ready.is_set(), "active": nav_active.is_set()}})
+        nav_queue.put(('activate' if active else 'deactivate', None))
+        if nav_ready.is_set() and not wait_nav_active(active):
+            logging.warning(f"Navigation worker did not {'activate' if active else 'deactivate'} "
+                            f"within {NAV_SWITCH_TIMEOUT}s")
+        return jsonify({"status": f"Mode set to {current_mode}",
+                        "navigation": {"ready": nav_ready.is_set(), "active": nav_active.is_set()}})
     else:
         print("Invalid mode selected")
         return jsonify({"status": "Invalid mode selected"}), 400
@@ -618,8 +768,11 @@ def update_pid():
 def receive_coordinates():
     data = request.get_json()
     coordinates = data.get('coordinates', [])
+    if e_stop_active:
+        # The e-stop dropped the mission; send the waypoints again after releasing it
+        return jsonify({"status": "E-Stop active, coordinates rejected"}), 400
     if coordinates:
-        command_queue.put(('set_waypoints', coordinates))
+        nav_queue.put(('set_waypoints', coordinates))
         return jsonify({"status": "Coordinates received"})
     else:
         return jsonify({"status": "No coordinates received"}), 400
@@ -630,9 +783,21 @@ if __name__ == '__main__':
     t = threading.Thread(target=main_loop)
     t.daemon = True
     t.start()
+    # Start the navigation worker once; /set_mode activates and deactivates it
+    nav_proc = Process(target=auto_navigation_process,
+                       args=(nav_queue, client, stop_event, imu_sampler, heading_service, gps_reader, gps_data_queue),
+                       kwargs={'ready_event': nav_ready, 'active_event': nav_active, 'start_active': False,
+                               'estop_event': nav_estop},
+                       daemon=True)
+    nav_proc.start()
     # Start face tracking process
     face_track_proc = Process(target=face_tracking_process, args=(command_queue, client))
     face_track_proc.start()
     # Start pump data log process
     # Run the Flask app
-    app.run(host='0.0.0.0', port=5000)
+    try:
+        app.run(host='0.0.0.0', port=5000)
+    finally:
+        stop_event.set()
+        if telemetry_log is not None:
+            telemetry_log.close()
@@ -0,0 +1,338 @@
+# fake_smbus.py
+#
+# SMBus stand-ins so IMU.py and everything built on it can run without a BerryIMU.
+#
+#   FakeSMBus       emulates the LSM9DS0, LSM9DS1 or LSM6DSL + LIS3MDL register maps
+#   RecordingSMBus  wraps a real bus and writes every transaction to a trace file
+#   ReplaySMBus     plays a recorded trace back
+#
+# Select one for IMU.py with the IMU_BUS environment variable, e.g.
+#   IMU_BUS=fake:lsm6dsl python3 central_script.py
+#   IMU_BUS=replay:imu_trace.jsonl python3 central_script.py
+# and record a trace on the robot with IMU_RECORD=imu_trace.jsonl.
+#
+# Running this file profiles detectIMU, init and readAll against each emulated chip.
+
+import json
+import math
+import os
+import time
+from collections import defaultdict, deque
+
+# Register maps: device address -> WHO_AM_I register/value, where the X/Y/Z outputs
+# start and how address auto-increment is enabled ('msb' = bit 7 of the register
+# address, otherwise (register, bit) of the control flag, which is set at reset)
+CHIPS = {
+    'lsm9ds0': {
+        'devices': {
+            0x6A: {'who_am_i': (0x0F, 0xD4), 'increment': 'msb'},
+            0x1E: {'who_am_i': (0x0F, 0x49), 'increment': 'msb'},
+        },
+        'outputs': {'acc': (0x1E, 0x28), 'gyr': (0x6A, 0x28), 'mag': (0x1E, 0x08)},
+        'gains': {'acc': 0.000244, 'gyr': 0.070, 'mag': 0.00048},
+    },
+    'lsm9ds1': {
+        'devices': {
+            0x6A: {'who_am_i': (0x0F, 0x68), 'increment': (0x22, 0x04)},
+            0x1C: {'who_am_i': (0x0F, 0x3D), 'increment': 'msb'},
+        },
+        'outputs': {'acc': (0x6A, 0x28), 'gyr': (0x6A, 0x18), 'mag': (0x1C, 0x28)},
+        'gains': {'acc': 0.000244, 'gyr': 0.070, 'mag': 0.00043},
+    },
+    'lsm6dsl': {
+        'devices': {
+            0x6A: {'who_am_i': (0x0F, 0x6A), 'increment': (0x12, 0x04)},
+            0x1C: {'who_am_i': (0x0F, 0x3D), 'increment': 'msb'},
+        },
+        'outputs': {'acc': (0x6A, 0x28), 'gyr': (0x6A, 0x22), 'mag': (0x1C, 0x28)},
+        'gains': {'acc': 0.000244, 'gyr': 0.070, 'mag': 1.0 / 3421},
+    },
+}
+
+# LSM6DSL FIFO registers and ODR_FIFO codes
+FIFO_CTRL5 = 0x0A
+FIFO_STATUS1 = 0x3A
+FIFO_DATA_OUT_L = 0x3E
+FIFO_DATA_OUT_H = 0x3F
+FIFO_DEPTH_WORDS = 4096
+FIFO_ODR_HZ = {0b0001: 12.5, 0b0010: 26, 0b0011: 52, 0b0100: 104, 0b0101: 208,
+               0b0110: 416, 0b0111: 833, 0b1000: 1660, 0b1001: 3330, 0b1010: 6660}
+
+
+def rotating_robot(t, yaw_rate_dps=10.0, field_gauss=0.5, dip_deg=60.0):
+    """
+    Default motion: level robot turning on the spot at yaw_rate_dps.
+    Returns physical (acc in g, gyr in dps, mag in gauss) for time t.
+    """
+    yaw = math.radians(yaw_rate_dps * t)
+    horizontal = field_gauss * math.cos(math.radians(dip_deg))
+    vertical = field_gauss * math.sin(math.radians(dip_deg))
+    acc = (0.0, 0.0, 1.0)
+    gyr = (0.0, 0.0, yaw_rate_dps)
+    mag = (horizontal * math.cos(yaw), -horizontal * math.sin(yaw), vertical)
+    return acc, gyr, mag
+
+
+def to_raw(values, gain):
+    raw = []
+    for value in values:
+        count = int(round(value / gain))
+        raw.append(max(-32768, min(32767, count)))
+    return raw
+
+
+class FakeSMBus:
+    """
+    Emulated BerryIMU register map. Output registers are refreshed from
+    motion(t) on every read; unknown device addresses raise IOError like an
+    unanswered I2C transfer. i2c_hz > 0 adds the wire time of each transfer.
+    """
+
+    def __init__(self, chip='lsm6dsl', motion=rotating_robot, i2c_hz=0, clock=time.monotonic):
+        if chip not in CHIPS:
+            raise ValueError(f"Unknown chip '{chip}', expected one of {sorted(CHIPS)}")
+        self.chip = chip
+        self.spec = CHIPS[chip]
+        self.motion = motion
+        self.i2c_hz = i2c_hz
+        self.clock = clock
+        self.start_time = clock()
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.registers = {}
+        for address, device in self.spec['devices'].items():
+            self.registers[address] = bytearray(256)
+            register, value = device['who_am_i']
+            self.registers[address][register] = value
+            if device['increment'] != 'msb':
+                flag_register, flag = device['increment']
+                self.registers[address][flag_register] |= flag
+        self.fifo = deque(maxlen=FIFO_DEPTH_WORDS)
+        self.fifo_time = None
+        self.fifo_overrun = False
+
+    def _device(self, address):
+        if address not in self.registers:
+            raise IOError(121, "Remote I/O error")
+        return self.registers[address]
+
+    def _transfer(self, length):
+        self.transactions += 1
+        self.bytes_transferred += length
+        if self.i2c_hz:
+            # Start, address, register, repeated start + address, data, 9 clocks per byte
+            time.sleep((length + 3) * 9 / self.i2c_hz)
+
+    def _refresh(self):
+        t = self.clock() - self.start_time
+        values = dict(zip(('acc', 'gyr', 'mag'), self.motion(t)))
+        for name, (address, register) in self.spec['outputs'].items():
+            raw = to_raw(values[name], self.spec['gains'][name])
+            self.registers[address][register:register + 6] = bytes(
+                b for count in raw for b in (count & 0xFF, (count >> 8) & 0xFF))
+        if self.chip == 'lsm6dsl':
+            self._fill_fifo(t)
+
+    def _fill_fifo(self, t):
+        control = self.registers[0x6A][FIFO_CTRL5]
+        odr = FIFO_ODR_HZ.get(control >> 3)
+        if control & 0x07 != 0b110 or odr is None:
+            self.fifo.clear()
+            self.fifo_time = None
+            return
+        if self.fifo_time is None:
+            self.fifo_time = t
+        registers = self.registers[0x6A]
+        while self.fifo_time + 1.0 / odr <= t:
+            self.fifo_time += 1.0 / odr
+            if len(self.fifo) + 6 > FIFO_DEPTH_WORDS:
+                self.fifo_overrun = True
+            for base in (0x22, 0x28):  # gyro set first, then accelerometer
+                for axis in range(3):
+                    register = base + 2 * axis
+                    self.fifo.append(registers[register] | (registers[register + 1] << 8))
+
+    def _read_register(self, address, register):
+        registers = self.registers[address]
+        if self.chip == 'lsm6dsl' and address == 0x6A:
+            if register == FIFO_STATUS1:
+                return len(self.fifo) & 0xFF
+            if register == FIFO_STATUS1 + 1:
+                return ((len(self.fifo) >> 8) & 0x07) | (0x40 if self.fifo_overrun else 0) | (0 if self.fifo else 0x10)
+            if register in (FIFO_DATA_OUT_L, FIFO_DATA_OUT_H):
+                word = self.fifo[0] if self.fifo else 0
+                if register == FIFO_DATA_OUT_H and self.fifo:
+                    self.fifo.popleft()
+                    self.fifo_overrun = False
+                return (word >> 8) & 0xFF if register == FIFO_DATA_OUT_H else word & 0xFF
+            if register == FIFO_STATUS1 + 2:
+                # FIFO_PATTERN: the queue is always drained in whole words from a set boundary
+                return 0
+        return registers[register]
+
+    def read_byte_data(self, address, register):
+        self._device(address)
+        self._transfer(1)
+        self._refresh()
+        return self._read_register(address, register & 0x7F)
+
+    def read_i2c_block_data(self, address, register, length):
+        device = self.spec['devices'].get(address)
+        registers = self._device(address)
+        self._transfer(length)
+        self._refresh()
+        if device['increment'] == 'msb':
+            increment = bool(register & 0x80)
+        else:
+            flag_register, flag = device['increment']
+            increment = bool(registers[flag_register] & flag)
+        register &= 0x7F
+        data = []
+        for i in range(length):
+            data.append(self._read_register(address, register))
+            if increment:
+                if self.chip == 'lsm6dsl' and address == 0x6A and register == FIFO_DATA_OUT_H:
+                    register = FIFO_DATA_OUT_L  # FIFO burst reads roll back to DATA_OUT_L
+                else:
+                    register += 1
+        return data
+
+    def write_byte_data(self, address, register, value):
+        self._device(address)[register & 0x7F] = value & 0xFF
+        self._transfer(1)
+        if self.chip == 'lsm6dsl' and address == 0x6A and register == FIFO_CTRL5:
+            self._fill_fifo(self.clock() - self.start_time)  # FIFO starts (or clears) from now
+
+    def close(self):
+        pass
+
+
+class RecordingSMBus:
+    """
+    Wraps a real SMBus and appends every transaction to a JSON lines trace
+    that ReplaySMBus can play back later.
+    """
+
+    def __init__(self, bus, path):
+        self.bus = bus
+        self.trace = open(path, 'a')
+        self.start_time = time.monotonic()
+
+    def _record(self, entry):
+        entry['t'] = round(time.monotonic() - self.start_time, 6)
+        self.trace.write(json.dumps(entry) + '\n')
+
+    def read_byte_data(self, address, register):
+        entry = {'op': 'read_byte', 'addr': address, 'reg': register}
+        try:
+            entry['data'] = self.bus.read_byte_data(address, register)
+        except IOError as e:
+            entry['error'] = str(e)
+            self._record(entry)
+            raise
+        self._record(entry)
+        return entry['data']
+
+    def read_i2c_block_data(self, address, register, length):
+        entry = {'op': 'read_block', 'addr': address, 'reg': register, 'len': length}
+        try:
+            entry['data'] = list(self.bus.read_i2c_block_data(address, register, length))
+        except IOError as e:
+            entry['error'] = str(e)
+            self._record(entry)
+            raise
+        self._record(entry)
+        return entry['data']
+
+    def write_byte_data(self, address, register, value):
+        self._record({'op': 'write_byte', 'addr': address, 'reg': register, 'data': value})
+        self.bus.write_byte_data(address, register, value)
+
+    def close(self):
+        self.trace.close()
+        self.bus.close()
+
+
+class ReplaySMBus:
+    """
+    Plays back a trace written by RecordingSMBus. Each read returns the next
+    recorded response for the same (operation, address, register, length);
+    when those run out the trace starts over if loop is True, otherwise
+    IOError is raised. Writes are accepted and ignored.
+    """
+
+    def __init__(self, path, loop=True):
+        self.loop = loop
+        self.responses = defaultdict(list)
+        self.positions = defaultdict(int)
+        with open(path) as trace:
+            for line in trace:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry['op'] == 'write_byte':
+                    continue
+                key = (entry['op'], entry['addr'], entry['reg'], entry.get('len'))
+                self.responses[key].append(entry)
+
+    def _next(self, key):
+        responses = self.responses.get(key)
+        if not responses:
+            raise IOError(121, f"No recorded response for {key}")
+        position = self.positions[key]
+        if position >= len(responses):
+            if not self.loop:
+                raise IOError(121, f"Trace exhausted for {key}")
+            position = 0
+        self.positions[key] = position + 1
+        entry = responses[position]
+        if 'error' in entry:
+            raise IOError(121, entry['error'])
+        return entry['data']
+
+    def read_byte_data(self, address, register):
+        return self._next(('read_byte', address, register, None))
+
+    def read_i2c_block_data(self, address, register, length):
+        return list(self._next(('read_block', address, register, length)))
+
+    def write_byte_data(self, address, register, value):
+        pass
+
+    def close(self):
+        pass
+
+
+def profile(samples=2000, i2c_hz=0):
+    # IMU.py opens its module bus on import; the profiled buses are passed in,
+    # so an emulated one (BerryIMU v3) is enough when IMU_BUS is not set
+    os.environ.setdefault('IMU_BUS', 'fake:lsm6dsl')
+    import IMU
+    for chip in CHIPS:
+        fake_bus = FakeSMBus(chip, i2c_hz=i2c_hz)
+
+        start = time.perf_counter()
+        imu = IMU.detectIMU(fake_bus)
+        detect_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        imu.init()
+        init_time = time.perf_counter() - start
+
+        fake_bus.transactions = 0
+        start = time.perf_counter()
+        for i in range(samples):
+            imu.readAll()
+        read_time = (time.perf_counter() - start) / samples
+
+        print(f"{chip}: detectIMU {detect_time * 1000:.1f} ms, init {init_time * 1000:.2f} ms, "
+              f"readAll {read_time * 1e6:.1f} us/sample, {fake_bus.transactions / samples:.0f} transactions/sample")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile the IMU driver against emulated BerryIMUs")
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--i2c-hz', type=int, default=0, help="emulate bus wire time at this clock (e.g. 100000)")
+    args = parser.parse_args()
+    profile(args.samples, args.i2c_hz)
@@ -0,0 +1,251 @@
+# gps_reader.py
+
+import ctypes
+import json
+import logging
+import math
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from multiprocessing import Lock, RawArray, RawValue
+
+import numpy as np
+
+GPSD_HOST = "127.0.0.1"
+GPSD_PORT = 2947
+WATCH_COMMAND = b'?WATCH={"enable":true,"json":true};\n'
+
+# Column layout of one fix row in the history buffer
+COL_TIME = 0       # time.monotonic() when the fix was taken
+COL_LAT = 1
+COL_LON = 2
+COL_MODE = 3       # 0/1 no fix, 2 = 2D, 3 = 3D
+COL_HDOP = 4
+COL_SPEED = 5      # m/s
+COL_TRACK = 6      # Degrees from true north
+COL_FIX_TIME = 7   # Fix time from the receiver, seconds since the epoch
+FIX_WIDTH = 8
+
+# Layout of the shared statistics array
+STAT_REPORTS = 0
+STAT_RECONNECTS = 1
+STAT_ERRORS = 2
+
+# Receiver latency above this is treated as clock skew and not used to back-date fixes
+MAX_FIX_LATENCY = 1.0
+
+
+def parse_fix_time(value):
+    """Converts a gpsd ISO 8601 time string to seconds since the epoch, or NaN."""
+    if not value:
+        return math.nan
+    try:
+        parsed = datetime.strptime(value.rstrip('Z')[:26], "%Y-%m-%dT%H:%M:%S.%f")
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value.rstrip('Z'), "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            return math.nan
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+class GPSReader:
+    """
+    Consumes gpsd's JSON watch stream on a background thread and keeps every
+    TPV report in a preallocated, timestamped history buffer.
+    Readers never touch the socket: latest() and position() only copy the
+    newest row. The buffer lives in shared memory, so a process started with
+    the reader as an argument sees the same fixes.
+    """
+
+    def __init__(self, host=GPSD_HOST, port=GPSD_PORT, capacity=3600, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.capacity = int(capacity)
+        self.timeout = timeout
+        self._raw = RawArray(ctypes.c_double, self.capacity * FIX_WIDTH)
+        self._count = RawValue(ctypes.c_long, 0)  # Total fixes written
+        self._hdop = RawValue(ctypes.c_double, math.nan)  # From the latest SKY report
+        self._stats = RawArray(ctypes.c_double, 3)
+        self._lock = Lock()
+        self._buffer = None
+        self._thread = None
+        self._running = threading.Event()
+        self._listeners = []
+
+    def __getstate__(self):
+        # Only the shared memory travels to child processes, not the thread or the socket
+        state = self.__dict__.copy()
+        state['_listeners'] = []
+        state['_buffer'] = None
+        state['_thread'] = None
+        state['_running'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._running = threading.Event()
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = np.frombuffer(self._raw, dtype=np.float64).reshape(self.capacity, FIX_WIDTH)
+        return self._buffer
+
+    def add_listener(self, callback):
+        """
+        Calls callback(fix) on the reader thread for every TPV report, with fix
+        as returned by latest().
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="gps-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout + 1.0)
+            self._thread = None
+
+    def _run(self):
+        backoff = 1.0
+        while self._running.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                    sock.sendall(WATCH_COMMAND)
+                    backoff = 1.0
+                    self._stream(sock)
+            except OSError as e:
+                if not self._running.is_set():
+                    break
+                self._stats[STAT_RECONNECTS] += 1
+                logging.error(f"gpsd connection failed: {e}; retrying in {backoff:.0f}s")
+                # Sleep in short steps so stop() is not held up by the backoff
+                end = time.monotonic() + backoff
+                while self._running.is_set() and time.monotonic() < end:
+                    time.sleep(0.1)
+                backoff = min(backoff * 2, 10.0)
+
+    def _stream(self, sock):
+        pending = b''
+        while self._running.is_set():
+            try:
+                chunk = sock.recv(4096)
+            except socket.timeout:
+                # gpsd is quiet without a receiver attached; keep waiting
+                continue
+            if not chunk:
+                raise ConnectionError("gpsd closed the connection")
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    self._handle(line)
+
+    def _handle(self, line):
+        try:
+            report = json.loads(line)
+        except ValueError:
+            self._stats[STAT_ERRORS] += 1
+            return
+        report_class = report.get('class')
+        if report_class == 'SKY':
+            if 'hdop' in report:
+                self._hdop.value = report['hdop']
+        elif report_class == 'TPV':
+            self._write(report)
+
+    def _write(self, report):
+        now = time.monotonic()
+        fix_time = parse_fix_time(report.get('time'))
+        # Back-date by the receiver latency when the system clock agrees with the fix
+        latency = time.time() - fix_time
+        timestamp = now - latency if 0 <= latency <= MAX_FIX_LATENCY else now
+
+        buffer = self.buffer
+        with self._lock:
+            row = buffer[self._count.value % self.capacity]
+            row[COL_TIME] = timestamp
+            row[COL_LAT] = report.get('lat', math.nan)
+            row[COL_LON] = report.get('lon', math.nan)
+            row[COL_MODE] = report.get('mode', 0)
+            row[COL_HDOP] = self._hdop.value
+            row[COL_SPEED] = report.get('speed', math.nan)
+            row[COL_TRACK] = report.get('track', math.nan)
+            row[COL_FIX_TIME] = fix_time
+            self._count.value += 1
+            fix = self._row_to_fix(row)
+        self._stats[STAT_REPORTS] += 1
+
+        for callback in self._listeners:
+            try:
+                callback(fix)
+            except Exception as e:
+                logging.error(f"GPS fix listener failed: {e}")
+
+    @staticmethod
+    def _row_to_fix(row):
+        return {
+            'timestamp': float(row[COL_TIME]),
+            'lat': float(row[COL_LAT]),
+            'lon': float(row[COL_LON]),
+            'mode': int(row[COL_MODE]),
+            'hdop': float(row[COL_HDOP]),
+            'speed': float(row[COL_SPEED]),
+            'track': float(row[COL_TRACK]),
+            'time': float(row[COL_FIX_TIME]),
+        }
+
+    def latest(self):
+        """
+        Returns the newest TPV report as a dict (timestamp on the time.monotonic
+        clock, time in seconds since the epoch, missing fields as NaN), or None
+        before the first report.
+        """
+        buffer = self.buffer
+        with self._lock:
+            count = self._count.value
+            if count == 0:
+                return None
+            return self._row_to_fix(buffer[(count - 1) % self.capacity])
+
+    def position(self, max_age=None):
+        """
+        Returns (lat, lon) of the newest 2D/3D fix, or (None, None) if there is
+        none or it is older than max_age seconds.
+        """
+        fix = self.latest()
+        if fix is None or fix['mode'] < 2:
+            return None, None
+        if max_age is not None and time.monotonic() - fix['timestamp'] > max_age:
+            return None, None
+        return fix['lat'], fix['lon']
+
+    def history(self, count=None, seconds=None):
+        """
+        Returns up to `count` most recent reports (or those from the last
+        `seconds`) as an (N, FIX_WIDTH) array ordered oldest to newest.
+        """
+        buffer = self.buffer
+        with self._lock:
+            total = self._count.value
+            n = min(total, self.capacity)
+            if count is not None:
+                n = min(n, count)
+            rows = buffer[np.arange(total - n, total) % self.capacity]
+        if seconds is not None and len(rows):
+            rows = rows[rows[:, COL_TIME] > rows[-1, COL_TIME] - seconds]
+        return rows
+
+    def stats(self):
+        return {
+            'reports': int(self._stats[STAT_REPORTS]),
+            'reconnects': int(self._stats[STAT_RECONNECTS]),
+            'errors': int(self._stats[STAT_ERRORS]),
+        }
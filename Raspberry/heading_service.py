@@ -0,0 +1,182 @@
+# heading_service.py
+
+import ctypes
+import math
+import os
+import time
+from multiprocessing import Lock, RawArray
+
+import numpy as np
+
+from imu_calibration import Calibration
+
+# Layout of the shared cache
+CACHE_TIMESTAMP = 0
+CACHE_HEADING = 1
+CACHE_VALID = 2
+
+
+def compute_heading(acc, mag):
+    """
+    Tilt-compensated compass heading in degrees from one accelerometer and
+    magnetometer reading.
+    """
+    ACCx, ACCy, ACCz = acc
+    MAGx, MAGy, MAGz = mag
+
+    # Normalize accelerometer raw values.
+    acc_magnitude = math.sqrt(ACCx ** 2 + ACCy ** 2 + ACCz ** 2)
+    if acc_magnitude == 0:
+        print("Error: Accelerometer magnitude is zero.")
+        return 0
+    accXnorm = ACCx / acc_magnitude
+    accYnorm = ACCy / acc_magnitude
+
+    # Rounding can push the ratios a hair past +/-1, which math.asin rejects
+    pitch = math.asin(max(-1.0, min(1.0, accXnorm)))
+    if math.cos(pitch) == 0:
+        roll = 0
+    else:
+        roll = -math.asin(max(-1.0, min(1.0, accYnorm / math.cos(pitch))))
+
+    # Tilt compensation
+    magXcomp = MAGx * math.cos(pitch) + MAGz * math.sin(pitch)
+    magYcomp = (MAGx * math.sin(roll) * math.sin(pitch) +
+               MAGy * math.cos(roll) -
+               MAGz * math.sin(roll) * math.cos(pitch))
+
+    heading = math.degrees(math.atan2(magYcomp, magXcomp))
+    if heading < 0:
+        heading += 360
+
+    return heading
+
+
+def compute_heading_batch(acc, mag):
+    """
+    Vectorized compute_heading() for logged data.
+    Takes (N, 3) arrays of ACC and MAG readings and returns (pitch, roll, heading)
+    arrays in degrees. Samples with zero accelerometer magnitude give 0 for all
+    three, and roll is 0 where cos(pitch) is 0, as in the scalar version.
+    """
+    acc = np.asarray(acc, dtype=float)
+    mag = np.asarray(mag, dtype=float)
+    ACCx, ACCy, ACCz = acc[:, 0], acc[:, 1], acc[:, 2]
+    MAGx, MAGy, MAGz = mag[:, 0], mag[:, 1], mag[:, 2]
+
+    acc_magnitude = np.sqrt(ACCx ** 2 + ACCy ** 2 + ACCz ** 2)
+    valid = acc_magnitude != 0
+    acc_magnitude = np.where(valid, acc_magnitude, 1.0)
+    accXnorm = ACCx / acc_magnitude
+    accYnorm = ACCy / acc_magnitude
+
+    pitch = np.arcsin(np.clip(accXnorm, -1.0, 1.0))
+    cos_pitch = np.cos(pitch)
+    tilted = cos_pitch != 0
+    ratio = np.divide(accYnorm, cos_pitch, out=np.zeros_like(accYnorm), where=tilted)
+    roll = np.where(tilted, -np.arcsin(np.clip(ratio, -1.0, 1.0)), 0.0)
+
+    # Tilt compensation
+    sin_pitch = np.sin(pitch)
+    sin_roll = np.sin(roll)
+    cos_roll = np.cos(roll)
+    magXcomp = MAGx * cos_pitch + MAGz * sin_pitch
+    magYcomp = (MAGx * sin_roll * sin_pitch +
+                MAGy * cos_roll -
+                MAGz * sin_roll * cos_pitch)
+
+    heading = np.degrees(np.arctan2(magYcomp, magXcomp))
+    heading = np.where(heading < 0, heading + 360, heading)
+
+    return (np.where(valid, np.degrees(pitch), 0.0),
+            np.where(valid, np.degrees(roll), 0.0),
+            np.where(valid, heading, 0.0))
+
+
+class HeadingService:
+    """
+    One place to get the robot heading, shared by the main loop and the
+    navigation process.
+
+    Heading is computed at most once per IMU sample: the result is cached in
+    shared memory under the sample timestamp and reused until the sampler
+    produces a newer sample. A fresh AHRS estimate is preferred when one is
+    attached. If the sampler has nothing newer than max_age seconds, the
+    process that created the service reads the bus itself and caches that
+    reading for max_age as well. Other processes, forked or not, never touch
+    the bus: they get the last known heading, flagged stale by
+    heading_status().
+    """
+
+    def __init__(self, sampler=None, ahrs=None, acc_calibration=None, mag_calibration=None,
+                 read_sample=None, max_age=0.2):
+        self.sampler = sampler
+        self.ahrs = ahrs
+        self.acc_calibration = acc_calibration or Calibration()
+        self.mag_calibration = mag_calibration or Calibration()
+        self.read_sample = read_sample
+        self.max_age = max_age
+        # Only this process may call read_sample; a forked child inherits the
+        # closure but not the bus ownership
+        self._owner_pid = os.getpid()
+        self._cache = RawArray(ctypes.c_double, 3)
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # The bus handle stays with the owning process
+        state = self.__dict__.copy()
+        state['read_sample'] = None
+        return state
+
+    def _compute(self, timestamp, acc, mag):
+        heading = compute_heading(self.acc_calibration.apply(acc), self.mag_calibration.apply(mag))
+        self._cache[CACHE_TIMESTAMP] = timestamp
+        self._cache[CACHE_HEADING] = heading
+        self._cache[CACHE_VALID] = 1.0
+        return heading
+
+    def heading(self):
+        """
+        Returns the heading in degrees.
+        """
+        return self.heading_sample()[1]
+
+    def heading_sample(self):
+        """
+        Returns (timestamp, heading in degrees), timestamp being the
+        time.monotonic() time of the IMU data the heading was computed from.
+        """
+        return self.heading_status()[:2]
+
+    def heading_status(self):
+        """
+        Returns (timestamp, heading in degrees, stale) like heading_sample().
+        stale is True when no source had data newer than max_age and the
+        heading is the last known one.
+        """
+        now = time.monotonic()
+        if self.ahrs is not None:
+            estimate = self.ahrs.snapshot()
+            if estimate is not None and now - estimate['timestamp'] <= self.max_age:
+                return estimate['timestamp'], estimate['heading'], False
+
+        sample = self.sampler.latest() if self.sampler is not None else None
+        with self._lock:
+            cached_timestamp = self._cache[CACHE_TIMESTAMP]
+            cached = self._cache[CACHE_VALID]
+            if sample is not None and now - sample[0] <= self.max_age:
+                timestamp, acc, gyr, mag = sample
+                if cached and cached_timestamp == timestamp:
+                    return timestamp, self._cache[CACHE_HEADING], False
+                return timestamp, self._compute(timestamp, acc, mag), False
+
+            # Sampler missing or stalled
+            if cached and now - cached_timestamp <= self.max_age:
+                return cached_timestamp, self._cache[CACHE_HEADING], False
+            if self.read_sample is not None and os.getpid() == self._owner_pid:
+                acc, gyr, mag = self.read_sample()
+                return now, self._compute(now, acc, mag), False
+            if sample is not None and not (cached and cached_timestamp == sample[0]):
+                timestamp, acc, gyr, mag = sample
+                return timestamp, self._compute(timestamp, acc, mag), True
+            return cached_timestamp, self._cache[CACHE_HEADING], True
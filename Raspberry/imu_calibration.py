@@ -0,0 +1,156 @@
+# imu_calibration.py
+#
+# Hard/soft-iron calibration for the magnetometer and offset/scale calibration for the
+# accelerometer. A rotation sweep is collected into a NumPy buffer, an ellipsoid is fitted
+# to it and the resulting offset and 3x3 matrix are stored per BerryIMU version.
+#
+# Run on the robot and slowly rotate it through as many orientations as possible:
+#   python3 imu_calibration.py --seconds 60
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+CALIBRATION_FILE = os.environ.get('IMU_CALIBRATION_FILE',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imu_calibration.json'))
+
+
+class Calibration:
+    """
+    corrected = matrix @ (raw - offset), applied row-wise to arrays of shape (3,) or (N, 3).
+    """
+
+    def __init__(self, offset=None, matrix=None):
+        self.offset = np.zeros(3) if offset is None else np.asarray(offset, dtype=float)
+        self.matrix = np.eye(3) if matrix is None else np.asarray(matrix, dtype=float)
+        self._matrix_t = self.matrix.T.copy()
+
+    def apply(self, raw):
+        return (np.asarray(raw, dtype=float) - self.offset) @ self._matrix_t
+
+    def to_dict(self):
+        return {'offset': self.offset.tolist(), 'matrix': self.matrix.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['offset'], data['matrix'])
+
+
+def fit_ellipsoid(samples):
+    """
+    Least-squares fit of a general ellipsoid to (N, 3) samples.
+    Returns a Calibration that maps the ellipsoid onto a sphere whose radius is
+    the mean radius of the fitted ellipsoid, so corrected values keep raw units.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) < 9:
+        raise ValueError("At least 9 samples are needed to fit an ellipsoid")
+    x, y, z = samples[:, 0], samples[:, 1], samples[:, 2]
+
+    # a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1
+    design = np.column_stack([x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z])
+    coefficients, *_ = np.linalg.lstsq(design, np.ones(len(samples)), rcond=None)
+    a, b, c, d, e, f, g, h, i = coefficients
+
+    quadric = np.array([[a, d, e],
+                        [d, b, f],
+                        [e, f, c]])
+    linear = np.array([g, h, i])
+    offset = -np.linalg.solve(quadric, linear)
+
+    # Shifted to the centre: (v - offset)^T (quadric / k) (v - offset) = 1
+    k = 1 + offset @ quadric @ offset
+    shape = quadric / k
+    eigenvalues, eigenvectors = np.linalg.eigh(shape)
+    if np.any(eigenvalues <= 0):
+        raise ValueError("Samples do not describe an ellipsoid; rotate through more orientations")
+
+    radii = 1 / np.sqrt(eigenvalues)
+    radius = radii.mean()
+    # Symmetric square root of the shape matrix maps the ellipsoid to the unit sphere
+    matrix = eigenvectors @ np.diag(np.sqrt(eigenvalues)) @ eigenvectors.T * radius
+    return Calibration(offset, matrix)
+
+
+def load_calibration(version, sensor, path=CALIBRATION_FILE):
+    """
+    Returns the stored Calibration for a BerryIMU version and sensor ('mag' or 'acc'),
+    or an identity calibration if none has been saved.
+    """
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        return Calibration.from_dict(stored[str(version)][sensor])
+    except (OSError, ValueError, KeyError):
+        return Calibration()
+
+
+def save_calibration(version, sensor, calibration, path=CALIBRATION_FILE):
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    stored.setdefault(str(version), {})[sensor] = calibration.to_dict()
+    with open(path, 'w') as f:
+        json.dump(stored, f, indent=2)
+
+
+def collect_sweep(read_sample, seconds=60.0, rate_hz=50.0):
+    """
+    Collects acc and mag readings while the robot is rotated.
+    Returns two (N, 3) arrays.
+    """
+    capacity = int(seconds * rate_hz)
+    acc = np.empty((capacity, 3))
+    mag = np.empty((capacity, 3))
+    period = 1.0 / rate_hz
+    next_tick = time.monotonic()
+    count = 0
+    while count < capacity:
+        sample_acc, sample_gyr, sample_mag = read_sample()
+        acc[count] = sample_acc
+        mag[count] = sample_mag
+        count += 1
+        next_tick += period
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    return acc[:count], mag[:count]
+
+
+def calibrate(imu, seconds=60.0, rate_hz=50.0, path=CALIBRATION_FILE):
+    print(f"Rotate the robot slowly through all orientations for {seconds:.0f} seconds...")
+    acc, mag = collect_sweep(imu.readAll, seconds, rate_hz)
+    results = {}
+    for sensor, samples in (('mag', mag), ('acc', acc)):
+        try:
+            calibration = fit_ellipsoid(samples)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            logging.error(f"{sensor} calibration failed: {e}")
+            continue
+        save_calibration(imu.version, sensor, calibration, path)
+        residual = np.linalg.norm(calibration.apply(samples), axis=1)
+        print(f"{sensor}: offset {np.round(calibration.offset, 1)}, "
+              f"radius spread {residual.std() / residual.mean() * 100:.1f}%")
+        results[sensor] = calibration
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import IMU
+    parser = argparse.ArgumentParser(description="Calibrate the BerryIMU magnetometer and accelerometer")
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--rate', type=float, default=50.0)
+    args = parser.parse_args()
+
+    imu = IMU.detectIMU()
+    if imu is None:
+        print("No BerryIMU found... exiting")
+    else:
+        imu.init()
+        calibrate(imu, args.seconds, args.rate)
@@ -0,0 +1,178 @@
+# imu_sampler.py
+
+import ctypes
+import logging
+import threading
+import time
+from multiprocessing import Lock, RawArray, RawValue
+
+import numpy as np
+
+import IMU
+
+# Column layout of one sample row in the ring buffer
+COL_TIME = 0
+COL_ACC = slice(1, 4)
+COL_GYR = slice(4, 7)
+COL_MAG = slice(7, 10)
+SAMPLE_WIDTH = 10
+
+# Layout of the shared statistics array
+STAT_ACHIEVED_HZ = 0
+STAT_OVERRUNS = 1
+STAT_ERRORS = 2
+
+
+class IMUSampler:
+    """
+    Polls the IMU at a fixed rate on a background thread and writes timestamped
+    acc/gyr/mag samples into a preallocated ring buffer.
+    The buffer lives in shared memory, so a process started with the sampler as
+    an argument reads the same samples without touching the I2C bus.
+    """
+
+    def __init__(self, rate_hz=50.0, capacity=1024, read_sample=None):
+        self.rate_hz = float(rate_hz)
+        self.capacity = int(capacity)
+        self.read_sample = read_sample or IMU.readAll
+        self._raw = RawArray(ctypes.c_double, self.capacity * SAMPLE_WIDTH)
+        self._count = RawValue(ctypes.c_long, 0)  # Total samples written
+        self._stats = RawArray(ctypes.c_double, 3)
+        self._lock = Lock()
+        self._buffer = None
+        self._thread = None
+        self._running = threading.Event()
+        self._listeners = []
+
+    def __getstate__(self):
+        # Only the shared memory travels to child processes, not the thread or the bus
+        state = self.__dict__.copy()
+        state['read_sample'] = None
+        state['_listeners'] = []
+        state['_buffer'] = None
+        state['_thread'] = None
+        state['_running'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._running = threading.Event()
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = np.frombuffer(self._raw, dtype=np.float64).reshape(self.capacity, SAMPLE_WIDTH)
+        return self._buffer
+
+    def add_listener(self, callback):
+        """
+        Calls callback(timestamp, acc, gyr, mag) on the sampler thread for every
+        new sample, e.g. to run a filter at the IMU rate.
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="imu-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _write(self, timestamp, acc, gyr, mag):
+        buffer = self.buffer
+        with self._lock:
+            row = buffer[self._count.value % self.capacity]
+            row[COL_TIME] = timestamp
+            row[COL_ACC] = acc
+            row[COL_GYR] = gyr
+            row[COL_MAG] = mag
+            self._count.value += 1
+
+    def _run(self):
+        period = 1.0 / self.rate_hz
+        next_tick = time.monotonic()
+        report_start = next_tick
+        report_samples = 0
+        report_overruns = 0
+
+        while self._running.is_set():
+            timestamp = time.monotonic()
+            try:
+                acc, gyr, mag = self.read_sample()
+            except IOError as e:
+                self._stats[STAT_ERRORS] += 1
+                logging.error(f"IMU read failed: {e}")
+            else:
+                self._write(timestamp, acc, gyr, mag)
+                report_samples += 1
+                for callback in self._listeners:
+                    try:
+                        callback(timestamp, acc, gyr, mag)
+                    except Exception as e:
+                        logging.error(f"IMU sample listener failed: {e}")
+
+            # Deadline based scheduling so read time does not stretch the period
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Missed the slot; skip ahead instead of bursting to catch up
+                self._stats[STAT_OVERRUNS] += 1
+                report_overruns += 1
+                next_tick = time.monotonic()
+
+            now = time.monotonic()
+            if now - report_start >= 1.0:
+                self._stats[STAT_ACHIEVED_HZ] = report_samples / (now - report_start)
+                if report_overruns:
+                    logging.warning(f"IMU sampler overran {report_overruns} times in the last "
+                                    f"{now - report_start:.1f}s, achieved {self._stats[STAT_ACHIEVED_HZ]:.1f} Hz "
+                                    f"of {self.rate_hz:.1f} Hz")
+                report_start = now
+                report_samples = 0
+                report_overruns = 0
+
+    def latest(self):
+        """
+        Returns the newest sample as (timestamp, acc, gyr, mag), or None if the
+        sampler has not produced anything yet.
+        """
+        buffer = self.buffer
+        with self._lock:
+            count = self._count.value
+            if count == 0:
+                return None
+            row = buffer[(count - 1) % self.capacity].copy()
+        return row[COL_TIME], row[COL_ACC], row[COL_GYR], row[COL_MAG]
+
+    def window(self, count=None, seconds=None):
+        """
+        Returns up to `count` most recent samples (or those from the last
+        `seconds`) as an (N, SAMPLE_WIDTH) array ordered oldest to newest.
+        """
+        buffer = self.buffer
+        with self._lock:
+            total = self._count.value
+            n = min(total, self.capacity)
+            if count is not None:
+                n = min(n, count)
+            rows = buffer[np.arange(total - n, total) % self.capacity]
+        if seconds is not None and len(rows):
+            rows = rows[rows[:, COL_TIME] > rows[-1, COL_TIME] - seconds]
+        return rows
+
+    def stats(self):
+        return {
+            'rate_hz': self.rate_hz,
+            'achieved_hz': self._stats[STAT_ACHIEVED_HZ],
+            'overruns': int(self._stats[STAT_OVERRUNS]),
+            'errors': int(self._stats[STAT_ERRORS]),
+            'samples': self._count.value,
+        }
@@ -0,0 +1,473 @@
+# nav_simulator.py
+#
+# Headless closed-loop simulator for auto_navigation_process(). A
+# differential-drive robot that follows the "fb ss" commands published on
+# robot/control, synthetic GPS and IMU/compass readings, an in-process MQTT
+# stand-in and a simulated clock replace the hardware, so the unchanged
+# navigation loop runs a mission as fast as the CPU allows (or at --speed
+# times real time):
+#   python3 nav_simulator.py --gps-noise 1.5 --gps-rate 5
+#   python3 nav_simulator.py --waypoints "0,10;10,10;10,0" --json
+
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# IMU.py opens the I2C bus on import; nothing reads it here since the
+# simulated sampler is passed in, so an emulated bus is enough
+os.environ.setdefault('IMU_BUS', 'fake:lsm6dsl')
+
+import auto_navigation as nav
+from imu_sampler import SAMPLE_WIDTH, COL_TIME, COL_ACC, COL_GYR
+from projection import ENUProjection
+from segment_index import SegmentIndex
+
+GRAVITY = 9.80665
+REF_LAT, REF_LON = 35.0, -86.0  # Where the simulated field is
+
+# A point of the path counts as visited when the true robot position passes
+# within COVERAGE_RADIUS of it; points are taken every COVERAGE_STEP meters.
+# A segment none of whose points were visited was skipped
+COVERAGE_RADIUS = 1.5  # Meters
+COVERAGE_STEP = 0.5    # Meters
+MIN_COVERAGE = 0.9     # Fraction of the path points that must be visited
+
+# Cross-track is measured against the segments from the last one the robot
+# was on up to TRACK_WINDOW meters of path past its last progress, so
+# leaving out a row shows up as error instead of matching the row it skipped to
+TRACK_WINDOW = 2 * nav.LOOK_AHEAD_DISTANCE  # Meters
+
+
+class SimClock:
+    """
+    Stand-in for the time module: monotonic() returns simulated seconds and
+    sleep() advances them, stepping the world in `substep` increments. With
+    a speed, sleep() also waits in real time so the simulation runs at that
+    multiple of real time. The real time spent between sleep() calls, which
+    is the caller's compute cost per tick, is collected in tick_costs, and
+    the on_tick callables run at every sleep() call.
+    """
+
+    def __init__(self, start=1000.0, substep=0.01, speed=None):
+        self.now = start
+        self.substep = substep
+        self.speed = speed
+        self.world = []  # Callables step(now, dt) run while time advances
+        self.on_tick = []
+        self.tick_costs = []
+        self.world_time = 0.0  # Real seconds spent stepping the world
+        self._wall_start = time.perf_counter()
+        self._sim_start = start
+        self._last_return = None
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        end = self.now + seconds
+        start = time.perf_counter()
+        while self.now < end - 1e-12:
+            step = min(self.substep, end - self.now)
+            self.now += step
+            for step_world in self.world:
+                step_world(self.now, step)
+        self.world_time += time.perf_counter() - start
+
+    def sleep(self, seconds):
+        if self._last_return is not None:
+            self.tick_costs.append(time.perf_counter() - self._last_return)
+        for callback in self.on_tick:
+            callback(self.now)
+        self.advance(seconds)
+        if self.speed:
+            ahead = (self.now - self._sim_start) / self.speed - (time.perf_counter() - self._wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
+        self._last_return = time.perf_counter()
+
+
+class LocalMQTT:
+    """In-process stand-in for the paho client: publish() calls the subscribers of the topic."""
+
+    def __init__(self):
+        self.subscribers = {}
+        self.published = 0
+
+    def subscribe(self, topic, callback):
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+        for callback in self.subscribers.get(topic, []):
+            callback(topic, payload)
+
+
+class DiffDriveRobot:
+    """
+    Kinematic differential-drive robot. Commands are mixed like the ESP32
+    firmware, wheel = (fb - 64) +/- (ss - 64), with the dashboard's steering
+    convention (ss 126 is full left). Wheel speeds follow their targets with
+    a first-order lag. x/y are meters east/north, heading degrees clockwise
+    from north like the compass.
+    """
+
+    def __init__(self, max_speed=1.0, track_width=0.6, time_constant=0.2, x=0.0, y=0.0, heading=0.0):
+        self.max_speed = max_speed  # m/s of a wheel at command +64
+        self.track_width = track_width
+        self.time_constant = time_constant
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.command = (64, 64)
+        self.left = self.right = 0.0
+        self.speed = 0.0
+        self.accel = 0.0     # Forward acceleration, m/s^2
+        self.yaw_rate = 0.0  # Degrees per second, clockwise
+
+    def on_command(self, topic, payload):
+        front_back, side_side = (int(value) for value in payload.split())
+        self.command = (front_back, side_side)
+
+    def step(self, now, dt):
+        forward = self.command[0] - 64
+        turn = self.command[1] - 64
+        scale = self.max_speed / 64
+        target_left = max(-127, min(127, forward - turn)) * scale
+        target_right = max(-127, min(127, forward + turn)) * scale
+        blend = 1 - math.exp(-dt / self.time_constant) if self.time_constant > 0 else 1.0
+        self.left += (target_left - self.left) * blend
+        self.right += (target_right - self.right) * blend
+
+        speed = (self.left + self.right) / 2
+        self.accel = (speed - self.speed) / dt
+        self.speed = speed
+        self.yaw_rate = math.degrees((self.left - self.right) / self.track_width)
+        self.heading = (self.heading + self.yaw_rate * dt) % 360
+        self.x += speed * math.sin(math.radians(self.heading)) * dt
+        self.y += speed * math.cos(math.radians(self.heading)) * dt
+
+
+class SimGPS:
+    """
+    GPSReader stand-in. Fixes are taken at rate_hz with Gaussian position
+    noise (meters, per axis), become visible latency seconds later, and are
+    stamped with the time they were taken, like GPSReader's back-dated
+    timestamps.
+    """
+
+    def __init__(self, robot, clock, projection, rate_hz=1.0, noise=1.0, latency=0.1, seed=0):
+        self.robot = robot
+        self.clock = clock
+        self.projection = projection
+        self.period = 1.0 / rate_hz
+        self.noise = noise
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        self._next_fix = clock.monotonic()
+        self._pending = deque()
+        self._latest = None
+
+    def step(self, now, dt):
+        if now >= self._next_fix:
+            self._next_fix += self.period
+            x = self.robot.x + self.rng.normal(scale=self.noise)
+            y = self.robot.y + self.rng.normal(scale=self.noise)
+            lat, lon = self.projection.to_latlon(x, y)
+            self._pending.append({
+                'timestamp': now,
+                'lat': lat,
+                'lon': lon,
+                'mode': 3,
+                'hdop': self.noise,
+                'speed': abs(self.robot.speed),
+                'track': self.robot.heading,
+                'time': time.time(),
+            })
+        while self._pending and self._pending[0]['timestamp'] + self.latency <= now:
+            self._latest = self._pending.popleft()
+
+    def latest(self):
+        return dict(self._latest) if self._latest is not None else None
+
+    def position(self, max_age=None):
+        fix = self._latest
+        if fix is None or (max_age is not None and self.clock.monotonic() - fix['timestamp'] > max_age):
+            return None, None
+        return fix['lat'], fix['lon']
+
+
+class SimIMU:
+    """
+    IMUSampler and HeadingService stand-in. Samples at rate_hz hold raw
+    accelerometer counts (body frame: x forward, y left, z up, with
+    Gaussian noise in m/s^2) and the yaw rate in the gyro z column, in the
+    sampler's row layout. heading_sample() is the true heading plus
+    Gaussian noise in degrees, timestamped with the newest sample.
+    """
+
+    def __init__(self, robot, clock, rate_hz=50.0, accel_noise=0.05, heading_noise=1.0,
+                 capacity=1024, seed=1):
+        self.robot = robot
+        self.clock = clock
+        self.period = 1.0 / rate_hz
+        self.accel_noise = accel_noise
+        self.heading_noise = heading_noise
+        self.rng = np.random.default_rng(seed)
+        self.capacity = capacity
+        self._rows = np.zeros((capacity, SAMPLE_WIDTH))
+        self._count = 0
+        self._next_sample = clock.monotonic()
+        self._heading = (clock.monotonic(), robot.heading)
+
+    def step(self, now, dt):
+        if now < self._next_sample:
+            return
+        self._next_sample += self.period
+        row = self._rows[self._count % self.capacity]
+        row[COL_TIME] = now
+        lateral = self.robot.speed * math.radians(-self.robot.yaw_rate)  # Positive turning left
+        acc = np.array([self.robot.accel, lateral, GRAVITY]) + self.rng.normal(scale=self.accel_noise, size=3)
+        row[COL_ACC] = acc / nav.accel_scale()
+        row[COL_GYR] = 0.0, 0.0, self.robot.yaw_rate
+        self._count += 1
+        heading = (self.robot.heading + self.rng.normal(scale=self.heading_noise)) % 360
+        self._heading = (now, heading)
+
+    def latest(self):
+        if self._count == 0:
+            return None
+        row = self._rows[(self._count - 1) % self.capacity].copy()
+        return row[COL_TIME], row[COL_ACC], row[COL_GYR], row[7:10]
+
+    def window(self, count=None, seconds=None):
+        n = min(self._count, self.capacity)
+        if count is not None:
+            n = min(n, count)
+        rows = self._rows[np.arange(self._count - n, self._count) % self.capacity]
+        if seconds is not None and len(rows):
+            rows = rows[rows[:, COL_TIME] > rows[-1, COL_TIME] - seconds]
+        return rows
+
+    def heading_sample(self):
+        return self._heading
+
+    def heading_status(self):
+        return self._heading + (False,)
+
+    def heading(self):
+        return self._heading[1]
+
+
+def serpentine(rows=3, row_length=20.0, row_spacing=4.0):
+    """Waypoints (x, y) in meters of a coverage path starting north from the origin."""
+    points = []
+    for row in range(rows):
+        x = row * row_spacing
+        ends = [(x, 0.0), (x, row_length)]
+        points.extend(ends if row % 2 == 0 else ends[::-1])
+    return points[1:]
+
+
+def path_samples(index, step=COVERAGE_STEP):
+    """Points every `step` meters along the path of a SegmentIndex, and the segment each lies on."""
+    progress = np.append(np.arange(0.0, index.length, step), index.length)
+    segment = np.clip(np.searchsorted(index.cumulative, progress, side='right') - 1, 0, len(index) - 1)
+    length = np.sqrt(index.length_sq[segment])
+    t = np.divide(progress - index.cumulative[segment], length, out=np.zeros_like(length), where=length > 0)
+    return index.start[segment] + np.clip(t, 0.0, 1.0)[:, None] * index.delta[segment], segment
+
+
+def track(index, point, last):
+    """
+    location() of `point` on the segments from the one of `last` (the
+    previous location, None at the start) up to TRACK_WINDOW meters of path
+    past it. The segment never goes back, and moves at most TRACK_WINDOW
+    meters of path per call.
+    """
+    segment, progress = (0, 0.0) if last is None else (last['segment'], last['progress'])
+    end = int(np.searchsorted(index.cumulative, progress + TRACK_WINDOW, side='right'))
+    segments = np.arange(segment, min(max(end, segment + 1), len(index)))
+    distance, t = index.project(point, segments)
+    k = int(np.argmin(distance))
+    return index.location(point, segments[k], distance[k], t[k])
+
+
+def simulate(waypoints, max_time=600.0, gps_rate=1.0, gps_noise=1.0, gps_latency=0.1,
+             imu_rate=50.0, accel_noise=0.05, heading_noise=1.0, max_speed=1.0,
+             start_heading=0.0, speed=None, seed=0):
+    """
+    Drives the robot from the origin along `waypoints` ((x, y) meters east/
+    north of it) with auto_navigation_process() and returns a report dict:
+    whether it arrived, mission and wall time, cross-track error of the true
+    position tracked along the planned path with track(), the share of the
+    path and the segments the robot came within COVERAGE_RADIUS of, and the
+    real compute time per navigation tick.
+    """
+    clock = SimClock(speed=speed)
+    projection = ENUProjection(REF_LAT, REF_LON)
+    robot = DiffDriveRobot(max_speed=max_speed, heading=start_heading)
+    gps = SimGPS(robot, clock, projection, gps_rate, gps_noise, gps_latency, seed=seed)
+    imu = SimIMU(robot, clock, imu_rate, accel_noise, heading_noise, seed=seed + 1)
+    client = LocalMQTT()
+    client.subscribe('robot/control', robot.on_command)
+    clock.world = [robot.step, imu.step, gps.step]
+
+    # Planned path as the navigator builds it: from the start through the waypoints
+    path_index = SegmentIndex(np.vstack([[0.0, 0.0], np.asarray(waypoints, dtype=float)]))
+    cross_track = []
+    pose_errors = []  # Navigator's pose against the true position, when it was sent
+    gps_errors = []   # Latest raw fix held, against the true position at the same moment
+    pose_jumps = []   # Distance between consecutive poses
+    samples, sample_segment = path_samples(path_index)
+    visited = np.zeros(len(samples), dtype=bool)
+    state = {'arrived_at': None, 'stats': None, 'pose': None, 'location': None}
+    stop_event = threading.Event()
+    pose_queue = queue.Queue()
+
+    # Wait for the first fix so the navigator starts from the robot's position
+    while gps.latest() is None:
+        clock.advance(clock.substep)
+    start = clock.monotonic()
+
+    def observe(now):
+        # Once per navigation tick, which sleeps once per tick
+        if len(path_index):
+            state['location'] = track(path_index, (robot.x, robot.y), state['location'])
+            if robot.speed != 0:
+                cross_track.append(state['location']['cross_track'])
+        visited[np.hypot(samples[:, 0] - robot.x, samples[:, 1] - robot.y) <= COVERAGE_RADIUS] = True
+        while not pose_queue.empty():
+            kind, data = pose_queue.get()
+            if kind == 'pose':
+                x, y = projection.to_xy(data['lat'], data['lon'])
+                pose_errors.append(math.hypot(x - robot.x, y - robot.y))
+                if state['pose'] is not None:
+                    pose_jumps.append(math.hypot(x - state['pose'][0], y - state['pose'][1]))
+                state['pose'] = (x, y)
+                fix = gps.latest()
+                if fix is not None:
+                    fix_x, fix_y = projection.to_xy(fix['lat'], fix['lon'])
+                    gps_errors.append(math.hypot(fix_x - robot.x, fix_y - robot.y))
+            elif kind == 'arrived':
+                state['arrived_at'] = data['timestamp']
+                stop_event.set()
+            elif kind == 'stats':
+                state['stats'] = data
+        if now - start > max_time:
+            stop_event.set()
+
+    clock.on_tick.append(observe)
+
+    command_queue = queue.Queue()
+    command_queue.put(('set_waypoints', [dict(zip(('lat', 'lng'), projection.to_latlon(x, y)))
+                                         for x, y in waypoints]))
+    wall_start = time.perf_counter()
+    nav.auto_navigation_process(command_queue, client, stop_event, sampler=imu, heading_source=imu,
+                                gps_source=gps, pose_queue=pose_queue, clock=clock)
+    wall_time = time.perf_counter() - wall_start
+
+    sim_time = clock.monotonic() - start
+    costs = np.array(clock.tick_costs) * 1000
+    errors = np.abs(cross_track) if cross_track else np.zeros(1)
+    final = np.asarray(waypoints[-1], dtype=float)
+    stats = state['stats'] or {}
+    pose_rms = float(np.sqrt(np.mean(np.square(pose_errors)))) if pose_errors else None
+    gps_rms = float(np.sqrt(np.mean(np.square(gps_errors)))) if gps_errors else None
+    return {
+        'arrived': state['arrived_at'] is not None,
+        'mission_time_s': state['arrived_at'] - start if state['arrived_at'] is not None else None,
+        'sim_time_s': sim_time,
+        'wall_time_s': wall_time,
+        'real_time_factor': sim_time / wall_time if wall_time > 0 else None,
+        'ticks': len(costs),
+        'tick_ms_mean': float(costs.mean()) if len(costs) else None,
+        'tick_ms_p95': float(np.percentile(costs, 95)) if len(costs) else None,
+        'tick_ms_max': float(costs.max()) if len(costs) else None,
+        'world_ms_per_tick': clock.world_time / max(len(costs), 1) * 1000,
+        'cross_track_rms_m': float(np.sqrt(np.mean(errors ** 2))),
+        'cross_track_max_m': float(errors.max()),
+        'final_error_m': float(np.hypot(robot.x - final[0], robot.y - final[1])),
+        'pose_rms_m': pose_rms,
+        'pose_jump_p99_m': float(np.percentile(pose_jumps, 99)) if pose_jumps else None,
+        'pose_jump_max_m': float(np.max(pose_jumps)) if pose_jumps else None,
+        'gps_rms_m': gps_rms,
+        'pose_filtered': pose_rms is not None and gps_rms is not None and pose_rms < gps_rms,
+        'coverage': float(visited.mean()),
+        'skipped_m': float(np.count_nonzero(~visited) * COVERAGE_STEP),
+        'missed_segments': sorted(set(range(len(path_index))) - set(sample_segment[visited].tolist())),
+        'commands': client.published,
+        'ekf_replays': stats.get('ekf_replays'),
+        'ekf_dropped': stats.get('ekf_dropped'),
+    }
+
+
+def parse_waypoints(text):
+    return [tuple(float(value) for value in point.split(',')) for point in text.split(';') if point.strip()]
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import logging
+    parser = argparse.ArgumentParser(description="Run auto navigation against a simulated robot")
+    parser.add_argument('--waypoints', type=parse_waypoints,
+                        help="x,y;x,y;... in meters east/north of the start (default: serpentine)")
+    parser.add_argument('--rows', type=int, default=3, help="serpentine rows")
+    parser.add_argument('--row-length', type=float, default=20.0)
+    parser.add_argument('--row-spacing', type=float, default=4.0)
+    parser.add_argument('--gps-rate', type=float, default=1.0, help="fixes per second")
+    parser.add_argument('--gps-noise', type=float, default=1.0, help="position noise per axis, meters")
+    parser.add_argument('--gps-latency', type=float, default=0.1, help="seconds")
+    parser.add_argument('--imu-rate', type=float, default=50.0)
+    parser.add_argument('--accel-noise', type=float, default=0.05, help="m/s^2")
+    parser.add_argument('--heading-noise', type=float, default=1.0, help="degrees")
+    parser.add_argument('--max-speed', type=float, default=1.0, help="wheel speed at full command, m/s")
+    parser.add_argument('--max-time', type=float, default=600.0, help="simulated seconds before giving up")
+    parser.add_argument('--speed', type=float, help="run at this multiple of real time (default: unthrottled)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-coverage', type=float, default=MIN_COVERAGE,
+                        help="fail below this fraction of the path visited (default: %(default)s)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="show the navigator's log")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    waypoints = args.waypoints or serpentine(args.rows, args.row_length, args.row_spacing)
+    report = simulate(waypoints, max_time=args.max_time, gps_rate=args.gps_rate, gps_noise=args.gps_noise,
+                      gps_latency=args.gps_latency, imu_rate=args.imu_rate, accel_noise=args.accel_noise,
+                      heading_noise=args.heading_noise, max_speed=args.max_speed, speed=args.speed,
+                      seed=args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        mission = f"{report['mission_time_s']:.1f} s" if report['arrived'] else "not reached"
+        print(f"mission: {mission}, {report['sim_time_s']:.1f} s simulated in {report['wall_time_s']:.2f} s "
+              f"({report['real_time_factor']:.0f}x real time)")
+        print(f"cross-track: rms {report['cross_track_rms_m']:.2f} m, max {report['cross_track_max_m']:.2f} m, "
+              f"final error {report['final_error_m']:.2f} m")
+        print(f"coverage: {report['coverage']:.1%} of the path within {COVERAGE_RADIUS} m, "
+              f"{report['skipped_m']:.1f} m skipped")
+        print(f"tick compute: mean {report['tick_ms_mean']:.2f} ms, p95 {report['tick_ms_p95']:.2f} ms, "
+              f"max {report['tick_ms_max']:.2f} ms over {report['ticks']} ticks; "
+              f"world {report['world_ms_per_tick']:.2f} ms/tick")
+        if report['pose_rms_m'] is not None and report['gps_rms_m'] is not None:
+            print(f"pose: rms {report['pose_rms_m']:.2f} m against {report['gps_rms_m']:.2f} m for the raw fix, "
+                  f"jumps p99 {report['pose_jump_p99_m']:.2f} m, max {report['pose_jump_max_m']:.2f} m")
+        if report['missed_segments']:
+            print(f"MISSED SEGMENTS: {report['missed_segments']} (never within {COVERAGE_RADIUS} m)")
+        if report['coverage'] < args.min_coverage:
+            print(f"COVERAGE BELOW {args.min_coverage:.0%}")
+        if not report['pose_filtered']:
+            print("POSE NOT BETTER THAN THE RAW FIX")
+    # A run that skips part of the path, or whose filter does worse than the
+    # raw GPS it is fed, is a failed run whatever the arrival says
+    ok = (report['arrived'] and not report['missed_segments'] and report['coverage'] >= args.min_coverage
+          and report['pose_filtered'])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,89 @@
+# projection.py
+
+import math
+from functools import lru_cache
+
+import numpy as np
+from pyproj import Transformer
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+# Fields that fit in this radius (meters) around the reference point use the
+# local tangent plane; the linearization error there stays at a few centimeters
+LOCAL_RADIUS = 2000.0
+
+
+@lru_cache(maxsize=None)
+def utm_transformers(zone_number, south):
+    """Cached (forward, inverse) lon/lat <-> UTM transformers for one zone."""
+    crs = f"EPSG:{(32700 if south else 32600) + zone_number}"
+    return (Transformer.from_crs("EPSG:4326", crs, always_xy=True),
+            Transformer.from_crs(crs, "EPSG:4326", always_xy=True))
+
+
+def utm_zone(lat, lon):
+    return int((lon + 180) / 6) + 1, lat < 0
+
+
+class UTMProjection:
+    """UTM meters for the zone of the reference point. Accepts scalars or arrays."""
+
+    def __init__(self, ref_lat, ref_lon):
+        self.zone_number, self.south = utm_zone(ref_lat, ref_lon)
+        self._forward, self._inverse = utm_transformers(self.zone_number, self.south)
+
+    def to_xy(self, lat, lon):
+        return self._forward.transform(lon, lat)
+
+    def to_latlon(self, x, y):
+        lon, lat = self._inverse.transform(x, y)
+        return lat, lon
+
+
+class ENUProjection:
+    """
+    East/north meters on the tangent plane at the reference point, using the
+    WGS84 radii of curvature there. Plain arithmetic, no pyproj calls.
+    Accepts scalars or arrays.
+    """
+
+    def __init__(self, ref_lat, ref_lon):
+        self.ref_lat = ref_lat
+        self.ref_lon = ref_lon
+        sin_lat = math.sin(math.radians(ref_lat))
+        w = 1 - WGS84_E2 * sin_lat ** 2
+        meridian_radius = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+        normal_radius = WGS84_A / math.sqrt(w)
+        self.meters_per_degree_lat = math.radians(meridian_radius)
+        self.meters_per_degree_lon = math.radians(normal_radius * math.cos(math.radians(ref_lat)))
+
+    def to_xy(self, lat, lon):
+        return ((lon - self.ref_lon) * self.meters_per_degree_lon,
+                (lat - self.ref_lat) * self.meters_per_degree_lat)
+
+    def to_latlon(self, x, y):
+        return (self.ref_lat + y / self.meters_per_degree_lat,
+                self.ref_lon + x / self.meters_per_degree_lon)
+
+
+def make_projection(ref_lat, ref_lon, latlon=None, local_radius=LOCAL_RADIUS):
+    """
+    Returns an ENUProjection when every (lat, lon) row of `latlon` lies within
+    local_radius meters of the reference point, otherwise a UTMProjection.
+    """
+    local = ENUProjection(ref_lat, ref_lon)
+    if latlon is not None and len(latlon):
+        latlon = np.asarray(latlon, dtype=float)
+        x, y = local.to_xy(latlon[:, 0], latlon[:, 1])
+        if np.max(np.hypot(x, y)) > local_radius:
+            return UTMProjection(ref_lat, ref_lon)
+    return local
+
+
+def to_xy_array(projection, latlon):
+    """Converts an (N, 2) array of (lat, lon) rows to an (N, 2) array of (x, y) in one call."""
+    latlon = np.asarray(latlon, dtype=float).reshape(-1, 2)
+    x, y = projection.to_xy(latlon[:, 0], latlon[:, 1])
+    return np.column_stack([x, y])
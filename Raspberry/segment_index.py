@@ -0,0 +1,73 @@
+# segment_index.py
+
+import math
+
+import numpy as np
+
+
+class SegmentIndex:
+    """
+    Segments of an (N, 2) path in meters, indexed by the distance along the
+    path to their start.
+
+    The navigator only ever looks at a window of segments in path order, so
+    a segment is found from a progress by a binary search over the
+    cumulative lengths; nothing is indexed spatially. Built once per
+    mission; the path must not change afterwards.
+    """
+
+    def __init__(self, path):
+        self.path = np.asarray(path, dtype=float).reshape(-1, 2)
+        self.start = self.path[:-1]
+        self.delta = self.path[1:] - self.start
+        self.length_sq = np.einsum('ij,ij->i', self.delta, self.delta)
+        lengths = np.sqrt(self.length_sq)
+        # Distance along the path to each vertex
+        self.cumulative = np.concatenate([[0.0], np.cumsum(lengths)])
+        self.length = float(self.cumulative[-1])
+
+    def __len__(self):
+        return len(self.start)
+
+    def project(self, point, segments):
+        """
+        Returns (distance, t) from `point` to each of the given segments, t
+        being the position of the closest point along the segment (0 to 1).
+        """
+        offset = np.asarray(point, dtype=float) - self.start[segments]
+        delta = self.delta[segments]
+        length_sq = self.length_sq[segments]
+        t = np.clip(np.einsum('ij,ij->i', offset, delta) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        closest = offset - t[:, None] * delta
+        return np.hypot(closest[:, 0], closest[:, 1]), t
+
+    def point_at(self, progress):
+        """Point `progress` meters along the path, clamped to its ends."""
+        if len(self) == 0:
+            return self.path[0].copy()
+        progress = min(max(progress, 0.0), self.length)
+        i = int(np.searchsorted(self.cumulative, progress, side='right')) - 1
+        i = min(max(i, 0), len(self) - 1)
+        t = (progress - self.cumulative[i]) / math.sqrt(self.length_sq[i]) if self.length_sq[i] > 0 else 0.0
+        return self.start[i] + t * self.delta[i]
+
+    def location(self, point, segment, distance, t):
+        """
+        Position of `point` given its closest segment, the distance to it and
+        the position t (0 to 1) of the closest point along it, as a dict with
+        the 'segment', the signed 'cross_track' error in meters (positive left
+        of the direction of travel), 'progress' along the path and
+        'remaining' to its end in meters.
+        """
+        segment = int(segment)
+        dx, dy = self.delta[segment]
+        px = point[0] - self.start[segment][0]
+        py = point[1] - self.start[segment][1]
+        side = dx * py - dy * px
+        progress = float(self.cumulative[segment] + t * math.sqrt(self.length_sq[segment]))
+        return {
+            'segment': segment,
+            'cross_track': float(distance) if side >= 0 else -float(distance),
+            'progress': progress,
+            'remaining': self.length - progress,
+        }
@@ -0,0 +1,80 @@
+# telemetry.py
+
+import json
+import threading
+import time
+
+_MISSING = object()
+
+
+class TelemetryHub:
+    """
+    Latest dashboard state (pose, heading, mode, e-stop, moisture, pumps...)
+    pushed to any number of Server-Sent Events clients.
+
+    Publishers call publish(key=value, ...) from any thread; only keys whose
+    value actually changed wake the clients. Each client sends at most one
+    event per min_interval seconds, and everything that changed in between is
+    coalesced into that event, so a slow or rate-limited client never queues
+    stale updates. The first event of a stream carries the whole state.
+    """
+
+    def __init__(self, min_interval=0.05, keepalive=15.0):
+        self.min_interval = min_interval
+        self.keepalive = keepalive  # Seconds between comments that detect closed connections
+        self._condition = threading.Condition()
+        self._state = {}
+        self._versions = {}  # Key -> version of its last change
+        self._version = 0
+        self.clients = 0
+
+    def publish(self, **fields):
+        with self._condition:
+            changed = False
+            for key, value in fields.items():
+                if self._state.get(key, _MISSING) != value:
+                    self._version += 1
+                    self._state[key] = value
+                    self._versions[key] = self._version
+                    changed = True
+            if changed:
+                self._condition.notify_all()
+
+    def snapshot(self):
+        with self._condition:
+            return dict(self._state)
+
+    def _changes(self, since):
+        return {key: self._state[key] for key, version in self._versions.items() if version > since}
+
+    def stream(self, min_interval=None):
+        """
+        Generator of text/event-stream chunks for one client. Each event's data
+        is a JSON object with the keys that changed since the previous event.
+        """
+        interval = self.min_interval if min_interval is None else min_interval
+        version = 0
+        last_sent = 0.0
+        with self._condition:
+            self.clients += 1
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._version > version, timeout=self.keepalive)
+                    pending = self._version > version
+                if not pending:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Rate limit; whatever changes while waiting goes out in this event
+                delay = last_sent + interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                with self._condition:
+                    changes = self._changes(version)
+                    version = self._version
+                last_sent = time.monotonic()
+                yield f"data: {json.dumps(changes)}\n\n"
+        finally:
+            with self._condition:
+                self.clients -= 1
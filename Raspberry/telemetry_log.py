@@ -0,0 +1,248 @@
+# telemetry_log.py
+#
+# Append-only binary telemetry log. Every channel is a file of fixed-size
+# NumPy records (<channel>.bin) with a JSON description of the record layout
+# (<channel>.json) and a sparse index of (wall time, record number) pairs
+# written every INDEX_EVERY records (<channel>.idx). Readers memory-map the
+# record file, so a query over days of data touches only the pages it needs.
+# When the wall clock steps back (an NTP sync on a Pi without an RTC) the
+# index starts a new segment, written as a repeated entry, so every segment
+# is sorted by wall time on its own.
+#
+# Summarize a channel, optionally for a time range (seconds since the epoch):
+#   python3 telemetry_log.py gps --start 1718000000 --end 1718003600
+
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+LOG_DIR = os.environ.get('TELEMETRY_LOG_DIR',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry_log'))
+
+# Every record starts with the time.monotonic() timestamp it was taken at and
+# the wall clock time it was written at
+RECORD_HEADER = [('time', '<f8'), ('wall', '<f8')]
+
+CHANNELS = {
+    'gps': np.dtype(RECORD_HEADER + [
+        ('lat', '<f8'),
+        ('lon', '<f8'),
+        ('mode', '<i4'),
+        ('hdop', '<f4'),
+        ('speed', '<f4'),
+        ('track', '<f4'),
+    ]),
+    'imu': np.dtype(RECORD_HEADER + [
+        ('acc', '<f4', (3,)),
+        ('gyr', '<f4', (3,)),
+        ('mag', '<f4', (3,)),
+    ]),
+    'heading': np.dtype(RECORD_HEADER + [
+        ('heading', '<f4'),
+    ]),
+    'commands': np.dtype(RECORD_HEADER + [
+        ('front', '<i2'),
+        ('side', '<i2'),
+    ]),
+}
+
+INDEX_DTYPE = np.dtype([('wall', '<f8'), ('record', '<i8')])
+INDEX_EVERY = 1024
+
+
+def _paths(directory, channel):
+    base = os.path.join(directory, channel)
+    return base + '.bin', base + '.idx', base + '.json'
+
+
+class _ChannelWriter:
+    def __init__(self, directory, channel, dtype):
+        self.dtype = dtype
+        data_path, index_path, header_path = _paths(directory, channel)
+        header = {'channel': channel, 'descr': dtype.descr, 'itemsize': dtype.itemsize}
+        try:
+            with open(header_path) as f:
+                existing = json.load(f)
+        except (OSError, ValueError):
+            existing = None
+        if existing is not None and existing.get('descr') != json.loads(json.dumps(dtype.descr)):
+            # Record layout changed; keep the old log next to the new one
+            suffix = time.strftime('%Y%m%d-%H%M%S')
+            for path in (data_path, index_path, header_path):
+                if os.path.exists(path):
+                    os.rename(path, f"{path}.{suffix}")
+            existing = None
+        if existing is None:
+            with open(header_path, 'w') as f:
+                json.dump(header, f)
+
+        self.data = open(data_path, 'ab')
+        self.index = open(index_path, 'ab')
+        # A crash can leave a partial record at the end; count whole records only
+        self.count = self.data.tell() // dtype.itemsize
+        if self.data.tell() % dtype.itemsize:
+            self.data.truncate(self.count * dtype.itemsize)
+            self.data.seek(0, os.SEEK_END)
+        # Wall time of the last record, to notice the clock stepping back
+        self.last_wall = -np.inf
+        if self.count:
+            self.last_wall = float(np.fromfile(data_path, dtype=dtype, count=1,
+                                               offset=(self.count - 1) * dtype.itemsize)['wall'][0])
+        self.record = np.zeros(1, dtype=dtype)
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class TelemetryLog:
+    """
+    Writes timestamped records to per-channel append-only files.
+    Writes are buffered and flushed at least every flush_interval seconds
+    (checked on the next write to the channel) and on close().
+    """
+
+    def __init__(self, directory=LOG_DIR, channels=CHANNELS, flush_interval=1.0):
+        self.directory = directory
+        self.channels = channels
+        self.flush_interval = flush_interval
+        self._writers = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _writer(self, channel):
+        writer = self._writers.get(channel)
+        if writer is None:
+            with self._lock:
+                writer = self._writers.get(channel)
+                if writer is None:
+                    writer = self._writers[channel] = _ChannelWriter(self.directory, channel,
+                                                                     self.channels[channel])
+        return writer
+
+    def log(self, channel, timestamp, **fields):
+        """
+        Appends one record; fields not given are written as zero.
+        Records logged after close() are dropped.
+        """
+        if self._closed:
+            return
+        writer = self._writer(channel)
+        with writer.lock:
+            record = writer.record
+            record.fill(0)
+            record['time'] = timestamp
+            wall = time.time()
+            record['wall'] = wall
+            for name, value in fields.items():
+                record[name] = value
+            try:
+                if writer.data.closed:
+                    return
+                stepped_back = wall < writer.last_wall
+                if writer.count % INDEX_EVERY == 0 or stepped_back:
+                    entry = np.array([(wall, writer.count)], dtype=INDEX_DTYPE).tobytes()
+                    # A repeated entry starts a new segment
+                    writer.index.write(entry * 2 if stepped_back else entry)
+                writer.data.write(record.tobytes())
+                writer.count += 1
+                writer.last_wall = wall
+                if timestamp - writer.last_flush >= self.flush_interval:
+                    writer.data.flush()
+                    writer.index.flush()
+                    writer.last_flush = timestamp
+            except OSError as e:
+                logging.error(f"Telemetry log write to {channel} failed: {e}")
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for writer in self._writers.values():
+                with writer.lock:
+                    writer.data.close()
+                    writer.index.close()
+            self._writers = {}
+
+
+def open_channel(channel, directory=LOG_DIR):
+    """
+    Memory-maps a channel's records read-only as a structured array (empty if
+    the channel has no records yet).
+    """
+    data_path, index_path, header_path = _paths(directory, channel)
+    with open(header_path) as f:
+        header = json.load(f)
+    dtype = np.dtype([tuple(field) for field in header['descr']])
+    count = os.path.getsize(data_path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(data_path, dtype=dtype, mode='r', shape=(count,))
+
+
+def load_index(channel, directory=LOG_DIR):
+    data_path, index_path, header_path = _paths(directory, channel)
+    try:
+        return np.fromfile(index_path, dtype=INDEX_DTYPE)
+    except OSError:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+
+def query(channel, start=None, end=None, directory=LOG_DIR):
+    """
+    Returns the records with start <= wall < end in the order they were
+    written, as a memory-mapped view. The index narrows the search to one
+    INDEX_EVERY block at each end, so only a few pages of the record file are
+    read. If the wall clock stepped back, each index segment is searched on its
+    own and the matches of several segments are joined into a copy.
+    """
+    records = open_channel(channel, directory)
+    index = load_index(channel, directory)
+
+    def locate(entries, low, high, wall):
+        block = np.searchsorted(entries['wall'], wall, side='right') - 1
+        if block >= 0:
+            low = int(entries['record'][block])
+        if block + 1 < len(entries):
+            high = min(high, int(entries['record'][block + 1]) + 1)
+        return low + int(np.searchsorted(records['wall'][low:high], wall))
+
+    # Segment k is index[bounds[k]:bounds[k + 1] - 1]; the entry before each repeat is its twin
+    repeats = np.flatnonzero(index['record'][1:] == index['record'][:-1]) + 1
+    bounds = [0] + repeats.tolist() + [len(index) + 1]
+    views = []
+    for k in range(len(bounds) - 1):
+        entries = index[bounds[k]:bounds[k + 1] - 1]
+        low = int(index['record'][bounds[k]]) if k else 0
+        high = int(index['record'][bounds[k + 1]]) if k + 2 < len(bounds) else len(records)
+        high = min(high, len(records))
+        first = low if start is None else locate(entries, low, high, start)
+        last = high if end is None else locate(entries, low, high, end)
+        if first < last:
+            views.append(records[first:last])
+
+    if not views:
+        return records[:0]
+    if len(views) == 1:
+        return views[0]
+    return np.concatenate(views)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize a telemetry log channel")
+    parser.add_argument('channel', choices=sorted(CHANNELS))
+    parser.add_argument('--start', type=float, help="Wall clock start, seconds since the epoch")
+    parser.add_argument('--end', type=float, help="Wall clock end, seconds since the epoch")
+    parser.add_argument('--dir', default=LOG_DIR)
+    args = parser.parse_args()
+
+    records = query(args.channel, args.start, args.end, args.dir)
+    print(f"{args.channel}: {len(records)} records")
+    if len(records):
+        print(f"  from {time.ctime(records['wall'][0])} to {time.ctime(records['wall'][-1])}")
+        for name in records.dtype.names[2:]:
+            values = np.asarray(records[name], dtype=float)
+            print(f"  {name}: mean {np.nanmean(values, axis=0)}")
@@ -0,0 +1,165 @@
+# track_simplify.py
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from track_store import TRACK_DTYPE
+
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+# Web Mercator ground resolution at zoom 0 on the equator, meters per pixel
+EQUATOR_METERS_PER_PIXEL = 156543.03392
+
+
+def zoom_tolerance(zoom, lat, pixels=1.0):
+    """Ground distance in meters covered by `pixels` screen pixels at a Leaflet zoom level."""
+    return pixels * EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def display_coordinates(points):
+    """The coordinates the map draws: the estimate where there is one, else the GPS fix."""
+    lat = np.where(np.isnan(points['est_lat']) | (points['est_lat'] == 0), points['lat'], points['est_lat'])
+    lon = np.where(np.isnan(points['est_lon']) | (points['est_lon'] == 0), points['lon'], points['est_lon'])
+    return lat, lon
+
+
+def douglas_peucker(xy, tolerance):
+    """
+    Douglas-Peucker simplification of an (N, 2) array of planar points.
+    Returns a boolean mask of the points to keep; the end points are always
+    kept and every dropped point is within `tolerance` of the kept polyline.
+    """
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = xy[start]
+        ab = xy[end] - a
+        ap = xy[start + 1:end] - a
+        length_sq = ab @ ab
+        if length_sq == 0:
+            distances = np.hypot(ap[:, 0], ap[:, 1])
+        else:
+            # Distance to the segment, not the infinite line, so a track that
+            # doubles back on itself is not collapsed
+            t = np.clip(ap @ ab / length_sq, 0.0, 1.0)
+            offset = ap - t[:, None] * ab
+            distances = np.hypot(offset[:, 0], offset[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+class _Level:
+    """Simplified track for one tolerance."""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.final = np.zeros(0, dtype=TRACK_DTYPE)  # Vertices that no longer change
+        self.tail = np.zeros(0, dtype=TRACK_DTYPE)   # Raw points after the last final vertex
+        self.tail_vertices = self.tail
+        self.last_seq = -1
+
+
+class TrackSimplifier:
+    """
+    Level-of-detail view of a TrackStore for the map.
+
+    Each tolerance level is simplified incrementally: only the points after the
+    last settled vertex (the tail) are re-simplified when new points arrive.
+    Vertices before the last two DP vertices of the tail are settled and never
+    recomputed, and a tail longer than max_tail is settled whole, so each
+    update costs O(new points + max_tail). Up to max_levels levels are cached.
+    """
+
+    def __init__(self, store, max_levels=8, max_tail=512):
+        self.store = store
+        self.max_levels = max_levels
+        self.max_tail = max_tail
+        self._levels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _level(self, key, tolerance):
+        level = self._levels.get(key)
+        if level is None:
+            level = self._levels[key] = _Level(tolerance)
+            if len(self._levels) > self.max_levels:
+                self._levels.popitem(last=False)
+        self._levels.move_to_end(key)
+        return level
+
+    def _update(self, level):
+        points, cursor, reset = self.store.changes(level.last_seq)
+        if reset:
+            # The store spilled points this level had not seen; keep the same window
+            if len(points):
+                level.final = level.final[level.final['seq'] >= points['seq'][0]]
+            points = points[points['seq'] > level.last_seq]
+        if not len(points):
+            level.last_seq = cursor
+            return
+        level.tail = np.concatenate([level.tail, points])
+        level.last_seq = cursor
+
+        lat, lon = display_coordinates(level.tail)
+        cos_lat = math.cos(math.radians(lat[0]))
+        xy = np.column_stack([(lon - lon[0]) * cos_lat * METERS_PER_DEGREE_LON,
+                              (lat - lat[0]) * METERS_PER_DEGREE_LAT])
+        keep = np.flatnonzero(douglas_peucker(xy, level.tolerance))
+
+        # The tail always starts at the last final vertex (or the first point),
+        # which is already in level.final except on the very first update
+        if len(level.tail) > self.max_tail:
+            settle = len(keep) - 1
+        else:
+            settle = len(keep) - 2
+        if settle > 0:
+            settled = level.tail[keep[:settle + 1]]
+            if len(level.final) and settled['seq'][0] == level.final['seq'][-1]:
+                settled = settled[1:]
+            level.final = np.concatenate([level.final, settled])
+            level.tail = level.tail[keep[settle]:]
+            keep = keep[settle:] - keep[settle]
+        level.tail_vertices = level.tail[keep]
+
+    def changes(self, since, tolerance=None, zoom=None):
+        """
+        Returns (points, tail, cursor, reset) for the level given by `tolerance`
+        in meters or by a Leaflet `zoom` level. points are the settled vertices
+        after the client's cursor `since` (all of them when reset is true), tail
+        the provisional vertices after them, which replace the previous tail.
+        cursor is the seq of the last settled vertex.
+        """
+        with self._lock:
+            if zoom is not None:
+                latest = self.store.latest()
+                lat = display_coordinates(latest)[0] if latest is not None else 0.0
+                key = ('zoom', int(zoom))
+                tolerance = zoom_tolerance(int(zoom), float(lat))
+            else:
+                key = ('tolerance', float(f"{tolerance:.2g}"))
+            level = self._level(key, tolerance)
+            self._update(level)
+
+            final = level.final
+            tail = level.tail_vertices
+            if len(final) and len(tail) and tail['seq'][0] == final['seq'][-1]:
+                tail = tail[1:]
+            cursor = int(final['seq'][-1]) if len(final) else -1
+            index = np.searchsorted(final['seq'], since)
+            reset = not (index < len(final) and final['seq'][index] == since)
+            points = final if reset else final[index + 1:]
+            return points.copy(), tail.copy(), cursor, reset
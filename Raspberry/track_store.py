@@ -0,0 +1,186 @@
+# track_store.py
+
+import glob
+import logging
+import math
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+TRACK_DIR = os.environ.get('TRACK_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'track_segments'))
+
+# One row per stored track point; estimated pose fields are NaN until the
+# navigation filter reports them
+TRACK_DTYPE = np.dtype([
+    ('seq', np.int64),
+    ('time', np.float64),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('heading', np.float64),
+    ('est_lat', np.float64),
+    ('est_lon', np.float64),
+    ('est_theta', np.float64),
+])
+
+
+def _same(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+class TrackStore:
+    """
+    Bounded GPS track backed by a preallocated NumPy record array.
+
+    Points that repeat the previous position, estimate and (within
+    min_heading_change degrees) heading are dropped. When the array fills up,
+    the older half is written to spill_dir as one .npy segment and the rest is
+    moved down, so memory stays at `capacity` rows however long the robot runs.
+    Every point gets an increasing sequence number that survives spills.
+    """
+
+    def __init__(self, capacity=20000, spill_dir=TRACK_DIR, min_heading_change=1.0):
+        self.capacity = int(capacity)
+        self.spill_dir = spill_dir
+        self.min_heading_change = min_heading_change
+        self._points = np.zeros(self.capacity, dtype=TRACK_DTYPE)
+        self._size = 0
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        # Sequence numbers restart every run, so segment names and cursors carry the start time
+        self.run = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    @property
+    def last_seq(self):
+        """Sequence number of the newest point, or -1 if nothing was stored."""
+        with self._lock:
+            return self._next_seq - 1
+
+    def _is_duplicate(self, lat, lon, heading, est_lat, est_lon, est_theta):
+        if self._size == 0:
+            return False
+        last = self._points[self._size - 1]
+        if not (_same(last['lat'], lat) and _same(last['lon'], lon) and
+                _same(last['est_lat'], est_lat) and _same(last['est_lon'], est_lon) and
+                _same(last['est_theta'], est_theta)):
+            return False
+        heading_change = abs((heading - last['heading'] + 180.0) % 360.0 - 180.0)
+        return heading_change < self.min_heading_change
+
+    def append(self, timestamp, lat, lon, heading,
+               est_lat=math.nan, est_lon=math.nan, est_theta=math.nan):
+        """
+        Stores one point and returns its sequence number, or None if it
+        duplicates the previous point.
+        """
+        with self._lock:
+            if self._is_duplicate(lat, lon, heading, est_lat, est_lon, est_theta):
+                return None
+            if self._size == self.capacity:
+                self._spill()
+            seq = self._next_seq
+            self._points[self._size] = (seq, timestamp, lat, lon, heading, est_lat, est_lon, est_theta)
+            self._size += 1
+            self._next_seq += 1
+            return seq
+
+    def _spill(self):
+        half = self.capacity // 2
+        segment = self._points[:half]
+        if self.spill_dir:
+            path = os.path.join(self.spill_dir, f"track_{self.run}_{segment['seq'][0]:012d}_{segment['seq'][-1]:012d}.npy")
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                np.save(path, segment)
+            except OSError as e:
+                logging.error(f"Could not spill track segment to {path}: {e}")
+        self._points[:self._size - half] = self._points[half:self._size]
+        self._size -= half
+
+    def points(self, since=None):
+        """
+        Returns a copy of the in-memory points with seq greater than `since`
+        (all of them if since is None), oldest first.
+        """
+        with self._lock:
+            points = self._points[:self._size]
+            if since is not None:
+                start = np.searchsorted(points['seq'], since, side='right')
+                points = points[start:]
+            return points.copy()
+
+    def cursor(self, seq):
+        """Encodes seq as a client cursor, '<run>:<seq>'."""
+        return f"{self.run}:{seq}"
+
+    def parse_cursor(self, cursor):
+        """
+        Returns the seq in a cursor made by cursor(), or None if the cursor is
+        from another run or malformed. A bare '-1' (nothing seen yet) is
+        accepted from any client.
+        """
+        run, _, seq = str(cursor).rpartition(':')
+        if run not in (self.run, '') or (not run and seq != '-1'):
+            return None
+        try:
+            return int(seq)
+        except ValueError:
+            return None
+
+    def changes(self, since):
+        """
+        Returns (points, cursor, reset) for a client that has seen everything
+        up to seq `since`. cursor is the seq to pass next time. reset is True
+        when the client must replace its copy with points instead of appending,
+        because `since` is past the newest point or points it has not seen were
+        spilled to disk. Cursors from another run are caught by parse_cursor().
+        """
+        with self._lock:
+            points = self._points[:self._size]
+            cursor = self._next_seq - 1
+            first = points['seq'][0] if self._size else self._next_seq
+            reset = since > cursor or since < first - 1
+            if not reset:
+                points = points[np.searchsorted(points['seq'], since, side='right'):]
+            return points.copy(), cursor, reset
+
+    def latest(self):
+        """Returns the newest point as a record, or None."""
+        with self._lock:
+            if self._size == 0:
+                return None
+            return self._points[self._size - 1].copy()
+
+
+def load_segments(spill_dir=TRACK_DIR, run='*'):
+    """
+    Reads the spilled segments of one run (its start time as YYYYmmdd-HHMMSS)
+    or of all runs back into one array, oldest first.
+    """
+    paths = sorted(glob.glob(os.path.join(spill_dir, f'track_{run}_*.npy')))
+    if not paths:
+        return np.zeros(0, dtype=TRACK_DTYPE)
+    return np.concatenate([np.load(path) for path in paths])
+
+
+def to_json_points(points):
+    """
+    Converts track records to the /get_gps_data point format, with missing
+    estimates reported as 0 like the original list of dicts.
+    """
+    columns = [np.nan_to_num(points[field], nan=0.0).tolist()
+               for field in ('lat', 'lon', 'heading', 'est_lat', 'est_lon', 'est_theta')]
+    return [{
+        'GPS_Lat': lat,
+        'GPS_Lon': lon,
+        'Heading': heading,
+        'Estimated_Lat': est_lat,
+        'Estimated_Lon': est_lon,
+        'Estimated_Theta': est_theta,
+    } for lat, lon, heading, est_lat, est_lon, est_theta in zip(*columns)]